@@ -1,12 +1,35 @@
+import functools
+
 from flask import Flask
 from flask_cors import CORS
 from app.api.user_routes import user_bp
 from app.api.timetable_routes import timeTable_bp
 from app.api.attendance_routes import attendance_bp
+from app.api.notification_routes import notification_bp
+from app.api.faq_routes import faq_bp
+from app.api.chat_routes import chat_bp
+from app.api.metrics_routes import metrics_bp
 from app.core.config import Config
+from app.core.metrics import init_metrics
+from app.core.query_audit import init_query_audit
+from app.core.realtime import init_realtime
+from app.core.commands import register_commands
+from app.core.scheduler import init_scheduler
+from app.core.prefork import add_post_fork_hook, reset_process_state, run_hooks_on_first_request
+from app.utility.db.db_entry import warm_entry_index
+from app.utility.db.db_faq import refresh_faq_index
+from app.utility.chat.chat_service import seed_answer_cache
+from app.utility.journal.entry_journal import entry_journal
 
 
-def create_app():
+def create_app(prefork=False):
+    """
+    prefork=True はプリフォーク型サーバー（serve.py / gunicorn）用。
+    マスタープロセスではDBに接続せず、入構索引の読み込みとスケジューラーの起動は
+    fork 後の各ワーカーで run_post_fork_hooks(app) から行う
+    prefork=False（flask run / flask の CLI コマンド）では最初のリクエストの前に行うので、
+    CLI コマンドでは索引の読み込みもスケジューラーの起動もしない
+    """
     app = Flask(__name__)
     
     # 設定を読み込む
@@ -14,9 +37,10 @@ def create_app():
 
     # --- ① CORSをグローバルで先に適用 ---
     # 全エンドポイントでCORSを許可（特にlocalhost環境）
+    origins = ["http://localhost","http://localhost:3000", "http://127.0.0.1:3000"]
     CORS(
         app,
-        origins=["http://localhost","http://localhost:3000", "http://127.0.0.1:3000"],
+        origins=origins,
         supports_credentials=True,
         allow_headers=["Content-Type", "Authorization"],
         methods=["GET", "POST", "OPTIONS"]
@@ -28,5 +52,40 @@ def create_app():
     app.register_blueprint(user_bp, url_prefix="/api/users")
     app.register_blueprint(timeTable_bp, url_prefix="/api/timetables")
     app.register_blueprint(attendance_bp, url_prefix="/api/attendance")
+    app.register_blueprint(notification_bp, url_prefix="/api/notifications")
+    app.register_blueprint(faq_bp, url_prefix="/api/faq")
+    app.register_blueprint(chat_bp, url_prefix="/api/chat")
+    app.register_blueprint(metrics_bp)
+
+    # --- ③ DB計測（/metrics と Server-Timing ヘッダー） ---
+    init_metrics(app)
+    # 開発・CI用のクエリ監査（QUERY_AUDIT_ENABLED=true のときだけ記録する）
+    init_query_audit(app)
+
+    # --- ④ Socket.IO（/live 名前空間で出席・入構イベントを配信） ---
+    init_realtime(app, origins)
+
+    # --- ⑤ 当日の入構記録索引・FAQ 検索索引・チャット回答キャッシュを温める（失敗しても初回利用時に再試行される） ---
+    # --- ⑥ 出席の締め処理ジョブ（プリフォーク時は1ワーカーだけで動かす） ---
+    # 入構ログをジャーナル経由で書く場合は、ライターを起動して前回終了時に未反映だった分を引き取る
+    if prefork:
+        add_post_fork_hook(app, reset_process_state)
+        add_post_fork_hook(app, warm_entry_index)
+        add_post_fork_hook(app, refresh_faq_index)
+        add_post_fork_hook(app, seed_answer_cache)
+        if Config.ENTRY_WRITE_MODE == "journal":
+            add_post_fork_hook(app, entry_journal.start)
+        add_post_fork_hook(app, functools.partial(init_scheduler, app, exclusive=True))
+    else:
+        add_post_fork_hook(app, warm_entry_index)
+        add_post_fork_hook(app, refresh_faq_index)
+        add_post_fork_hook(app, seed_answer_cache)
+        if Config.ENTRY_WRITE_MODE == "journal":
+            add_post_fork_hook(app, entry_journal.start)
+        add_post_fork_hook(app, functools.partial(init_scheduler, app))
+        run_hooks_on_first_request(app)
+
+    # --- ⑦ flask コマンド（migrate / explain-check / query-audit など） ---
+    register_commands(app)
 
     return app
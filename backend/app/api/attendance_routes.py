@@ -1,14 +1,25 @@
-from flask import request, jsonify,Blueprint
+from flask import request, jsonify,Blueprint, Response
 
 import datetime
+import hmac
+import json
+import zlib
 import app.utility.db.db_user as db_user
 import app.utility.db.db_entry as db_entry
 import app.utility.db.db_attendance as db_attendance
-import app.utility.db.db_timetable as db_timetable
+from app.utility.auth.jwt import decode_access_token
+from app.core.query_audit import query_budget
+from app.core.realtime import emit_attendance, emit_entry
+from app.core.config import Config
+import app.utility.journal.entry_journal as entry_journal
+from app.utility.cache.entry_index import entry_index
+from app.utility.export import attendance_export
+from app.utility.report import attendance_report
 
 attendance_bp = Blueprint('attendance', __name__)
 
 @attendance_bp.route('/attend', methods=['POST'])
+@query_budget(4)
 def attend():
     data = request.get_json()
     if not data or 'user_id' not in data or 'timetable_id' not in data:
@@ -17,25 +28,23 @@ def attend():
     user_id = data['user_id']
     timetable_id = data['timetable_id']
     
-    # 1. Get registered cards
-    cards = db_user.get_user_cards(user_id)
-    if not cards:
+    # 1. Get registered cards / timetable start in one query, recent entry from the in-process index
+    #    (entry_logs is queried only when the index has no recent tap for the user's cards)
+    context = db_entry.get_recent_entry_for_user(user_id, timetable_id)
+    if context is None:
+        return jsonify({'message': 'Failed to check entry records'}), 500
+
+    if not context['card_count']:
         return jsonify({'message': 'No cards registered for this user'}), 400
         
     # 2. Check entry logs
-    entry_time = None
-    for card in cards:
-        idm = card['felica_idm']
-        entry_time = db_entry.check_recent_entry(idm)
-        if entry_time:
-            break
-            
+    entry_time = context['entered_at']
     if not entry_time:
         return jsonify({'message': 'No recent entry record found'}), 403
         
     # 3. Determine Status
     status = '出席'
-    timetable = db_timetable.get_timetable_by_id(timetable_id)
+    timetable = context if context['date'] else None
     
     if timetable:
         try:
@@ -69,11 +78,13 @@ def attend():
             
     # 4. Register attendance
     if db_attendance.register_attendance(user_id, timetable_id, status):
+        emit_attendance(user_id, timetable_id, status)
         return jsonify({'message': 'Attendance registered successfully', 'status': status}), 200
     else:
         return jsonify({'message': 'Failed to register attendance'}), 500
 
 @attendance_bp.route('/status', methods=['POST'])
+@query_budget(3)
 def update_status():
     data = request.get_json()
     if not data or 'user_id' not in data or 'timetable_id' not in data or 'status' not in data:
@@ -89,23 +100,200 @@ def update_status():
         return jsonify({'message': 'Invalid status'}), 400
         
     if db_attendance.update_attendance_status(user_id, timetable_id, status, reason):
+        emit_attendance(user_id, timetable_id, status)
         return jsonify({'message': 'Status updated successfully'}), 200
     else:
         return jsonify({'message': 'Failed to update status'}), 500
 
+@attendance_bp.route('/roll_call', methods=['POST'])
+@query_budget(5)
+def roll_call():
+    """
+    教員用: クラス全員分の出席ステータスを1リクエスト・1トランザクションで更新する
+    Body:
+      {"timetable_id": 1, "records": [{"user_id": 1, "status": "出席", "reason": null}, ...]}
+      または {"slots": [{"timetable_id": 1, "records": [...]}, ...]}
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    payload = decode_access_token(auth_header.split(' ')[1])
+    if not payload:
+        return jsonify({'message': 'Invalid or expired token'}), 401
+    if not payload.get('isTeacher'):
+        return jsonify({'message': 'Teacher permission required'}), 403
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'message': 'Request body is required'}), 400
+
+    slots = data.get('slots')
+    if slots is None:
+        slots = [{'timetable_id': data.get('timetable_id'), 'records': data.get('records')}]
+    if not isinstance(slots, list):
+        return jsonify({'message': 'slots must be a list'}), 400
+
+    allowed_statuses = ['出席', '欠席', '遅刻', '早退', '公欠']
+    records = []
+    for slot in slots:
+        if not isinstance(slot, dict) or slot.get('timetable_id') is None or not isinstance(slot.get('records'), list):
+            return jsonify({'message': 'Each slot needs timetable_id and records'}), 400
+        for record in slot['records']:
+            if not isinstance(record, dict) or 'user_id' not in record or 'status' not in record:
+                return jsonify({'message': 'Each record needs user_id and status'}), 400
+            if record['status'] not in allowed_statuses:
+                return jsonify({'message': 'Invalid status', 'user_id': record['user_id']}), 400
+            try:
+                records.append((int(record['user_id']), int(slot['timetable_id']), record['status'], record.get('reason')))
+            except (TypeError, ValueError):
+                return jsonify({'message': 'user_id and timetable_id must be integers'}), 400
+
+    result = db_attendance.bulk_update_attendance(records)
+    if result is None:
+        return jsonify({'message': 'Failed to update roll call'}), 500
+
+    for user_id, timetable_id, status, _ in records:
+        emit_attendance(user_id, timetable_id, status)
+
+    return jsonify({'message': 'Roll call updated successfully', **result}), 200
+
 @attendance_bp.route('/entry', methods=['POST'])
+@query_budget(2)
 def record_entry():
     data = request.get_json()
     if not data or 'idm' not in data:
         return jsonify({'message': 'IDm is required'}), 400
     
     idm = data['idm']
-    if db_entry.add_entry_log(idm):
+    if not entry_journal.valid_idm(idm):
+        return jsonify({'message': 'IDm must be a string of up to 16 characters'}), 400
+    if Config.ENTRY_WRITE_MODE == 'journal':
+        # ジャーナルに追記して即応答（entry_logs への反映はバックグラウンド）
+        recorded = entry_journal.record_entry(idm)
+    else:
+        recorded = db_entry.add_entry_log(idm)
+
+    if recorded:
+        emit_entry(idm)
         return jsonify({'message': 'Entry recorded successfully'}), 200
     else:
         return jsonify({'message': 'Failed to record entry'}), 500
 
+def _device_authorized():
+    if not Config.DEVICE_SYNC_TOKEN:
+        return True
+    token = request.headers.get('X-Device-Token') or ''
+    return hmac.compare_digest(token, Config.DEVICE_SYNC_TOKEN)
+
+def _load_sync_body():
+    """
+    リクエストボディを JSON として読む（Content-Encoding: gzip / deflate に対応）
+    展開後のサイズは DEVICE_SYNC_MAX_BYTES までに制限する。読めなければ None
+    """
+    body = request.get_data(cache=False)
+    encoding = (request.headers.get('Content-Encoding') or '').lower()
+    try:
+        if encoding in ('gzip', 'deflate'):
+            # wbits=47 で gzip / zlib のどちらのヘッダーも自動判別する
+            decompressor = zlib.decompressobj(47)
+            body = decompressor.decompress(body, Config.DEVICE_SYNC_MAX_BYTES + 1)
+        elif encoding not in ('', 'identity'):
+            return None
+        if len(body) > Config.DEVICE_SYNC_MAX_BYTES:
+            return None
+        return json.loads(body)
+    except (zlib.error, ValueError):
+        return None
+
+def _parse_sync_record(item, latest_allowed):
+    """
+    {"seq": 連番, "idm": "...", "at": "ISO 8601"} を (連番, IDm, 時刻) にする
+    連番が読めなければ None。IDm・時刻が不正な記録は時刻を None にして返す（連番だけ進めて捨てる）
+    """
+    if not isinstance(item, dict):
+        return None
+    sequence = item.get('seq')
+    if not isinstance(sequence, int) or isinstance(sequence, bool) or sequence <= 0:
+        return None
+
+    idm = item.get('idm')
+    try:
+        entered_at = datetime.datetime.fromisoformat(item.get('at'))
+    except (TypeError, ValueError):
+        return sequence, idm, None
+    if entered_at.tzinfo is not None:
+        entered_at = entered_at.astimezone().replace(tzinfo=None)
+    entered_at = entered_at.replace(microsecond=0)
+    if not entry_journal.valid_idm(idm) or entered_at > latest_allowed:
+        return sequence, idm, None
+    return sequence, idm, entered_at
+
+@attendance_bp.route('/entry/sync', methods=['POST'])
+@query_budget(5)
+def sync_entries():
+    """
+    入構端末がためておいたタッチ記録をまとめて送る
+    Body（gzip 圧縮可）: {"device_id": "...", "records": [{"seq": 1, "idm": "...", "at": "2024-04-01T08:50:00"}, ...]}
+    seq は端末ごとに単調増加する連番。応答の high_water_mark 以下の記録は再送しても無視されるので、
+    端末は応答を受け取るまで記録を消さずに何度でも送り直してよい
+    """
+    if not _device_authorized():
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    data = _load_sync_body()
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Invalid request body'}), 400
+
+    device_id = data.get('device_id')
+    if not isinstance(device_id, str) or not 0 < len(device_id) <= 50:
+        return jsonify({'message': 'device_id is required'}), 400
+
+    items = data.get('records')
+    if not isinstance(items, list):
+        return jsonify({'message': 'records must be a list'}), 400
+    if len(items) > Config.DEVICE_SYNC_MAX_RECORDS:
+        return jsonify({'message': f'At most {Config.DEVICE_SYNC_MAX_RECORDS} records per request'}), 413
+
+    latest_allowed = entry_index.now() + datetime.timedelta(seconds=Config.DEVICE_SYNC_MAX_SKEW_SECONDS)
+    records = []
+    for i, item in enumerate(items):
+        record = _parse_sync_record(item, latest_allowed)
+        if record is None:
+            return jsonify({'message': f'records[{i}].seq must be a positive integer'}), 400
+        records.append(record)
+
+    # 一括反映は既に DB 往復がまとまっているので、ENTRY_WRITE_MODE に関係なく直接書く
+    result = db_entry.sync_device_entries(device_id, records)
+    if result is None:
+        return jsonify({'message': 'Failed to sync entries'}), 500
+
+    for idm, entered_at in result.pop('entered'):
+        emit_entry(idm, entered_at)
+
+    return jsonify({'device_id': device_id, **result}), 200
+
+@attendance_bp.route('/entry/sync', methods=['GET'])
+@query_budget(1)
+def get_sync_state():
+    """
+    端末の反映済み連番を返す（端末の再起動後、どこから送り直すか決めるのに使う）
+    Query: device_id
+    """
+    if not _device_authorized():
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    device_id = request.args.get('device_id')
+    if not device_id:
+        return jsonify({'message': 'device_id is required'}), 400
+
+    high_water_mark = db_entry.get_device_high_water_mark(device_id)
+    if high_water_mark is None:
+        return jsonify({'message': 'Failed to get sync state'}), 500
+    return jsonify({'device_id': device_id, 'high_water_mark': high_water_mark}), 200
+
 @attendance_bp.route('/register_card', methods=['POST'])
+@query_budget(2)
 def register_card():
     data = request.get_json()
     if not data or 'idm' not in data or 'student_id' not in data:
@@ -124,6 +312,7 @@ def register_card():
         return jsonify({'message': 'Failed to register card'}), 500
 
 @attendance_bp.route('/summary', methods=['GET'])
+@query_budget(3)
 def get_summary():
     user_id = request.args.get('user_id')
     if not user_id:
@@ -131,23 +320,10 @@ def get_summary():
         
     summary = db_attendance.get_attendance_summary(user_id)
     if summary is not None:
-        # Calculate Attendance Rate
-        # Rate = (Attendance Count) / (Total - Public Absent) * 100
-        # Attendance Count = Present + Late + Early = (Total - Public Absent) - Absent
-        total = summary['total']
-        absent = summary['欠席']
-        public_absent = summary['公欠']
-        
-        denom = total - public_absent
-        rate = 0
-        
-        if denom > 0:
-            rate = (denom - absent) / denom * 100
-        elif total > 0:
-            # If all classes are Public Absence, treat as 100% attendance (no unauthorized absence)
-            rate = 100.0
-            
-        summary['attendance_rate'] = round(rate, 1)
+        # Calculate Attendance Rate (式は attendance_report.attendance_rate を参照)
+        summary['attendance_rate'] = attendance_report.attendance_rate(
+            summary['total'], summary['欠席'], summary['公欠'], summary['遅刻'], summary['早退']
+        )
 
         # Get Subject Summary
         subject_summary = db_attendance.get_subject_attendance_summary(user_id)
@@ -181,3 +357,104 @@ def get_summary():
         return jsonify(summary), 200
     else:
         return jsonify({'message': 'Failed to get summary'}), 500
+
+@attendance_bp.route('/export', methods=['GET'])
+@query_budget(2)
+def export_attendance():
+    """
+    教員用: クラスの期間内の出席を授業コマ × 学生の1行ずつ出力する（読みながら送るので件数が多くてもメモリは一定）
+    Query: class_id, start_date, end_date (YYYY-MM-DD), format (csv | parquet、既定は csv)
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    payload = decode_access_token(auth_header.split(' ')[1])
+    if not payload:
+        return jsonify({'message': 'Invalid or expired token'}), 401
+    if not payload.get('isTeacher'):
+        return jsonify({'message': 'Teacher permission required'}), 403
+
+    try:
+        class_id = int(request.args['class_id'])
+        start_date = datetime.datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify({'message': 'class_id, start_date and end_date (YYYY-MM-DD) are required'}), 400
+    if end_date < start_date or (end_date - start_date).days >= Config.EXPORT_MAX_DAYS:
+        return jsonify({'message': f'Date range must be 1 to {Config.EXPORT_MAX_DAYS} days'}), 400
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'parquet'):
+        return jsonify({'message': 'format must be csv or parquet'}), 400
+    if export_format == 'parquet' and not attendance_export.parquet_available():
+        return jsonify({'message': 'Parquet export requires pyarrow'}), 400
+
+    rows = db_attendance.stream_class_attendance(class_id, start_date, end_date)
+    if rows is None:
+        return jsonify({'message': 'Failed to export attendance'}), 500
+
+    if export_format == 'parquet':
+        body = attendance_export.parquet_chunks(rows, Config.EXPORT_CHUNK_ROWS)
+        mimetype = 'application/vnd.apache.parquet'
+    else:
+        body = attendance_export.csv_chunks(rows, db_attendance.EXPORT_COLUMNS, Config.EXPORT_CHUNK_ROWS)
+        mimetype = 'text/csv; charset=utf-8'
+
+    filename = f"attendance_{class_id}_{start_date:%Y%m%d}_{end_date:%Y%m%d}.{export_format}"
+    response = Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        # リバースプロキシでためずにそのまま流す
+        'X-Accel-Buffering': 'no',
+    })
+    # 送信の完了・中断のどちらでも接続を返す
+    response.call_on_close(rows.close)
+    return response
+
+@attendance_bp.route('/at_risk', methods=['GET'])
+@query_budget(1)
+def at_risk_report():
+    """
+    教員用: 期間内の出席率が基準を下回る（または欠席できる残り回数が少ない）学生の一覧
+    Query: class_id または department_id, start_date, end_date (YYYY-MM-DD),
+           threshold（出席率の基準 %、省略時は AT_RISK_THRESHOLD）,
+           allowance_margin（残り欠席可能回数がこれ以下なら対象、省略時は AT_RISK_ALLOWANCE_MARGIN）
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    payload = decode_access_token(auth_header.split(' ')[1])
+    if not payload:
+        return jsonify({'message': 'Invalid or expired token'}), 401
+    if not payload.get('isTeacher'):
+        return jsonify({'message': 'Teacher permission required'}), 403
+
+    try:
+        class_id = int(request.args['class_id']) if request.args.get('class_id') else None
+        department_id = int(request.args['department_id']) if request.args.get('department_id') else None
+        start_date = datetime.datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+        threshold = float(request.args.get('threshold', Config.AT_RISK_THRESHOLD))
+        allowance_margin = int(request.args.get('allowance_margin', Config.AT_RISK_ALLOWANCE_MARGIN))
+    except (KeyError, ValueError):
+        return jsonify({'message': 'start_date and end_date (YYYY-MM-DD) are required and ids must be integers'}), 400
+    if (class_id is None) == (department_id is None):
+        return jsonify({'message': 'Specify either class_id or department_id'}), 400
+    if end_date < start_date or (end_date - start_date).days >= Config.AT_RISK_MAX_DAYS:
+        return jsonify({'message': f'Date range must be 1 to {Config.AT_RISK_MAX_DAYS} days'}), 400
+    if not 0 < threshold <= 100:
+        return jsonify({'message': 'Invalid threshold'}), 400
+
+    # 未展開の繰り返しルールの授業もクエリ内で数える（時間割は書き込まない）
+    rows = db_attendance.get_term_attendance_counts(start_date, end_date, class_id=class_id, department_id=department_id)
+    if rows is None:
+        return jsonify({'message': 'Failed to get attendance'}), 500
+
+    students = attendance_report.build_at_risk_report(rows, threshold, allowance_margin)
+    return jsonify({
+        'threshold': threshold,
+        'allowance_margin': allowance_margin,
+        'student_count': len({row['user_id'] for row in rows}),
+        'students': students,
+    }), 200
@@ -0,0 +1,47 @@
+from flask import Blueprint, request, jsonify
+
+import app.utility.db.db_chat as db_chat
+import app.utility.db.db_user as db_user
+from app.utility.auth.jwt import decode_access_token
+from app.utility.chat import chat_service
+from app.utility.chat.chat_model import ChatModelError
+from app.core.query_audit import query_budget
+
+chat_bp = Blueprint('chat', __name__)
+
+MAX_MESSAGE_LENGTH = 1000
+
+@chat_bp.route('/', methods=['POST'])
+@query_budget(6)
+def chat():
+    """
+    チャットボットに質問する（同じ質問には回答キャッシュから答える）
+    Body: {"message": "..."}
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    payload = decode_access_token(auth_header.split(' ')[1])
+    if not payload:
+        return jsonify({'message': 'Invalid or expired token'}), 401
+
+    student = db_user.get_student_info(payload.get('sub'))
+    if not student:
+        return jsonify({'message': 'User not found'}), 401
+
+    data = request.get_json(silent=True) or {}
+    message = (data.get('message') or '').strip()
+    if not message:
+        return jsonify({'message': 'message is required'}), 400
+    if len(message) > MAX_MESSAGE_LENGTH:
+        return jsonify({'message': f'message must be at most {MAX_MESSAGE_LENGTH} characters'}), 400
+
+    try:
+        response, source = chat_service.answer(message)
+    except ChatModelError as e:
+        print(f"chat モデルエラー: {e}", flush=True)
+        return jsonify({'message': 'The assistant is currently unavailable'}), 503
+
+    db_chat.add_chat_log(student['user_id'], message, response)
+    return jsonify({'response': response, 'source': source, 'cached': source == 'cache'}), 200
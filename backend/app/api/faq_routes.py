@@ -0,0 +1,28 @@
+from flask import Blueprint, request, jsonify
+
+import app.utility.db.db_faq as db_faq
+from app.core.query_audit import query_budget
+
+faq_bp = Blueprint('faq', __name__)
+
+@faq_bp.route('/search', methods=['GET'])
+@query_budget(2)
+def search():
+    """
+    FAQ を検索する（文字 2-gram のインメモリ索引）
+    Query Params:
+      q: 検索語
+      category: カテゴリで絞り込む（任意）
+      limit: 1〜50（既定 10）
+    """
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'message': 'q is required'}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer'}), 400
+
+    results = db_faq.search_faq(query, limit=limit, category=request.args.get('category'))
+    return jsonify({'query': query, 'results': results}), 200
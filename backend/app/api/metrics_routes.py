@@ -0,0 +1,62 @@
+from flask import Blueprint, Response
+
+from app.core.metrics import registry
+from app.utility.db.db_connect import pool_stats
+from app.utility.db.db_user import student_info_cache
+from app.utility.db.db_notification import unread_count_cache
+from app.utility.cache.entry_index import entry_index
+from app.utility.cache.faq_index import faq_index
+from app.utility.auth.google_keys import google_key_cache
+import app.utility.cache.timetable_cache as timetable_cache
+from app.utility.chat import chat_service
+from app.utility.journal.entry_journal import entry_journal
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def _pool_gauges():
+    series = []
+    for name in ("primary", "replica"):
+        stats = pool_stats(name)
+        if not stats:
+            continue
+        for key, value in stats.items():
+            series.append(((("pool", name), ("stat", key)), value))
+    return ("db_pool", "Connection pool counters and gauges", series)
+
+
+def _cache_gauges():
+    series = []
+    caches = {
+        "student_info": student_info_cache,
+        "timetable_week": timetable_cache.week_cache,
+        "timetable_status": timetable_cache.status_cache,
+        "timetable_body": timetable_cache.body_cache,
+        "timetable_expanded": timetable_cache.expanded_cache,
+        "notification_unread_count": unread_count_cache,
+        "chat_answer": chat_service.answer_cache,
+    }
+    for name, cache in caches.items():
+        for key, value in cache.stats().items():
+            series.append(((("cache", name), ("stat", key)), value))
+    series.append(((("cache", "entry_index"), ("stat", "size")), len(entry_index)))
+    series.append(((("cache", "faq_index"), ("stat", "size")), len(faq_index)))
+    for key, value in entry_journal.stats().items():
+        series.append(((("cache", "entry_journal"), ("stat", key)), value))
+    for key, value in google_key_cache.stats().items():
+        series.append(((("cache", "google_keys"), ("stat", key)), value))
+    return ("app_cache", "In-process cache counters and sizes", series)
+
+
+def _chat_gauges():
+    series = [((("stat", key),), value) for key, value in chat_service.stats().items()]
+    return ("chat", "Chatbot requests, answer-cache hit rate and model calls", series)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus テキスト形式のメトリクス（プロセス単位）
+    """
+    body = registry.render(extra_gauges=[_pool_gauges(), _cache_gauges(), _chat_gauges()])
+    return Response(body, mimetype="text/plain; version=0.0.4")
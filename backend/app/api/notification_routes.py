@@ -0,0 +1,137 @@
+from flask import Blueprint, request, jsonify
+
+import app.utility.db.db_notification as db_notification
+import app.utility.db.db_user as db_user
+from app.utility.auth.jwt import decode_access_token
+from app.core.query_audit import query_budget
+from app.core.realtime import emit_notification
+
+notification_bp = Blueprint('notification', __name__)
+
+def _payload():
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return decode_access_token(auth_header.split(' ')[1])
+
+def _current_student():
+    payload = _payload()
+    if not payload:
+        return None
+    return db_user.get_student_info(payload.get('sub'))
+
+@notification_bp.route('/', methods=['GET'])
+@query_budget(3)
+def list_unread():
+    """
+    未読通知を新しい順に返す
+    Query Params:
+      before_id: 前ページの next_before_id（省略時は最新から）
+      limit: 1〜100（既定 20）
+    """
+    student = _current_student()
+    if not student:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    try:
+        before_id = request.args.get('before_id', type=int)
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer'}), 400
+
+    notifications, next_before_id = db_notification.get_unread_notifications(student['user_id'], before_id, limit)
+    for item in notifications:
+        item['created_at'] = item['created_at'].isoformat() if item['created_at'] else None
+
+    return jsonify({'notifications': notifications, 'next_before_id': next_before_id}), 200
+
+@notification_bp.route('/unread_count', methods=['GET'])
+@query_budget(3)
+def unread_count():
+    student = _current_student()
+    if not student:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    count = db_notification.get_unread_count(student['user_id'])
+    if count is None:
+        return jsonify({'message': 'Failed to get unread count'}), 500
+    return jsonify({'unread_count': count}), 200
+
+@notification_bp.route('/read', methods=['POST'])
+@query_budget(3)
+def mark_read():
+    """
+    Body:
+      {"ids": [1, 2, 3]}  指定した通知を既読にする
+      {"up_to_id": 10}     その id 以下の未読をすべて既読にする
+      {}                   すべて既読にする
+    """
+    student = _current_student()
+    if not student:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if ids is not None and not isinstance(ids, list):
+        return jsonify({'message': 'ids must be a list'}), 400
+
+    try:
+        ids = [int(i) for i in ids] if ids else None
+        up_to_id = int(data['up_to_id']) if data.get('up_to_id') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'message': 'ids must be integers'}), 400
+
+    updated = db_notification.mark_notifications_read(student['user_id'], ids=ids, up_to_id=up_to_id)
+    if updated is None:
+        return jsonify({'message': 'Failed to mark notifications as read'}), 500
+    return jsonify({'updated': updated}), 200
+
+@notification_bp.route('/broadcast', methods=['POST'])
+@query_budget(2)
+def broadcast():
+    """
+    教員用: 通知を一斉送信する（宛先ごとに INSERT ... SELECT 1文）
+    Body:
+      {"type": "授業変更", "message": "...", "class_ids": [1, 2], "major_id": null}
+      または {"type": ..., "message": ..., "department_id": 101}
+      または {"type": ..., "message": ..., "user_ids": [24001001, ...]}
+    """
+    payload = _payload()
+    if not payload:
+        return jsonify({'message': 'Unauthorized'}), 401
+    if not payload.get('isTeacher'):
+        return jsonify({'message': 'Teacher permission required'}), 403
+
+    data = request.get_json(silent=True) or {}
+    notification_type = data.get('type')
+    message = data.get('message')
+    if notification_type not in db_notification.NOTIFICATION_TYPES:
+        return jsonify({'message': 'Invalid type'}), 400
+    if not message:
+        return jsonify({'message': 'message is required'}), 400
+
+    try:
+        if data.get('user_ids'):
+            user_ids = [int(u) for u in data['user_ids']]
+            created = db_notification.notify_users(user_ids, notification_type, message)
+            target = {'user_ids': user_ids}
+        elif data.get('class_ids'):
+            class_ids = [int(c) for c in data['class_ids']]
+            major_id = int(data['major_id']) if data.get('major_id') is not None else None
+            created = db_notification.notify_classes(class_ids, notification_type, message, major_id)
+            target = {'class_ids': class_ids, 'major_id': major_id}
+        elif data.get('department_id') is not None:
+            department_id = int(data['department_id'])
+            created = db_notification.notify_department(department_id, notification_type, message)
+            target = {'department_id': department_id}
+        else:
+            return jsonify({'message': 'user_ids, class_ids or department_id is required'}), 400
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Target ids must be integers'}), 400
+
+    if created is None:
+        return jsonify({'message': 'Failed to create notifications'}), 500
+
+    if created:
+        emit_notification(notification_type, message, **target)
+    return jsonify({'message': 'Notifications created', 'created': created}), 200
@@ -1,14 +1,18 @@
-from flask import Blueprint, request, jsonify
-from app.utility.db.db_timetable import get_timetable
+from flask import Blueprint, request, jsonify, Response
+import app.utility.cache.timetable_cache as timetable_cache
 from app.utility.db.db_user import get_student_info
 from app.utility.db.db_class import get_majors_by_department
+from app.utility.importer import timetable_importer
+import app.utility.db.db_timetable as db_timetable
 from app.utility.auth.jwt import decode_access_token
 from app.core.config import Config
+from app.core.query_audit import query_budget
 import datetime
 
 timeTable_bp = Blueprint('timetable', __name__)
 
 @timeTable_bp.route("/majors", methods=["GET"])
+@query_budget(3)
 def get_majors():
     """
     ユーザーの学科に関連する専攻一覧を取得する
@@ -39,6 +43,7 @@ def get_majors():
     return jsonify({"majors": majors}), 200
 
 @timeTable_bp.route("/", methods=["GET"])
+@query_budget(7)
 def get_timetables():
     """
     時間割を取得するエンドポイント
@@ -101,23 +106,205 @@ def get_timetables():
         except ValueError:
             return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
 
-    # 4. Fetch Data
+    # 4. Fetch Data (クラス共通部分とユーザーの出席ステータスは別々にキャッシュ)
     user_id = student_info['user_id']
-    timetable_data = get_timetable(class_id, major_id, start_date, end_date, user_id)
-    
-    # 5. Format Response
-    formatted_data = []
-    for entry in timetable_data:
-        formatted_data.append({
-            "id": entry['id'],
-            "date": entry['date'].strftime('%Y-%m-%d'),
-            "period": entry['period'],
-            "subject_name": entry['subject_name'],
-            "teacher_name": entry['teacher_name'],
-            "major_id": entry['major_id'],
-            "start_time": str(entry['start_time']) if entry['start_time'] else None,
-            "end_time": str(entry['end_time']) if entry['end_time'] else None,
-            "attendance_status": entry.get('attendance_status')
-        })
-
-    return jsonify(formatted_data)
+    entries, digest = timetable_cache.get_week(class_id, major_id, start_date, end_date)
+    statuses = timetable_cache.get_statuses(user_id, start_date, end_date)
+
+    # 5. Conditional Response
+    etag = timetable_cache.make_etag(digest, statuses)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = timetable_cache.render(etag, entries, statuses)
+        response = Response(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def _require_teacher():
+    """
+    教員のトークンでなければエラーレスポンスを返す（教員なら None）
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return jsonify({"error": "Authorization header missing"}), 401
+
+    token = auth_header.split(" ")[1] if len(auth_header.split(" ")) > 1 else None
+    payload = decode_access_token(token) if token else None
+    if not payload:
+        return jsonify({"error": "Invalid or expired token"}), 401
+    if not payload.get('isTeacher'):
+        return jsonify({"error": "Teacher permission required"}), 403
+    return None
+
+@timeTable_bp.route("/import", methods=["POST"])
+@query_budget(13)
+def import_timetables():
+    """
+    教員用: 時間割を一括で取り込む（既存の時間割との差分だけを反映する）
+    Body: multipart/form-data の file（CSV / XLSX）または {"sheet_url": "https://docs.google.com/spreadsheets/d/..."}
+    Query Params:
+      dry_run: true なら反映せず件数だけ返す
+      keep_missing: true なら表にない既存の時間割を削除しない
+    """
+    error = _require_teacher()
+    if error:
+        return error
+
+    upload = request.files.get('file')
+    data = request.get_json(silent=True) or {}
+    try:
+        if upload:
+            frame = timetable_importer.read_timetable_frame(upload.read(), upload.filename)
+        elif data.get('sheet_url'):
+            frame = timetable_importer.read_sheet_frame(str(data['sheet_url']))
+        else:
+            return jsonify({"error": "file or sheet_url is required"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to read timetable: {e}"}), 400
+
+    try:
+        result = timetable_importer.import_timetables(
+            frame,
+            delete_missing=request.args.get('keep_missing', 'false').lower() != 'true',
+            dry_run=request.args.get('dry_run', 'false').lower() == 'true',
+        )
+    except timetable_importer.TimetableImportError as e:
+        return jsonify({"error": "Invalid timetable", "errors": e.errors}), 400
+    except Exception as e:
+        print(f"import_timetables エラー: {e}", flush=True)
+        return jsonify({"error": "Failed to import timetable"}), 500
+
+    return jsonify(result), 200
+
+def _format_rule(rule):
+    return dict(rule, start_date=rule['start_date'].strftime('%Y-%m-%d'), end_date=rule['end_date'].strftime('%Y-%m-%d'))
+
+@timeTable_bp.route("/rules", methods=["GET"])
+@query_budget(1)
+def get_rules():
+    """
+    教員用: クラスの繰り返しルール一覧
+    Query Params:
+      class_id
+    """
+    error = _require_teacher()
+    if error:
+        return error
+
+    class_id = request.args.get('class_id', type=int)
+    if class_id is None:
+        return jsonify({"error": "class_id is required"}), 400
+    return jsonify({"rules": [_format_rule(rule) for rule in db_timetable.get_timetable_rules(class_id)]}), 200
+
+@timeTable_bp.route("/rules", methods=["POST"])
+@query_budget(3)
+def create_rule():
+    """
+    教員用: 繰り返しルールを登録する（時間割は表示された週から順に展開される）
+    Body: {"class_id": 1, "major_id": null, "weekday": 0 (月曜), "period": 1, "subject_id": 1, "teacher_id": 100000,
+           "start_date": "2025-04-07", "end_date": "2025-09-30"}
+    """
+    error = _require_teacher()
+    if error:
+        return error
+
+    data = request.get_json(silent=True) or {}
+    try:
+        rule = {
+            'class_id': int(data['class_id']),
+            'major_id': int(data['major_id']) if data.get('major_id') is not None else None,
+            'weekday': int(data['weekday']),
+            'period': int(data['period']),
+            'subject_id': int(data['subject_id']),
+            'teacher_id': int(data['teacher_id']),
+            'start_date': datetime.datetime.strptime(data['start_date'], '%Y-%m-%d').date(),
+            'end_date': datetime.datetime.strptime(data['end_date'], '%Y-%m-%d').date(),
+        }
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "class_id, weekday, period, subject_id, teacher_id, start_date and end_date are required"}), 400
+    if not 0 <= rule['weekday'] <= 6 or not 1 <= rule['period'] <= 7 or rule['end_date'] < rule['start_date']:
+        return jsonify({"error": "Invalid weekday, period or date range"}), 400
+
+    rule_id = db_timetable.create_timetable_rule(**rule)
+    if rule_id == "OVERLAP":
+        return jsonify({"error": "Another rule already covers this class, weekday and period in the date range"}), 409
+    if rule_id is None:
+        return jsonify({"error": "Failed to create rule"}), 500
+
+    timetable_cache.invalidate_weeks()
+    return jsonify({"id": rule_id}), 201
+
+@timeTable_bp.route("/rules/<int:rule_id>/end", methods=["POST"])
+@query_budget(4)
+def end_rule(rule_id):
+    """
+    教員用: ルールを end_date で終わらせる（それより後の展開済みの授業は、出席記録がなければ削除する）
+    期間を延ばす場合は新しいルールを登録する（他のルールとの重なりを確認するため）
+    Body: {"end_date": "2025-06-30"}
+    """
+    error = _require_teacher()
+    if error:
+        return error
+
+    data = request.get_json(silent=True) or {}
+    try:
+        end_date = datetime.datetime.strptime(data['end_date'], '%Y-%m-%d').date()
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "end_date (YYYY-MM-DD) is required"}), 400
+
+    rule = db_timetable.get_timetable_rule(rule_id)
+    if not rule:
+        return jsonify({"error": "Rule not found"}), 404
+    if end_date < rule['start_date'] - datetime.timedelta(days=1):
+        return jsonify({"error": "end_date must not be before the day before start_date"}), 400
+    if end_date > rule['end_date']:
+        return jsonify({"error": "end_date must not be after the rule's current end_date; create a new rule to extend it"}), 400
+
+    deleted = db_timetable.end_timetable_rule(rule_id, end_date)
+    if deleted is None:
+        return jsonify({"error": "Failed to end rule"}), 500
+
+    timetable_cache.invalidate_weeks()
+    return jsonify({"id": rule_id, "end_date": end_date.strftime('%Y-%m-%d'), "deleted": deleted}), 200
+
+@timeTable_bp.route("/rules/<int:rule_id>/overrides/<date>", methods=["PUT"])
+@query_budget(7)
+def set_override(rule_id, date):
+    """
+    教員用: ルールの特定の日を休講にするか、科目・教員を差し替える
+    Body: {"cancelled": true} または {"subject_id": 2, "teacher_id": 100001}
+    """
+    error = _require_teacher()
+    if error:
+        return error
+
+    try:
+        day = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    data = request.get_json(silent=True) or {}
+    cancelled = bool(data.get('cancelled'))
+    try:
+        subject_id = int(data['subject_id']) if data.get('subject_id') is not None else None
+        teacher_id = int(data['teacher_id']) if data.get('teacher_id') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "subject_id and teacher_id must be integers"}), 400
+
+    rule = db_timetable.get_timetable_rule(rule_id)
+    if not rule:
+        return jsonify({"error": "Rule not found"}), 404
+    if day.weekday() != rule['weekday'] or not rule['start_date'] <= day <= rule['end_date']:
+        return jsonify({"error": "The rule has no lesson on this date"}), 400
+
+    result = db_timetable.set_timetable_override(rule_id, day, cancelled, subject_id, teacher_id)
+    if result == "HAS_ATTENDANCE":
+        return jsonify({"error": "Attendance has already been recorded for this lesson"}), 409
+    if result != "SUCCESS":
+        return jsonify({"error": "Failed to set override"}), 500
+
+    timetable_cache.invalidate_weeks()
+    return jsonify({"rule_id": rule_id, "date": date, "cancelled": cancelled}), 200
@@ -1,9 +1,8 @@
 from flask import Flask, request, jsonify,Blueprint
-from google.oauth2 import id_token
-from google.auth.transport import requests as grequests
-
 from app.utility.auth.jwt import create_access_token, decode_access_token
+from app.utility.auth.google_keys import verify_google_id_token
 from app.core.config import Config
+from app.core.query_audit import query_budget
 import datetime
 from app.utility.db.db_test import get_departments
 import app.utility.db.db_user as db_user
@@ -12,6 +11,7 @@ import app.utility.db.db_class as db_class
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route("/auth/google", methods=["POST"])
+@query_budget(5)
 def google_login():
     """
     googleログイン認証を行い、データベースへの登録とJWTの発行を行う。
@@ -21,8 +21,8 @@ def google_login():
     token = data.get("token")
     GOOGLE_CLIENT_ID = Config.GOOGLE_CLIENT_ID
     try:
-        # IDトークンをGoogleで検証
-        idinfo = id_token.verify_oauth2_token(token, grequests.Request(),audience=GOOGLE_CLIENT_ID)
+        # IDトークンをキャッシュ済みのGoogle署名鍵で検証
+        idinfo = verify_google_id_token(token, audience=GOOGLE_CLIENT_ID)
 
         user = {
             "email": idinfo["email"],
@@ -85,6 +85,7 @@ def db_test():
     return jsonify({"departments": rows}), 200
 
 @user_bp.route("/me", methods=["GET"])
+@query_budget(3)
 def get_me():
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
@@ -130,6 +131,7 @@ def get_me():
         return jsonify({"error": "Internal server error"}), 500
 
 @user_bp.route("/me/major", methods=["PUT"])
+@query_budget(4)
 def update_major():
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
@@ -0,0 +1,115 @@
+import datetime
+import sys
+
+import click
+
+from app.utility.db.db_migrate import apply_migrations
+from app.utility.db.explain_check import run_checks
+from app.utility.bench.synthetic_data import generate_synthetic_data, reset_synthetic_data
+from app.utility.bench.benchmark import run_benchmark, run_query_audit
+from app.utility.importer.timetable_importer import (
+    TimetableImportError, import_timetables, read_sheet_frame, read_timetable_frame
+)
+
+
+def register_commands(app):
+    """
+    flask コマンドを登録する
+    """
+
+    @app.cli.command("migrate")
+    def migrate_command():
+        """backend/migrations の未適用マイグレーションを適用する"""
+        applied = apply_migrations()
+        if applied:
+            for version in applied:
+                click.echo(f"applied: {version}")
+        else:
+            click.echo("no pending migrations")
+
+    @app.cli.command("explain-check")
+    def explain_check_command():
+        """db_* の各クエリを EXPLAIN し、全件走査があれば失敗する"""
+        failed = False
+        for name, statements, scans in run_checks():
+            if statements == 0:
+                failed = True
+                click.echo(f"FAIL {name}: no statements were executed")
+            elif scans:
+                failed = True
+                click.echo(f"FAIL {name}: full table scan")
+                for sql, row in scans:
+                    click.echo(f"    table={row.get('table')} rows={row.get('rows')} sql={sql[:200]}")
+            else:
+                click.echo(f"ok   {name} ({statements} statements)")
+        sys.exit(1 if failed else 0)
+
+    @app.cli.command("import-timetable")
+    @click.argument("source")
+    @click.option("--keep-missing", is_flag=True, help="表にない既存の時間割を削除しない")
+    @click.option("--dry-run", is_flag=True, help="反映せずに差分の件数だけ表示する")
+    def import_timetable_command(source, keep_missing, dry_run):
+        """CSV / XLSX / Google スプレッドシートのURLから時間割を取り込み、差分だけを反映する"""
+        frame = read_sheet_frame(source) if source.startswith("https://") else read_timetable_frame(source)
+        try:
+            result = import_timetables(frame, delete_missing=not keep_missing, dry_run=dry_run)
+        except TimetableImportError as e:
+            for error in e.errors:
+                click.echo(f"row {error['row']} {error['column']}: {error['message']}")
+            sys.exit(1)
+        click.echo(("dry run: " if dry_run else "") + str(result))
+
+    @app.cli.command("seed-synthetic")
+    @click.option("--students", default=5000, show_default=True, help="学生数")
+    @click.option("--class-size", default=40, show_default=True, help="1クラスの人数")
+    @click.option("--grades", default=2, show_default=True, help="学年数")
+    @click.option("--weeks", default=40, show_default=True, help="時間割を作る週数")
+    @click.option("--start", default=None, help="時間割の開始日 (YYYY-MM-DD)。省略時は今日の weeks/2 週前")
+    @click.option("--periods-per-day", default=4, show_default=True, help="1日の時限数")
+    @click.option("--no-attendance", is_flag=True, help="出席・入構記録を生成しない")
+    @click.option("--reset", is_flag=True, help="生成済みの架空データを先に削除する")
+    @click.option("--seed", default=0, show_default=True, help="乱数シード")
+    def seed_synthetic_command(students, class_size, grades, weeks, start, periods_per_day, no_attendance, reset, seed):
+        """負荷検証用の架空キャンパスデータを投入する"""
+        if reset:
+            reset_synthetic_data()
+            click.echo("synthetic data removed")
+        start_date = datetime.datetime.strptime(start, "%Y-%m-%d").date() if start else None
+        counts = generate_synthetic_data(
+            students=students, class_size=class_size, grades=grades, start=start_date, weeks=weeks,
+            periods_per_day=periods_per_day, with_attendance=not no_attendance, seed=seed, log=click.echo
+        )
+        click.echo(counts)
+
+    @app.cli.command("benchmark")
+    @click.option("--requests", "requests_per_endpoint", default=500, show_default=True, help="エンドポイントごとのリクエスト数")
+    @click.option("--concurrency", default=4, show_default=True, help="同時実行スレッド数")
+    @click.option("--cold-cache", is_flag=True, help="毎リクエスト前にアプリ内キャッシュを空にする")
+    @click.option("--endpoint", "endpoints", multiple=True, help="計測するエンドポイント名（複数指定可）")
+    def benchmark_command(requests_per_endpoint, concurrency, cold_cache, endpoints):
+        """各エンドポイントのレイテンシ・クエリ数・スループットを計測する"""
+        results = run_benchmark(
+            app, requests_per_endpoint=requests_per_endpoint, concurrency=concurrency,
+            cold_cache=cold_cache, endpoints=endpoints, log=lambda r: None
+        )
+        click.echo(f"{'endpoint':32} {'req':>6} {'err':>5} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'q/req':>6} {'rps':>8}")
+        for r in results:
+            click.echo(
+                f"{r['endpoint']:32} {r['requests']:>6} {r['errors']:>5} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+                f"{r['p99_ms']:>8} {r['queries_per_request']:>6} {r['throughput_rps']:>8}"
+            )
+
+    @app.cli.command("query-audit")
+    @click.option("--samples", default=5, show_default=True, help="エンドポイントごとに試す学生数")
+    def query_audit_command(samples):
+        """各エンドポイントをクエリ監査付きで実行し、N+1・クエリ数超過・遅い文があれば失敗する"""
+        failed = False
+        for name, problems in run_query_audit(app, samples=samples):
+            if problems:
+                failed = True
+                click.echo(f"FAIL {name}")
+                for problem in problems:
+                    click.echo(f"    {problem}")
+            else:
+                click.echo(f"ok   {name}")
+        sys.exit(1 if failed else 0)
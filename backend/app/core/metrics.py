@@ -0,0 +1,209 @@
+"""
+リクエストごとのDB計測（クエリ数・DB時間・接続取得時間・行数）と、
+エンドポイント別のヒストグラム（Prometheus テキスト形式で /metrics に出力）。
+"""
+import bisect
+import contextvars
+import sys
+import threading
+import time
+
+from flask import g, request
+
+from app.utility.db.db_connect import add_acquire_listener, add_query_listener
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+class RequestStats:
+    """
+    1リクエスト分のDB計測値
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.acquire_seconds = 0.0
+        self.rows = 0
+
+
+_current = contextvars.ContextVar("request_db_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for labels, series in sorted(self._series.items()):
+            label_text = _labels(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._series = {}
+
+    def inc(self, labels, value=1):
+        self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} counter")
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{{{_labels(labels)}}} {value}")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_seconds = Histogram(
+            "http_request_duration_seconds", "Request latency per endpoint", DURATION_BUCKETS)
+        self.request_queries = Histogram(
+            "db_queries_per_request", "SQL statements issued per request", QUERY_BUCKETS)
+        self.request_db_seconds = Histogram(
+            "db_seconds_per_request", "Time spent executing SQL per request", DURATION_BUCKETS)
+        self.request_acquire_seconds = Histogram(
+            "db_acquire_seconds_per_request", "Time spent waiting for a pooled connection per request",
+            DURATION_BUCKETS)
+        self.request_rows = Histogram(
+            "db_rows_per_request", "Rows returned or affected per request", ROW_BUCKETS)
+        self.function_calls = Counter(
+            "db_function_queries_total", "SQL statements issued per data-access function")
+        self.function_seconds = Counter(
+            "db_function_seconds_total", "Time spent in SQL per data-access function")
+
+    def observe_request(self, endpoint, method, status, seconds, stats):
+        labels = (("endpoint", endpoint), ("method", method))
+        with self._lock:
+            self.request_seconds.observe(labels + (("status", status),), seconds)
+            self.request_queries.observe(labels, stats.queries)
+            self.request_db_seconds.observe(labels, stats.db_seconds)
+            self.request_acquire_seconds.observe(labels, stats.acquire_seconds)
+            self.request_rows.observe(labels, stats.rows)
+
+    def observe_function(self, function, seconds):
+        labels = (("function", function),)
+        with self._lock:
+            self.function_calls.inc(labels)
+            self.function_seconds.inc(labels, seconds)
+
+    def render(self, extra_gauges=()):
+        lines = []
+        with self._lock:
+            for metric in (self.request_seconds, self.request_queries, self.request_db_seconds,
+                           self.request_acquire_seconds, self.request_rows,
+                           self.function_calls, self.function_seconds):
+                metric.render(lines)
+        for name, help_text, series in extra_gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series:
+                lines.append(f"{name}{{{_labels(labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _db_function_name():
+    """
+    実行中のクエリを発行した app.utility.db.db_* の関数名を呼び出し履歴から探す
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("app.utility.db.db_") and module != "app.utility.db.db_connect":
+            return f"{module.rsplit('.', 1)[-1]}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "other"
+
+
+def _on_query(sql, seconds, rowcount):
+    registry.observe_function(_db_function_name(), seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+        if rowcount and rowcount > 0:
+            stats.rows += rowcount
+
+
+def _on_acquire(pool_name, seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.acquire_seconds += seconds
+
+
+def current_stats():
+    return _current.get()
+
+
+def init_metrics(app):
+    """
+    リクエスト計測のフックと Server-Timing ヘッダーを登録する
+    """
+    add_query_listener(_on_query)
+    add_acquire_listener(_on_acquire)
+
+    @app.before_request
+    def start_request_stats():
+        stats = RequestStats()
+        g.db_stats = stats
+        g.db_stats_token = _current.set(stats)
+
+    @app.after_request
+    def finish_request_stats(response):
+        stats = g.pop("db_stats", None)
+        token = g.pop("db_stats_token", None)
+        if stats is None:
+            return response
+        if token is not None:
+            _current.reset(token)
+
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        if endpoint != "/metrics":
+            registry.observe_request(endpoint, request.method, response.status_code, elapsed, stats)
+
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries", '
+            f"acquire;dur={stats.acquire_seconds * 1000:.2f}, "
+            f"app;dur={elapsed * 1000:.2f}"
+        )
+        return response
@@ -0,0 +1,72 @@
+"""
+プリフォーク型サーバー（gunicorn）用のワーカー初期化。
+
+create_app(prefork=True) ではマスタープロセスで1度だけアプリを作り（DBには接続しない）、
+fork 後の各ワーカーで run_post_fork_hooks(app) を呼んで接続プール・キャッシュを作り直す。
+開発サーバー（flask run / wsgi.py）では run_hooks_on_first_request(app) で最初のリクエストの前に実行する。
+"""
+import threading
+
+from app.utility.auth.google_keys import google_key_cache
+from app.utility.cache.entry_index import entry_index
+from app.utility.cache.faq_index import faq_index
+import app.utility.cache.timetable_cache as timetable_cache
+import app.utility.db.db_user as db_user
+import app.utility.db.db_notification as db_notification
+from app.utility.chat import chat_service
+from app.utility.db.db_connect import reset_pool
+
+
+def add_post_fork_hook(app, func):
+    """
+    fork 後の各ワーカーで1度だけ実行する処理を登録する
+    """
+    app.extensions.setdefault("post_fork_hooks", []).append(func)
+
+
+def run_post_fork_hooks(app):
+    """
+    登録された処理を順に実行する（gunicorn.conf.py の post_worker_init から呼ばれる）
+    """
+    for func in app.extensions.get("post_fork_hooks", []):
+        try:
+            func()
+        except Exception as e:
+            print(f"post_fork {getattr(func, '__name__', func)} エラー: {e}", flush=True)
+
+
+def run_hooks_on_first_request(app):
+    """
+    開発サーバー用。登録された処理を最初のリクエストの前に1度だけ実行する
+    flask の CLI コマンド（migrate / import-timetable など）はリクエストを受けないので、
+    索引の読み込みやスケジューラー・ジャーナルのライターは起動しない
+    """
+    lock = threading.Lock()
+    started = []
+
+    @app.before_request
+    def _run_startup_hooks():
+        if started:
+            return
+        with lock:
+            if not started:
+                run_post_fork_hooks(app)
+                started.append(True)
+
+
+def reset_process_state():
+    """
+    親プロセスから引き継いだ接続・ロック・キャッシュを破棄する
+    eventlet ワーカーではモンキーパッチ後に呼ぶことで、ロックがグリーンスレッド対応のものになる
+    """
+    reset_pool()
+    google_key_cache.reset()
+    db_user.student_info_cache.clear()
+    db_notification.unread_count_cache.clear()
+    timetable_cache.week_cache.clear()
+    timetable_cache.status_cache.clear()
+    timetable_cache.body_cache.clear()
+    timetable_cache.expanded_cache.clear()
+    entry_index.clear()
+    faq_index.clear()
+    chat_service.answer_cache.clear()
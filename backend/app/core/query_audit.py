@@ -0,0 +1,192 @@
+"""
+開発・CI用のクエリ監査（QUERY_AUDIT_ENABLED=true のときだけ有効）。
+
+リクエスト中に発行された全SQLを記録し、次のものを検出する。
+- 同じ形の文の繰り返し（N+1 の疑い）
+- エンドポイントのクエリ数の上限（@query_budget で宣言、未宣言は QUERY_AUDIT_DEFAULT_BUDGET）超過
+- QUERY_AUDIT_SLOW_MS を超えた遅い文
+
+QUERY_AUDIT_STRICT=true では違反時に QueryBudgetExceeded を送出する。
+TESTING=True のテストクライアントでは例外がそのまま呼び出し元に届くので、テストを失敗させられる。
+"""
+import contextlib
+import contextvars
+import re
+import threading
+from collections import Counter
+
+from flask import current_app, g, request
+
+from app.utility.db.db_connect import add_query_listener, remove_query_listener
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    クエリ監査の違反（クエリ数超過・N+1・遅い文）
+    """
+
+
+_LITERALS = [
+    (re.compile(r"'(?:[^'\\]|\\.)*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    (re.compile(r"\(\?\+\)(?:\s*,\s*\(\?\+\))+"), "(?+)+"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_sql(sql):
+    """
+    リテラル・プレースホルダー・IN リスト・複数行VALUES をまとめ、文の「形」にする
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    shape = sql.strip()
+    for pattern, replacement in _LITERALS:
+        shape = pattern.sub(replacement, shape)
+    return shape
+
+
+def query_budget(limit):
+    """
+    ビュー関数に付けて、1リクエストで発行してよい文の数を宣言する
+    （@blueprint.route より下に付ける）
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+class QueryAudit:
+    """
+    1リクエスト（または capture_queries() のブロック）で発行された文の記録
+    """
+
+    def __init__(self):
+        self.statements = []  # [(sql, seconds, rowcount), ...]
+
+    def record(self, sql, seconds, rowcount):
+        self.statements.append((sql, seconds, rowcount))
+
+    def repeated(self, threshold):
+        """
+        threshold 回以上繰り返された文の形と回数
+        """
+        shapes = Counter(normalize_sql(sql) for sql, _, _ in self.statements)
+        return [(shape, count) for shape, count in shapes.most_common() if count >= threshold]
+
+    def slow(self, slow_ms):
+        return [(sql, seconds) for sql, seconds, _ in self.statements if seconds * 1000 > slow_ms]
+
+    def violations(self, budget=None, repeat_threshold=3, slow_ms=None):
+        """
+        違反内容を文字列のリストで返す（なければ空リスト）
+        """
+        problems = []
+        if budget is not None and len(self.statements) > budget:
+            problems.append(f"{len(self.statements)} statements (budget {budget})")
+        for shape, count in self.repeated(repeat_threshold):
+            problems.append(f"repeated {count}x: {shape[:200]}")
+        if slow_ms is not None:
+            for sql, seconds in self.slow(slow_ms):
+                problems.append(f"slow {seconds * 1000:.1f}ms: {normalize_sql(sql)[:200]}")
+        return problems
+
+
+_current = contextvars.ContextVar("query_audit", default=None)
+_listener_lock = threading.Lock()
+_captures = 0  # 実行中の capture_queries() の数
+_request_audit_installed = False  # init_query_audit が常駐で登録したか
+
+
+def _on_query(sql, seconds, rowcount):
+    audit = _current.get()
+    if audit is not None:
+        audit.record(sql, seconds, rowcount)
+
+
+@contextlib.contextmanager
+def capture_queries():
+    """
+    ブロック内で発行された文を記録する
+        with capture_queries() as audit:
+            client.get("/api/attendance/summary?user_id=1")
+        assert len(audit.statements) <= 3
+    """
+    global _captures
+    with _listener_lock:
+        _captures += 1
+        add_query_listener(_on_query)
+    audit = QueryAudit()
+    token = _current.set(audit)
+    try:
+        yield audit
+    finally:
+        _current.reset(token)
+        # 最後のキャプチャが終わったら外す（リクエスト監査が使っている間は残す）
+        with _listener_lock:
+            _captures -= 1
+            if _captures == 0 and not _request_audit_installed:
+                remove_query_listener(_on_query)
+
+
+@contextlib.contextmanager
+def assert_max_queries(limit, repeat_threshold=3):
+    """
+    ブロック内の文の数が limit を超えるか、同じ形の文が repeat_threshold 回以上あれば失敗する
+    """
+    with capture_queries() as audit:
+        yield audit
+    problems = audit.violations(budget=limit, repeat_threshold=repeat_threshold)
+    if problems:
+        raise QueryBudgetExceeded("; ".join(problems))
+
+
+def _view_budget():
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, "query_budget", None)
+    if budget is None:
+        budget = current_app.config["QUERY_AUDIT_DEFAULT_BUDGET"]
+    return budget
+
+
+def init_query_audit(app):
+    """
+    リクエストごとのクエリ監査を登録する
+    QUERY_AUDIT_ENABLED はリクエストごとに参照するので、flask query-audit などで後から有効にできる
+    """
+    global _request_audit_installed
+    with _listener_lock:
+        _request_audit_installed = True
+        add_query_listener(_on_query)
+
+    @app.before_request
+    def start_query_audit():
+        if app.config.get("QUERY_AUDIT_ENABLED"):
+            g.query_audit_token = _current.set(QueryAudit())
+
+    @app.after_request
+    def finish_query_audit(response):
+        token = g.pop("query_audit_token", None)
+        if token is None:
+            return response
+        audit = _current.get()
+        _current.reset(token)
+
+        problems = audit.violations(
+            budget=_view_budget(),
+            repeat_threshold=app.config["QUERY_AUDIT_REPEAT_THRESHOLD"],
+            slow_ms=app.config["QUERY_AUDIT_SLOW_MS"],
+        )
+        response.headers["X-Query-Count"] = str(len(audit.statements))
+        if not problems:
+            return response
+
+        endpoint = request.url_rule.rule if request.url_rule else request.path
+        message = f"{request.method} {endpoint}: " + "; ".join(problems)
+        print(f"query audit: {message}", flush=True)
+        if app.config["QUERY_AUDIT_STRICT"]:
+            raise QueryBudgetExceeded(message)
+        return response
@@ -0,0 +1,136 @@
+"""
+Socket.IO による出席・入構イベントのプッシュ（名前空間 /live）。
+
+接続時に auth={"token": <アクセストークン>} を渡す。
+- 学生: 自分のルーム user:<user_id>、登録済みカードのルーム card:<idm>、
+        クラス・専攻・学科のルーム class:<class_id> / class:<class_id>:major:<major_id> /
+        department:<department_id> に自動で入る
+- 教員: subscribe_slot {"timetable_id": n} で授業コマのルーム slot:<timetable_id> に入る
+
+イベント
+- entry:      {"entered_at": "..."}                               → card:<idm>
+- attendance: {"user_id": n, "timetable_id": n, "status": "出席"}  → user:<user_id>, slot:<timetable_id>
+- notification: {"type": "授業変更", "message": "..."}             → user / class / class:major / department ルーム
+
+複数プロセスで動かす場合は SOCKETIO_MESSAGE_QUEUE（例: redis://redis:6379/0）を設定し、
+他のワーカーに接続しているクライアントにも届くようにする。
+"""
+import datetime
+
+from flask import request, session
+from flask_socketio import Namespace, SocketIO, join_room, leave_room
+
+from app.core.config import Config
+from app.utility.auth.jwt import decode_access_token
+import app.utility.db.db_user as db_user
+
+NAMESPACE = "/live"
+
+socketio = SocketIO()
+
+
+def _token_from(auth):
+    if isinstance(auth, dict) and auth.get("token"):
+        return auth["token"]
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        return header.split(" ")[1]
+    return request.args.get("token")
+
+
+class LiveNamespace(Namespace):
+
+    def on_connect(self, auth=None):
+        payload = decode_access_token(_token_from(auth) or "")
+        if not payload:
+            return False
+
+        session["is_teacher"] = bool(payload.get("isTeacher"))
+        if session["is_teacher"]:
+            return True
+
+        student_info = db_user.get_student_info(payload.get("sub"))
+        if not student_info:
+            return False
+
+        user_id = student_info["user_id"]
+        session["user_id"] = user_id
+        join_room(f"user:{user_id}")
+        join_room(f"class:{student_info['class_id']}")
+        if student_info.get("major_id"):
+            # 専攻を変更した場合は再接続で新しいルームに入る
+            join_room(f"class:{student_info['class_id']}:major:{student_info['major_id']}")
+        if student_info.get("department_id"):
+            join_room(f"department:{student_info['department_id']}")
+        for card in db_user.get_user_cards(user_id):
+            join_room(f"card:{card['felica_idm']}")
+        return True
+
+    def on_subscribe_slot(self, data):
+        if not session.get("is_teacher"):
+            return {"ok": False, "message": "Teacher permission required"}
+        try:
+            timetable_id = int((data or {}).get("timetable_id"))
+        except (TypeError, ValueError):
+            return {"ok": False, "message": "timetable_id is required"}
+        join_room(f"slot:{timetable_id}")
+        return {"ok": True}
+
+    def on_unsubscribe_slot(self, data):
+        try:
+            timetable_id = int((data or {}).get("timetable_id"))
+        except (TypeError, ValueError):
+            return {"ok": False, "message": "timetable_id is required"}
+        leave_room(f"slot:{timetable_id}")
+        return {"ok": True}
+
+
+def _emit(event, data, rooms):
+    """
+    イベント送信の失敗でAPIの応答を失敗させない
+    """
+    try:
+        socketio.emit(event, data, to=rooms, namespace=NAMESPACE)
+    except Exception as e:
+        print(f"socketio emit エラー: {e}", flush=True)
+
+
+def emit_entry(felica_idm, entered_at=None):
+    entered_at = entered_at or datetime.datetime.now()
+    _emit("entry", {"entered_at": entered_at.isoformat(timespec="seconds")}, [f"card:{felica_idm}"])
+
+
+def emit_attendance(user_id, timetable_id, status):
+    _emit(
+        "attendance",
+        {"user_id": user_id, "timetable_id": timetable_id, "status": status},
+        [f"user:{user_id}", f"slot:{timetable_id}"],
+    )
+
+
+def emit_notification(notification_type, message, user_ids=(), class_ids=(), department_id=None, major_id=None):
+    """
+    専攻を絞ったクラス通知は class:<class_id>:major:<major_id> のルームにだけ送る
+    """
+    if major_id is not None:
+        class_rooms = [f"class:{c}:major:{major_id}" for c in class_ids]
+    else:
+        class_rooms = [f"class:{c}" for c in class_ids]
+    rooms = [f"user:{u}" for u in user_ids] + class_rooms
+    if department_id is not None:
+        rooms.append(f"department:{department_id}")
+    if rooms:
+        _emit("notification", {"type": notification_type, "message": message}, rooms)
+
+
+def init_realtime(app, origins):
+    """
+    Socket.IO をアプリに登録する
+    """
+    socketio.init_app(
+        app,
+        async_mode=Config.SOCKETIO_ASYNC_MODE,
+        message_queue=Config.SOCKETIO_MESSAGE_QUEUE,
+        cors_allowed_origins=origins,
+    )
+    socketio.on_namespace(LiveNamespace(NAMESPACE))
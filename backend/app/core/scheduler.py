@@ -0,0 +1,108 @@
+import datetime
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from flask_apscheduler import APScheduler
+
+from app.core.config import Config
+import app.utility.db.db_attendance as db_attendance
+import app.utility.db.db_timetable as db_timetable
+import app.utility.cache.timetable_cache as timetable_cache
+
+scheduler = APScheduler()
+
+# 当日すでに締め処理をした時限 {date: {period, ...}}
+_closed_periods = {}
+_closed_lock = threading.Lock()
+
+# 複数ワーカーのうちスケジューラーを動かす1プロセスだけが保持するロックファイル
+_lock_file = None
+
+
+def close_out_due_periods(now=None):
+    """
+    開始から ABSENT_CLOSEOUT_MINUTES 分経過した時限について、
+    出席記録のない学生を欠席として登録する（1時限につき1回）
+    """
+    now = now or datetime.datetime.now()
+    today = now.date()
+    delay = datetime.timedelta(minutes=Config.ABSENT_CLOSEOUT_MINUTES)
+
+    with _closed_lock:
+        for day in [d for d in _closed_periods if d != today]:
+            del _closed_periods[day]
+        done = _closed_periods.setdefault(today, set())
+
+    # 繰り返しルールの今日の授業を全クラス分展開しておく（締め処理は timetables の行を対象にする）
+    timetable_cache.expand_rules(today, today)
+
+    for lesson in db_timetable.get_lessontimes():
+        period = lesson['id']
+        if period in done:
+            continue
+
+        start = datetime.datetime.combine(today, datetime.time(0, 0)) + lesson['start_time']
+        if now < start + delay:
+            continue
+
+        inserted = db_attendance.close_out_absentees(today, period)
+        if inserted is None:
+            # 失敗した場合は次回の実行で再試行する
+            continue
+
+        with _closed_lock:
+            done.add(period)
+        if inserted:
+            print(f"close_out_due_periods: {today} {period}限 {inserted}件を欠席にしました", flush=True)
+
+
+def _acquire_scheduler_lock():
+    """
+    SCHEDULER_LOCK_FILE の排他ロックを取れたプロセスだけ True を返す
+    ロックはプロセス終了時に解放されるので、ワーカーが再起動されると次のワーカーが引き継ぐ
+    """
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    if fcntl is None:
+        return True
+
+    handle = open(Config.SCHEDULER_LOCK_FILE, "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _lock_file = handle
+    return True
+
+
+def init_scheduler(app, exclusive=False):
+    """
+    出席の締め処理ジョブを登録して起動する
+    exclusive=True（プリフォーク時のワーカー）ではロックを取れた1ワーカーだけが起動する
+    """
+    if not Config.SCHEDULER_ENABLED:
+        return
+
+    if exclusive and not _acquire_scheduler_lock():
+        return
+
+    if scheduler.running:
+        return
+
+    scheduler.init_app(app)
+    scheduler.add_job(
+        id="close_out_due_periods",
+        func=close_out_due_periods,
+        trigger="interval",
+        seconds=Config.ABSENT_CLOSEOUT_CHECK_SECONDS,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True,
+    )
+    scheduler.start()
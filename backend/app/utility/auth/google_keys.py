@@ -0,0 +1,171 @@
+import json
+import os
+import re
+import threading
+import time
+
+import jwt
+import requests
+
+from app.core.config import Config
+
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+
+
+class GoogleKeyCache:
+    """
+    GoogleのIDトークン署名鍵（JWKS）のキャッシュ
+    - Cache-Control の max-age に従って保持し、期限が近づいたらバックグラウンドで更新する
+    - HTTPセッションは1つを使い回す
+    - certs_url に file:// やローカルパスを渡すと、そのJWKSファイルを読む（テスト・オフライン用）
+    """
+
+    def __init__(self, certs_url, default_ttl=3600, refresh_ratio=0.8, min_refetch_interval=30):
+        self.certs_url = certs_url
+        self.default_ttl = default_ttl
+        self.refresh_ratio = refresh_ratio
+        self.min_refetch_interval = min_refetch_interval
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # 取得を1本にまとめる（_lock より先に取る）
+        self._session = None
+        self._keys = {}  # kid -> PyJWK
+        self._fetched_at = 0.0
+        self._refresh_at = 0.0
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._stats = {"fetches": 0, "fetch_errors": 0, "background_refreshes": 0}
+
+    def reset(self):
+        """
+        fork後の子プロセスで呼ぶ（取得済みの鍵は残し、ロックとHTTPセッションを作り直す）
+        """
+        keys, fetched_at, refresh_at, expires_at = self._keys, self._fetched_at, self._refresh_at, self._expires_at
+        self._init_state()
+        self._keys, self._fetched_at, self._refresh_at, self._expires_at = keys, fetched_at, refresh_at, expires_at
+
+    def _load(self):
+        """
+        JWKSを取得し、(JWKS dict, 有効秒数) を返す
+        """
+        url = self.certs_url
+        if url.startswith("file://") or os.path.exists(url):
+            path = url[len("file://"):] if url.startswith("file://") else url
+            with open(path, encoding="utf-8") as f:
+                return json.load(f), self.default_ttl
+
+        if self._session is None:
+            self._session = requests.Session()
+        response = self._session.get(url, timeout=5)
+        response.raise_for_status()
+
+        ttl = self.default_ttl
+        match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        if match:
+            ttl = int(match.group(1)) - int(response.headers.get("Age", 0) or 0)
+        return response.json(), max(ttl, 0)
+
+    def refresh(self):
+        try:
+            jwks, ttl = self._load()
+            keys = {}
+            for data in jwks.get("keys", []):
+                key = jwt.PyJWK(data)
+                keys[key.key_id] = key
+        except Exception:
+            with self._lock:
+                self._stats["fetch_errors"] += 1
+                self._refreshing = False
+            raise
+
+        now = time.monotonic()
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = now
+            self._refresh_at = now + ttl * self.refresh_ratio
+            self._expires_at = now + ttl
+            self._refreshing = False
+            self._stats["fetches"] += 1
+
+    def _needs_refresh(self, kid, now):
+        expired = now >= self._expires_at
+        # 鍵のローテーション直後は未知のkidが来るので、間隔を空けて取り直す
+        unknown = kid not in self._keys and now - self._fetched_at >= self.min_refetch_interval
+        return expired or unknown
+
+    def _refresh_for(self, kid):
+        """
+        同期的に取り直す。同時に来たリクエストは1つだけが取得し、残りは待ってその結果を使う
+        """
+        with self._refresh_lock:
+            with self._lock:
+                needed = self._needs_refresh(kid, time.monotonic())
+            if needed:
+                self.refresh()
+
+    def _background_refresh(self):
+        try:
+            with self._refresh_lock:
+                self.refresh()
+        except Exception as e:
+            print(f"GoogleKeyCache background refresh エラー: {e}", flush=True)
+
+    def get_key(self, kid):
+        """
+        kid に対応する署名鍵を返す。通常はネットワークに出ない
+        """
+        now = time.monotonic()
+        with self._lock:
+            needed = self._needs_refresh(kid, now)
+            start_background = not needed and now >= self._refresh_at and not self._refreshing
+            if start_background:
+                self._refreshing = True
+                self._stats["background_refreshes"] += 1
+
+        if needed:
+            self._refresh_for(kid)
+        elif start_background:
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+
+        with self._lock:
+            key = self._keys.get(kid)
+        if key is None:
+            raise ValueError(f"Unknown Google signing key id: {kid}")
+        return key
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._keys)
+        return stats
+
+
+google_key_cache = GoogleKeyCache(Config.GOOGLE_CERTS_URL)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=google_key_cache.reset)
+
+
+def verify_google_id_token(token, audience, clock_skew_in_seconds=10):
+    """
+    GoogleのIDトークンをキャッシュ済みの鍵で検証し、クレームを返す
+    検証に失敗した場合は ValueError を送出する
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+        key = google_key_cache.get_key(header.get("kid"))
+        claims = jwt.decode(
+            token,
+            key.key,
+            algorithms=["RS256"],
+            audience=audience,
+            leeway=clock_skew_in_seconds,
+        )
+    except jwt.InvalidTokenError as e:
+        raise ValueError(f"Invalid Google ID token: {e}") from e
+
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {claims.get('iss')}")
+    return claims
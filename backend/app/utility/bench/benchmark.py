@@ -0,0 +1,238 @@
+"""
+Flask のテストクライアントで各エンドポイントを叩き、
+レイテンシ（p50/p95/p99）・1リクエストあたりのクエリ数・スループットを計測する。
+
+generate_synthetic_data() で投入した学生を使うので、先に `flask seed-synthetic` を実行しておくこと。
+"""
+import random
+import threading
+import time
+
+import pymysql.cursors
+
+import app.utility.cache.timetable_cache as timetable_cache
+import app.utility.db.db_user as db_user
+from app.core.config import Config
+from app.core.query_audit import QueryBudgetExceeded
+from app.utility.auth.jwt import create_access_token
+from app.utility.bench.synthetic_data import STUDENT_BASE
+from app.utility.db.db_connect import get_pool
+
+_counter = threading.local()
+
+
+def _count_queries():
+    """
+    PyMySQL が実際にサーバーへ送った文の数をスレッドごとに数える
+    （戻り値は元に戻すための関数）
+    """
+    original = pymysql.cursors.Cursor._query
+
+    def counting_query(self, q):
+        _counter.queries = getattr(_counter, "queries", 0) + 1
+        return original(self, q)
+
+    pymysql.cursors.Cursor._query = counting_query
+
+    def restore():
+        pymysql.cursors.Cursor._query = original
+    return restore
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def _load_students(limit):
+    conn = get_pool().acquire()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT s.user_id, s.google_sub, s.email, s.full_name, s.class_id, c.felica_idm
+                FROM student_users s
+                JOIN user_cards c ON c.user_id = s.user_id
+                WHERE s.user_id >= %s
+                LIMIT %s
+            """, (STUDENT_BASE, limit))
+            return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def _todays_slot(class_id):
+    conn = get_pool().acquire()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT id FROM timetables
+                WHERE class_id = %s AND date = CURDATE()
+                ORDER BY period LIMIT 1
+            """, (class_id,))
+            row = cursor.fetchone()
+            return row['id'] if row else None
+    finally:
+        conn.close()
+
+
+def _touch_entry(idm):
+    """
+    attend の前提となる「直近の入構記録」を作る
+    """
+    conn = get_pool().acquire()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO entry_logs (felica_idm) VALUES (%s)", (idm,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def build_scenarios(students):
+    """
+    エンドポイントごとに (名前, 準備関数, リクエスト関数) を作る
+    準備関数は計測前に student を受け取って実行され、リクエスト関数は (client, student) を受け取りレスポンスを返す
+    """
+    def token_for(student):
+        return create_access_token(
+            data={"sub": student['google_sub'], "email": student['email'],
+                  "name": student['full_name'], "isTeacher": False}
+        )
+
+    def get_timetable(client, student):
+        return client.get("/api/timetables/", headers={"Authorization": f"Bearer {token_for(student)}"})
+
+    def get_summary(client, student):
+        return client.get(f"/api/attendance/summary?user_id={student['user_id']}")
+
+    slots = {}
+
+    def prepare_attend(student):
+        class_id = student['class_id']
+        if class_id not in slots:
+            slots[class_id] = _todays_slot(class_id)
+        _touch_entry(student['felica_idm'])
+
+    def attend(client, student):
+        return client.post("/api/attendance/attend",
+                           json={"user_id": student['user_id'], "timetable_id": slots[student['class_id']]})
+
+    return [
+        ("GET /api/timetables/", None, get_timetable),
+        ("GET /api/attendance/summary", None, get_summary),
+        ("POST /api/attendance/attend", prepare_attend, attend),
+    ]
+
+
+def run_benchmark(app, requests_per_endpoint=500, concurrency=4, student_sample=1000,
+                  cold_cache=False, endpoints=None, seed=0, log=print):
+    """
+    各エンドポイントを計測し、結果の辞書のリストを返す
+    cold_cache=True の場合は毎リクエスト前にアプリ内キャッシュを空にする
+    """
+    if not Config.JWT_SECRET_KEY:
+        Config.JWT_SECRET_KEY = "benchmark"
+
+    students = _load_students(student_sample)
+    if not students:
+        raise RuntimeError("架空データがありません。先に flask seed-synthetic を実行してください")
+
+    rng = random.Random(seed)
+    restore = _count_queries()
+    results = []
+    try:
+        for name, prepare, request_func in build_scenarios(students):
+            if endpoints and name not in endpoints:
+                continue
+
+            latencies = []
+            queries = []
+            errors = [0]
+            lock = threading.Lock()
+            per_worker = max(1, requests_per_endpoint // concurrency)
+            picks = [[rng.choice(students) for _ in range(per_worker)] for _ in range(concurrency)]
+
+            def worker(picked):
+                client = app.test_client()
+                for student in picked:
+                    if prepare:
+                        prepare(student)
+                    if cold_cache:
+                        db_user.student_info_cache.clear()
+                        timetable_cache.week_cache.clear()
+                        timetable_cache.status_cache.clear()
+                    _counter.queries = 0
+                    started = time.perf_counter()
+                    response = request_func(client, student)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed * 1000)
+                        queries.append(_counter.queries)
+                        if response.status_code >= 400:
+                            errors[0] += 1
+
+            threads = [threading.Thread(target=worker, args=(p,)) for p in picks]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            wall = time.perf_counter() - started
+
+            result = {
+                "endpoint": name,
+                "requests": len(latencies),
+                "errors": errors[0],
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "queries_per_request": round(sum(queries) / len(queries), 2) if queries else 0,
+                "throughput_rps": round(len(latencies) / wall, 1) if wall else 0,
+            }
+            results.append(result)
+            log(result)
+    finally:
+        restore()
+
+    return results
+
+
+def run_query_audit(app, samples=5):
+    """
+    build_scenarios() の各エンドポイントをクエリ監査（strict）付きで samples 人分実行し、
+    [(名前, 違反メッセージのリスト)] を返す
+    """
+    if not Config.JWT_SECRET_KEY:
+        Config.JWT_SECRET_KEY = "benchmark"
+
+    students = _load_students(samples)
+    if not students:
+        raise RuntimeError("架空データがありません。先に flask seed-synthetic を実行してください")
+
+    keys = ("QUERY_AUDIT_ENABLED", "QUERY_AUDIT_STRICT", "TESTING")
+    saved = {key: app.config.get(key) for key in keys}
+    app.config.update(QUERY_AUDIT_ENABLED=True, QUERY_AUDIT_STRICT=True, TESTING=True)
+    results = []
+    try:
+        client = app.test_client()
+        for name, prepare, request_func in build_scenarios(students):
+            problems = []
+            for student in students:
+                if prepare:
+                    prepare(student)
+                try:
+                    response = request_func(client, student)
+                    if response.status_code >= 500:
+                        problems.append(f"HTTP {response.status_code}")
+                except QueryBudgetExceeded as e:
+                    problems.append(str(e))
+            results.append((name, problems))
+    finally:
+        app.config.update(saved)
+
+    return results
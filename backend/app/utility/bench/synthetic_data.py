@@ -0,0 +1,264 @@
+"""
+負荷検証用の架空キャンパスデータを生成してDBに投入する。
+
+学科ID 900〜、教員ID 90000000〜、学生ID 91000000〜 の範囲を使うので、
+既存の初期データとは衝突せず、reset_synthetic_data() でまとめて削除できる。
+"""
+import datetime
+import random
+
+from app.utility.db.db_connect import get_pool
+
+DEPARTMENT_BASE = 900
+TEACHER_BASE = 90000000
+STUDENT_BASE = 91000000
+
+STATUS_WEIGHTS = [
+    ('出席', 85),
+    ('遅刻', 5),
+    ('欠席', 7),
+    ('早退', 1),
+    ('公欠', 2),
+]
+
+FAMILY_NAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+GIVEN_NAMES = ["翔", "陽菜", "蓮", "結衣", "大翔", "葵", "湊", "凛", "悠真", "芽依"]
+SUBJECT_WORDS = ["プログラミング", "ネットワーク", "データベース", "セキュリティ", "デザイン",
+                 "ビジネス実務", "英語", "情報処理", "クラウド", "AI基礎", "キャリア", "PBL"]
+
+
+def _insert_many(cursor, sql, rows, chunk_size=5000):
+    """
+    PyMySQL の executemany（複数行INSERTにまとめられる）をチャンクごとに実行する
+    """
+    for i in range(0, len(rows), chunk_size):
+        cursor.executemany(sql, rows[i:i + chunk_size])
+
+
+def _school_days(start, weeks):
+    day = start - datetime.timedelta(days=start.weekday())
+    end = day + datetime.timedelta(weeks=weeks)
+    while day < end:
+        if day.weekday() < 5:
+            yield day
+        day += datetime.timedelta(days=1)
+
+
+def reset_synthetic_data():
+    """
+    生成済みの架空データを削除する
+    """
+    conn = get_pool().acquire()
+    try:
+        with conn.cursor() as cursor:
+            student_range = (STUDENT_BASE, STUDENT_BASE + 9999999)
+            teacher_range = (TEACHER_BASE, STUDENT_BASE - 1)
+            # 後から追加された機能（通知・チャット・繰り返しルール）が作った行も外部キーの順に消す
+            cursor.execute("DELETE FROM notifications WHERE user_id BETWEEN %s AND %s", student_range)
+            cursor.execute("DELETE FROM chat_logs WHERE user_id BETWEEN %s AND %s", student_range)
+            cursor.execute("DELETE FROM attendance WHERE user_id BETWEEN %s AND %s", student_range)
+            cursor.execute("DELETE FROM attendance_counters WHERE user_id BETWEEN %s AND %s", student_range)
+            cursor.execute("""
+                DELETE e FROM entry_logs e
+                JOIN user_cards c ON e.felica_idm = c.felica_idm
+                WHERE c.user_id BETWEEN %s AND %s
+            """, student_range)
+            cursor.execute("DELETE FROM user_cards WHERE user_id BETWEEN %s AND %s", student_range)
+            cursor.execute("DELETE FROM student_users WHERE user_id BETWEEN %s AND %s", student_range)
+            cursor.execute("""
+                DELETE t FROM timetables t
+                JOIN classes c ON t.class_id = c.id
+                WHERE c.department_id >= %s
+            """, (DEPARTMENT_BASE,))
+            cursor.execute("""
+                DELETE o FROM timetable_overrides o
+                JOIN timetable_rules r ON o.rule_id = r.id
+                JOIN classes c ON r.class_id = c.id
+                WHERE c.department_id >= %s
+                OR r.teacher_id BETWEEN %s AND %s
+                OR o.teacher_id BETWEEN %s AND %s
+            """, (DEPARTMENT_BASE, *teacher_range, *teacher_range))
+            cursor.execute("""
+                DELETE r FROM timetable_rules r
+                JOIN classes c ON r.class_id = c.id
+                WHERE c.department_id >= %s
+                OR r.teacher_id BETWEEN %s AND %s
+            """, (DEPARTMENT_BASE, *teacher_range))
+            cursor.execute("DELETE FROM classes WHERE department_id >= %s", (DEPARTMENT_BASE,))
+            cursor.execute("DELETE FROM major WHERE department_id >= %s", (DEPARTMENT_BASE,))
+            cursor.execute("DELETE FROM departments WHERE id >= %s", (DEPARTMENT_BASE,))
+            cursor.execute("DELETE FROM teacher_users WHERE user_id BETWEEN %s AND %s", teacher_range)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def generate_synthetic_data(students=5000, class_size=40, grades=2, start=None, weeks=40,
+                            periods_per_day=4, subjects_per_class=12, teachers=80,
+                            with_attendance=True, seed=0, log=print):
+    """
+    架空の学科・クラス・専攻・学生・カード・時間割・入構記録・出席を生成する
+    start から weeks 週分の平日に時間割を作り、今日より前の授業には出席と入構記録を付ける
+    戻り値: 種類ごとの投入件数
+    """
+    rng = random.Random(seed)
+    start = start or datetime.date.today() - datetime.timedelta(weeks=weeks // 2)
+    today = datetime.date.today()
+    counts = {}
+
+    class_count = max(1, -(-students // class_size))
+    # 学科IDは 100〜999 の制約があるので最大100学科に収める
+    departments = min(100, max(1, -(-class_count // grades)))
+
+    conn = get_pool().acquire()
+    try:
+        with conn.cursor() as cursor:
+            # 学科・専攻
+            department_ids = [DEPARTMENT_BASE + i for i in range(departments)]
+            _insert_many(cursor, "INSERT INTO departments (id, name) VALUES (%s, %s)",
+                         [(d, f"負荷検証学科{d}") for d in department_ids])
+            _insert_many(cursor, "INSERT INTO major (name, department_id) VALUES (%s, %s)",
+                         [(f"専攻{k + 1}", d) for d in department_ids for k in range(2)])
+            cursor.execute("SELECT id, department_id FROM major WHERE department_id >= %s", (DEPARTMENT_BASE,))
+            majors_of = {}
+            for row in cursor.fetchall():
+                majors_of.setdefault(row['department_id'], []).append(row['id'])
+
+            # 教員・教科
+            teacher_ids = [TEACHER_BASE + i for i in range(teachers)]
+            _insert_many(cursor, "INSERT INTO teacher_users (user_id, email, full_name) VALUES (%s, %s, %s)",
+                         [(t, f"{t}@synthetic.local", rng.choice(FAMILY_NAMES) + rng.choice(GIVEN_NAMES))
+                          for t in teacher_ids])
+            cursor.execute("SELECT id FROM subjects")
+            subject_ids = [row['id'] for row in cursor.fetchall()]
+            if len(subject_ids) < subjects_per_class:
+                new_subjects = [(f"{rng.choice(SUBJECT_WORDS)}{n}",) for n in range(subjects_per_class * 2)]
+                _insert_many(cursor, "INSERT INTO subjects (name) VALUES (%s)", new_subjects)
+                cursor.execute("SELECT id FROM subjects")
+                subject_ids = [row['id'] for row in cursor.fetchall()]
+
+            # クラス
+            class_rows = []
+            for i in range(class_count):
+                department_id = department_ids[i % departments]
+                grade = (i // departments) % grades + 1
+                class_rows.append((department_id, grade, f"負荷検証{department_id}-{grade}年"))
+            _insert_many(cursor, "INSERT INTO classes (department_id, grade, class_name) VALUES (%s, %s, %s)",
+                         class_rows)
+            cursor.execute("SELECT id, department_id FROM classes WHERE department_id >= %s ORDER BY id",
+                           (DEPARTMENT_BASE,))
+            classes = cursor.fetchall()
+            counts['classes'] = len(classes)
+
+            # 学生・カード
+            student_rows = []
+            card_rows = []
+            members = {}
+            for n in range(students):
+                klass = classes[n % len(classes)]
+                user_id = STUDENT_BASE + n
+                major_id = rng.choice(majors_of[klass['department_id']])
+                student_rows.append((user_id, f"{user_id}@synthetic.local", f"synthetic-{user_id}",
+                                     today.year - 1, rng.choice(FAMILY_NAMES) + rng.choice(GIVEN_NAMES),
+                                     klass['id'], major_id))
+                card_rows.append((user_id, f"{user_id:016X}"))
+                members.setdefault(klass['id'], []).append((user_id, major_id))
+            _insert_many(cursor, """
+                INSERT INTO student_users (user_id, email, google_sub, admission_year, full_name, class_id, major_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, student_rows)
+            _insert_many(cursor, "INSERT INTO user_cards (user_id, felica_idm) VALUES (%s, %s)", card_rows)
+            counts['students'] = len(student_rows)
+            conn.commit()
+            log(f"classes={len(classes)} students={len(student_rows)}")
+
+            # 時間割（クラスごとに週の型を決めて繰り返す）
+            days = list(_school_days(start, weeks))
+            timetable_rows = []
+            for klass in classes:
+                pool = rng.sample(subject_ids, min(subjects_per_class, len(subject_ids)))
+                pattern = {}
+                for weekday in range(5):
+                    for period in range(1, periods_per_day + 1):
+                        major_id = rng.choice(majors_of[klass['department_id']]) if rng.random() < 0.2 else None
+                        pattern[(weekday, period)] = (rng.choice(pool), rng.choice(teacher_ids), major_id)
+                for day in days:
+                    for period in range(1, periods_per_day + 1):
+                        subject_id, teacher_id, major_id = pattern[(day.weekday(), period)]
+                        timetable_rows.append((klass['id'], major_id, day, period, subject_id, teacher_id))
+            _insert_many(cursor, """
+                INSERT INTO timetables (class_id, major_id, date, period, subject_id, teacher_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, timetable_rows)
+            conn.commit()
+            counts['timetables'] = len(timetable_rows)
+            log(f"timetables={len(timetable_rows)}")
+
+            if with_attendance:
+                cursor.execute("""
+                    SELECT t.id, t.class_id, t.major_id, t.date
+                    FROM timetables t
+                    JOIN classes c ON t.class_id = c.id
+                    WHERE c.department_id >= %s AND t.date < %s
+                """, (DEPARTMENT_BASE, today))
+                past_slots = cursor.fetchall()
+
+                statuses = [s for s, _ in STATUS_WEIGHTS]
+                weights = [w for _, w in STATUS_WEIGHTS]
+                attendance_rows = []
+                entered = set()
+                entry_rows = []
+                for slot in past_slots:
+                    for user_id, major_id in members.get(slot['class_id'], []):
+                        if slot['major_id'] is not None and slot['major_id'] != major_id:
+                            continue
+                        status = rng.choices(statuses, weights)[0]
+                        attendance_rows.append((user_id, slot['id'], status))
+                        if status != '欠席' and (user_id, slot['date']) not in entered:
+                            entered.add((user_id, slot['date']))
+                            entered_at = datetime.datetime.combine(slot['date'], datetime.time(8, 30)) \
+                                + datetime.timedelta(minutes=rng.randint(0, 50))
+                            entry_rows.append((f"{user_id:016X}", entered_at))
+
+                    if len(attendance_rows) >= 50000:
+                        _insert_many(cursor, "INSERT INTO attendance (user_id, timetable_id, status) VALUES (%s, %s, %s)",
+                                     attendance_rows)
+                        conn.commit()
+                        counts['attendance'] = counts.get('attendance', 0) + len(attendance_rows)
+                        attendance_rows = []
+                _insert_many(cursor, "INSERT INTO attendance (user_id, timetable_id, status) VALUES (%s, %s, %s)",
+                             attendance_rows)
+                counts['attendance'] = counts.get('attendance', 0) + len(attendance_rows)
+                _insert_many(cursor, "INSERT INTO entry_logs (felica_idm, entered_at) VALUES (%s, %s)", entry_rows)
+                counts['entry_logs'] = len(entry_rows)
+
+                # 集計テーブルを作り直す
+                cursor.execute("""
+                    REPLACE INTO attendance_counters (user_id, subject_id, present, absent, late, early, public_absent, total)
+                    SELECT
+                        a.user_id,
+                        t.subject_id,
+                        SUM(CASE WHEN a.status = '出席' THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN a.status = '欠席' THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN a.status = '遅刻' THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN a.status = '早退' THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN a.status = '公欠' THEN 1 ELSE 0 END),
+                        COUNT(*)
+                    FROM attendance a
+                    JOIN timetables t ON a.timetable_id = t.id
+                    WHERE a.user_id BETWEEN %s AND %s
+                    GROUP BY a.user_id, t.subject_id
+                """, (STUDENT_BASE, STUDENT_BASE + students))
+                conn.commit()
+                log(f"attendance={counts['attendance']} entry_logs={counts['entry_logs']}")
+
+        return counts
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,90 @@
+import datetime
+import threading
+
+
+class EntryIndex:
+    """
+    当日の入構記録をFeliCa IDmごとに保持するインメモリ索引
+    時刻はDBの時計（NOW()）に合わせて保持し、日付が変わったら丸ごと破棄する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._latest = {}  # idm -> その日の最新入構時刻
+        self._offset = datetime.timedelta(0)  # DB時計 - アプリ時計
+        self._warmed = False
+
+    def now(self):
+        """
+        DBの時計に換算した現在時刻
+        """
+        return datetime.datetime.now() + self._offset
+
+    def _roll(self, now):
+        if self._day != now.date():
+            self._day = now.date()
+            self._latest = {}
+            self._warmed = False
+
+    @property
+    def warmed(self):
+        with self._lock:
+            self._roll(self.now())
+            return self._warmed
+
+    def load(self, db_now, rows):
+        """
+        DBから取得した当日分の (felica_idm, entered_at) で索引を作り直す
+        """
+        with self._lock:
+            self._offset = db_now - datetime.datetime.now()
+            self._day = db_now.date()
+            self._latest = {}
+            for idm, entered_at in rows:
+                if entered_at.date() == self._day:
+                    prev = self._latest.get(idm)
+                    if prev is None or entered_at > prev:
+                        self._latest[idm] = entered_at
+            self._warmed = True
+
+    def entered_today(self, idm):
+        with self._lock:
+            self._roll(self.now())
+            return idm in self._latest
+
+    def recent_entry(self, idm, minutes):
+        """
+        minutes 分以内の入構時刻を返す（なければ None）
+        """
+        with self._lock:
+            now = self.now()
+            self._roll(now)
+            entered_at = self._latest.get(idm)
+        if entered_at and entered_at >= now - datetime.timedelta(minutes=minutes):
+            return entered_at
+        return None
+
+    def record(self, idm, entered_at=None):
+        with self._lock:
+            now = self.now()
+            self._roll(now)
+            entered_at = entered_at or now
+            if entered_at.date() != self._day:
+                return
+            prev = self._latest.get(idm)
+            if prev is None or entered_at > prev:
+                self._latest[idm] = entered_at
+
+    def clear(self):
+        with self._lock:
+            self._day = None
+            self._latest = {}
+            self._warmed = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._latest)
+
+
+entry_index = EntryIndex()
@@ -0,0 +1,155 @@
+import heapq
+import math
+import threading
+import unicodedata
+
+# 区切りとして扱う文字（空白・句読点・記号は n-gram に含めない）
+_SEPARATOR_CATEGORIES = ("Z", "P", "S", "C")
+
+# フィールドごとの重み（質問文に一致したものを優先する）
+FIELD_WEIGHTS = {"question": 3.0, "category": 2.0, "answer": 1.0}
+
+
+def normalize(text):
+    """
+    NFKC 正規化・小文字化し、区切り文字で分割した断片のリストを返す
+    （全角英数と半角英数、カタカナの全角・半角を同一視する）
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    chunks, current = [], []
+    for ch in text:
+        if unicodedata.category(ch)[0] in _SEPARATOR_CATEGORIES:
+            if current:
+                chunks.append("".join(current))
+                current = []
+        else:
+            current.append(ch)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def ngrams(text, n=2):
+    """
+    文字 n-gram の出現回数 {gram: count}。n 文字未満の断片はそのまま1 gram にする
+    """
+    counts = {}
+    for chunk in normalize(text):
+        if len(chunk) < n:
+            grams = [chunk]
+        else:
+            grams = [chunk[i:i + n] for i in range(len(chunk) - n + 1)]
+        for gram in grams:
+            counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+class FaqIndex:
+    """
+    FAQ の文字 n-gram 転置インデックス（形態素解析なしで日本語を検索できる）
+    - postings: gram -> {faq_id: フィールド重み付きの出現回数}
+    - upsert / remove で1件ずつ更新できる
+    """
+
+    def __init__(self, n=2):
+        self.n = n
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._doc_grams = {}  # faq_id -> {gram: weight}（削除・更新用）
+        self._docs = {}  # faq_id -> 行
+        self.synced_at = None  # 取り込んだ行の updated_at の最大値
+        self.checked_at = 0.0  # 最後にDBと突き合わせた時刻（time.monotonic）
+        self.loaded = False
+
+    def _grams_for(self, row):
+        weights = {}
+        for field, field_weight in FIELD_WEIGHTS.items():
+            for gram, count in ngrams(row.get(field), self.n).items():
+                weights[gram] = weights.get(gram, 0.0) + count * field_weight
+        return weights
+
+    def _remove_locked(self, faq_id):
+        for gram in self._doc_grams.pop(faq_id, {}):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.pop(faq_id, None)
+                if not posting:
+                    del self._postings[gram]
+        self._docs.pop(faq_id, None)
+
+    def upsert(self, row):
+        grams = self._grams_for(row)
+        with self._lock:
+            self._remove_locked(row["id"])
+            for gram, weight in grams.items():
+                self._postings.setdefault(gram, {})[row["id"]] = weight
+            self._doc_grams[row["id"]] = grams
+            self._docs[row["id"]] = row
+            if row.get("updated_at") and (self.synced_at is None or row["updated_at"] > self.synced_at):
+                self.synced_at = row["updated_at"]
+
+    def remove(self, faq_id):
+        with self._lock:
+            self._remove_locked(faq_id)
+
+    def load(self, rows):
+        """
+        全件で作り直す（作り終えてから差し替えるので、その間も検索できる）
+        """
+        postings, doc_grams, docs, synced_at = {}, {}, {}, None
+        for row in rows:
+            grams = self._grams_for(row)
+            for gram, weight in grams.items():
+                postings.setdefault(gram, {})[row["id"]] = weight
+            doc_grams[row["id"]] = grams
+            docs[row["id"]] = row
+            if row.get("updated_at") and (synced_at is None or row["updated_at"] > synced_at):
+                synced_at = row["updated_at"]
+        with self._lock:
+            self._postings, self._doc_grams, self._docs = postings, doc_grams, docs
+            self.synced_at = synced_at
+            self.loaded = True
+
+    def search(self, query, limit=10, category=None):
+        """
+        クエリの n-gram に一致した FAQ を TF-IDF 風のスコア順に返す
+        戻り値: [(score, 行), ...]
+        """
+        query_grams = ngrams(query, self.n)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            total = len(self._docs)
+            scores = {}
+            for gram, query_count in query_grams.items():
+                posting = self._postings.get(gram)
+                if not posting:
+                    continue
+                idf = math.log(1 + total / len(posting))
+                for faq_id, weight in posting.items():
+                    scores[faq_id] = scores.get(faq_id, 0.0) + query_count * weight * idf
+            if category is not None:
+                scores = {faq_id: s for faq_id, s in scores.items() if self._docs[faq_id]["category"] == category}
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [(round(score, 4), self._docs[faq_id]) for faq_id, score in top]
+
+    def rows(self):
+        with self._lock:
+            return list(self._docs.values())
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._doc_grams = {}
+            self._docs = {}
+            self.synced_at = None
+            self.checked_at = 0.0
+            self.loaded = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._docs)
+
+
+faq_index = FaqIndex()
@@ -0,0 +1,47 @@
+import time
+
+from app.core.config import Config
+from app.utility.db.db_cache_version import get_cache_versions, bump_cache_version
+
+# キャッシュ名 -> 版数が変わったときに呼ぶ関数のリスト
+_listeners = {}
+# 最後に読んだ版数（cache_versions）と、読んだ時刻（time.monotonic）
+_state = {"versions": None, "checked_at": 0.0}
+
+
+def on_change(name, callback):
+    """
+    他のプロセスが name の版数を上げたときに callback を呼ぶよう登録する
+    """
+    _listeners.setdefault(name, []).append(callback)
+
+
+def sync():
+    """
+    CACHE_VERSION_CHECK_SECONDS ごとに全キャッシュの版数を1回のクエリで読み、
+    他のプロセス（別のワーカーや CLI）が変更したキャッシュを破棄する
+    """
+    now = time.monotonic()
+    if now - _state["checked_at"] < Config.CACHE_VERSION_CHECK_SECONDS:
+        return
+    _state["checked_at"] = now
+
+    versions = get_cache_versions()
+    if versions is None:
+        return
+    previous = _state["versions"]
+    _state["versions"] = versions
+    if previous is None:
+        return
+    for name, callbacks in _listeners.items():
+        if versions.get(name, 0) != previous.get(name, 0):
+            for callback in callbacks:
+                callback()
+
+
+def bump(name):
+    """
+    name の版数を上げて、他のプロセスにキャッシュを破棄させる
+    """
+    if not bump_cache_version(name):
+        print(f"{name} の版数を更新できませんでした（他のプロセスは TTL まで古いキャッシュを返します）", flush=True)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+
+from app.core.config import Config
+from app.utility.cache import shared_versions
+from app.utility.cache.ttl_cache import TTLCache
+from app.utility.db.db_connect import primary_reads
+from app.utility.db.db_timetable import (
+    get_timetable, get_attendance_statuses, expand_timetable_rules,
+)
+
+# (class_id, major_id, start_date, end_date) -> (整形済みの時間割, ダイジェスト)
+week_cache = TTLCache(maxsize=Config.TIMETABLE_CACHE_SIZE, ttl=Config.TIMETABLE_CACHE_TTL)
+# (user_id, start_date, end_date) -> {timetable_id: status}
+status_cache = TTLCache(maxsize=Config.TIMETABLE_STATUS_CACHE_SIZE, ttl=Config.TIMETABLE_STATUS_CACHE_TTL)
+# (class_id, department_id, start_date, end_date) -> True（その期間の繰り返しルールを展開済み）
+expanded_cache = TTLCache(maxsize=Config.TIMETABLE_CACHE_SIZE, ttl=Config.TIMETABLE_CACHE_TTL)
+# ETag -> レスポンス本文（JSON bytes）
+body_cache = TTLCache(maxsize=Config.TIMETABLE_STATUS_CACHE_SIZE, ttl=Config.TIMETABLE_STATUS_CACHE_TTL)
+
+
+def _format_entry(entry):
+    return {
+        "id": entry['id'],
+        "date": entry['date'].strftime('%Y-%m-%d'),
+        "period": entry['period'],
+        "subject_name": entry['subject_name'],
+        "teacher_name": entry['teacher_name'],
+        "major_id": entry['major_id'],
+        "start_time": str(entry['start_time']) if entry['start_time'] else None,
+        "end_time": str(entry['end_time']) if entry['end_time'] else None,
+    }
+
+
+def _clear_weeks():
+    week_cache.clear()
+    expanded_cache.clear()
+    body_cache.clear()
+
+
+# 他のプロセス（別のワーカーや flask import-timetable）が時間割を変更したら破棄する
+shared_versions.on_change("timetables", _clear_weeks)
+
+
+def expand_rules(start_date, end_date, class_id=None, department_id=None):
+    """
+    期間内の繰り返しルールを時間割の行に展開する（同じ範囲は TTL の間1度だけ）
+    """
+    shared_versions.sync()
+    _expand_rules(start_date, end_date, class_id, department_id)
+
+
+def _expand_rules(start_date, end_date, class_id=None, department_id=None):
+    """
+    戻り値: 今回展開を実行したか（展開済みの範囲や、展開に失敗した場合は False）
+    """
+    key = (class_id, department_id, start_date, end_date)
+    if expanded_cache.get(key):
+        return False
+    if expand_timetable_rules(start_date, end_date, class_id, department_id) is None:
+        return False
+    expanded_cache.set(key, True)
+    return True
+
+
+def get_week(class_id, major_id, start_date, end_date):
+    """
+    クラス共通の時間割（出席ステータスなし）を整形済みで返す
+    """
+    shared_versions.sync()
+    key = (class_id, major_id, start_date, end_date)
+    cached = week_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if _expand_rules(start_date, end_date, class_id=class_id):
+        # 展開した行（このプロセスか、直前に他のプロセスが作ったもの）はレプリカにまだ届いていないことがあるので、
+        # 展開した直後の1回はプライマリから読んでキャッシュする
+        with primary_reads():
+            timetable = get_timetable(class_id, major_id, start_date, end_date)
+    else:
+        timetable = get_timetable(class_id, major_id, start_date, end_date)
+    entries = [_format_entry(entry) for entry in timetable]
+    digest = hashlib.sha1(json.dumps(entries, ensure_ascii=False).encode("utf-8")).hexdigest()
+    week = (entries, digest)
+    # 空の結果（休校週やDBエラー）はキャッシュしない
+    if entries:
+        week_cache.set(key, week)
+    return week
+
+
+def get_statuses(user_id, start_date, end_date):
+    """
+    ユーザーの出席ステータスを返す（出席の登録・更新で破棄される）
+    """
+    key = (user_id, start_date, end_date)
+    cached = status_cache.get(key)
+    if cached is not None:
+        return cached
+
+    statuses = get_attendance_statuses(user_id, start_date, end_date)
+    if statuses is None:
+        return {}
+    status_cache.set(key, statuses)
+    return statuses
+
+
+def make_etag(digest, statuses):
+    overlay = json.dumps(sorted(statuses.items()), ensure_ascii=False)
+    return hashlib.sha1(f"{digest}:{overlay}".encode("utf-8")).hexdigest()
+
+
+def render(etag, entries, statuses):
+    """
+    出席ステータスを重ねたJSON本文を返す（ETagごとにキャッシュ）
+    """
+    body = body_cache.get(etag)
+    if body is None:
+        data = [dict(entry, attendance_status=statuses.get(entry["id"])) for entry in entries]
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        body_cache.set(etag, body)
+    return body
+
+
+def invalidate_statuses(user_id):
+    status_cache.invalidate_where(lambda key, value: str(key[0]) == str(user_id))
+
+
+def invalidate_all_statuses():
+    """
+    複数ユーザーの出席をまとめて変更したときに呼ぶ
+    """
+    status_cache.clear()
+    body_cache.clear()
+
+
+def invalidate_weeks():
+    """
+    時間割データ（繰り返しルールを含む）を変更したときに呼ぶ
+    このプロセスのキャッシュを破棄し、版数を上げて他のプロセスにも破棄させる
+    """
+    _clear_weeks()
+    shared_versions.bump("timetables")
@@ -0,0 +1,136 @@
+"""
+チャットボットの言語モデル。
+
+ChatModel を実装したクラスを set_chat_model() で差し替えられる。
+CHAT_MODEL_BACKEND=stub ではAPIを呼ばない StubChatModel を使う（テスト・オフライン用）。
+"""
+import threading
+from abc import ABC, abstractmethod
+
+from app.core.config import Config
+
+SYSTEM_PROMPT = (
+    "あなたは専門学校の学生生活をサポートするアシスタントです。"
+    "学校のFAQを参考に、日本語で簡潔に答えてください。"
+    "FAQにない学校固有の情報は推測せず、窓口への確認を勧めてください。"
+)
+
+
+class ChatModelError(Exception):
+    """
+    モデルの呼び出しに失敗した
+    """
+
+
+class ChatModel(ABC):
+    """
+    チャットモデルのインターフェース
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def generate(self, message, context=()):
+        """
+        message: 学生の質問
+        context: 参考情報（FAQ の質問・回答の組など）の文字列のリスト
+        戻り値: 回答の文字列。失敗時は ChatModelError を送出する
+        """
+
+
+def build_prompt(message, context=()):
+    parts = [SYSTEM_PROMPT]
+    if context:
+        parts.append("参考FAQ:\n" + "\n".join(f"- {item}" for item in context))
+    parts.append(f"質問: {message}")
+    return "\n\n".join(parts)
+
+
+class GeminiChatModel(ChatModel):
+    """
+    google-generativeai（Gemini）で回答を生成する
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key, model_name, timeout=20):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.timeout = timeout
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if not self.api_key:
+                        raise ChatModelError("GOOGLE_API_KEY is not set")
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, message, context=()):
+        try:
+            response = self._get_model().generate_content(
+                build_prompt(message, context),
+                request_options={"timeout": self.timeout},
+            )
+            text = response.text
+        except ChatModelError:
+            raise
+        except Exception as e:
+            raise ChatModelError(str(e)) from e
+        if not text:
+            raise ChatModelError("empty response")
+        return text.strip()
+
+
+class StubChatModel(ChatModel):
+    """
+    APIを呼ばないモデル。answers に正規化前の質問 -> 回答を渡すとそれを返し、
+    なければ参考FAQの先頭か決まり文句を返す。呼び出し回数を calls に数える
+    """
+
+    name = "stub"
+
+    def __init__(self, answers=None):
+        self.answers = dict(answers or {})
+        self.calls = 0
+
+    def generate(self, message, context=()):
+        self.calls += 1
+        if message in self.answers:
+            return self.answers[message]
+        if context:
+            return context[0]
+        return "すみません、その質問にはお答えできません。窓口に確認してください。"
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_chat_model():
+    """
+    CHAT_MODEL_BACKEND に応じたモデルを返す（初回呼び出し時に作成）
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if Config.CHAT_MODEL_BACKEND == "stub":
+                    _model = StubChatModel()
+                else:
+                    _model = GeminiChatModel(Config.GOOGLE_API_KEY, Config.GEMINI_MODEL, Config.GEMINI_TIMEOUT)
+    return _model
+
+
+def set_chat_model(model):
+    """
+    モデルを差し替える（テストではスタブを渡す）。None を渡すと設定に従って作り直す
+    """
+    global _model
+    with _model_lock:
+        _model = model
@@ -0,0 +1,107 @@
+"""
+チャットボットの回答。正規化した質問で回答キャッシュを引き、なければモデルを呼ぶ。
+
+回答キャッシュは FAQ（質問 -> 回答）と最近の chat_logs で初期化する。
+モデルには FAQ 検索の上位を参考情報として渡す。
+"""
+import threading
+import time
+
+from app.core.config import Config
+from app.utility.cache.faq_index import faq_index, normalize
+from app.utility.cache.ttl_cache import TTLCache
+from app.utility.chat.chat_model import get_chat_model
+import app.utility.db.db_chat as db_chat
+import app.utility.db.db_faq as db_faq
+
+# 正規化した質問 -> 回答
+answer_cache = TTLCache(maxsize=Config.CHAT_CACHE_SIZE, ttl=Config.CHAT_CACHE_TTL)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "cache_hits": 0,
+    "model_calls": 0,
+    "model_errors": 0,
+    "model_seconds": 0.0,
+}
+
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+def normalize_question(message):
+    """
+    表記ゆれ（全角・半角、大文字・小文字、空白・句読点・記号）を除いた質問文
+    """
+    return "".join(normalize(message))
+
+
+def seed_answer_cache(log_limit=None):
+    """
+    FAQ と最近のチャット履歴で回答キャッシュを埋める
+    同じ質問が複数ある場合は FAQ の回答を優先し、次に新しい履歴を使う
+    戻り値: 登録した件数
+    """
+    log_limit = Config.CHAT_SEED_LOG_LIMIT if log_limit is None else log_limit
+    seeded = {}
+    # 古い履歴から順に入れ、新しい履歴・FAQ で上書きする
+    for row in reversed(db_chat.get_recent_chat_answers(log_limit) if log_limit else []):
+        key = normalize_question(row['message'])
+        if key:
+            seeded[key] = row['response']
+    db_faq.refresh_faq_index()
+    for row in faq_index.rows():
+        key = normalize_question(row['question'])
+        if key:
+            seeded[key] = row['answer']
+
+    for key, response in seeded.items():
+        answer_cache.set(key, response)
+    return len(seeded)
+
+
+def answer(message):
+    """
+    質問に回答する
+    戻り値: (回答, 出典)。出典は "cache" または "model"
+    モデルの呼び出しに失敗した場合は ChatModelError を送出する
+    """
+    _count("requests")
+    key = normalize_question(message)
+    if key:
+        cached = answer_cache.get(key)
+        if cached is not None:
+            _count("cache_hits")
+            return cached, "cache"
+
+    context = [
+        f"Q: {hit['question']} A: {hit['answer']}"
+        for hit in db_faq.search_faq(message, limit=Config.CHAT_FAQ_CONTEXT)
+    ]
+
+    started = time.perf_counter()
+    _count("model_calls")
+    try:
+        response = get_chat_model().generate(message, context)
+    except Exception:
+        _count("model_errors")
+        raise
+    finally:
+        _count("model_seconds", time.perf_counter() - started)
+
+    if key:
+        answer_cache.set(key, response)
+    return response, "model"
+
+
+def stats():
+    """
+    回答キャッシュのヒット率とモデル呼び出しの統計
+    """
+    with _stats_lock:
+        result = dict(_stats)
+    result["hit_rate"] = round(result["cache_hits"] / result["requests"], 4) if result["requests"] else 0.0
+    return result
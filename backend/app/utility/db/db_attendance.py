@@ -1,4 +1,136 @@
-from app.utility.db.db_connect import db_connect
+import datetime
+import json
+
+import pymysql
+
+from app.core.config import Config
+from app.utility.db.db_connect import db_connect, read_only, mark_user_write
+from app.utility.cache.timetable_cache import invalidate_statuses, invalidate_all_statuses
+from app.utility.db.db_timetable import SLOT_MAJOR_CONFLICT
+
+# attendance.status と attendance_counters の列の対応
+STATUS_COLUMNS = {
+    '出席': 'present',
+    '欠席': 'absent',
+    '遅刻': 'late',
+    '早退': 'early',
+    '公欠': 'public_absent',
+}
+
+COUNTER_COLUMNS = list(STATUS_COLUMNS.values()) + ['total']
+
+def _counter_deltas(old_status=None, new_status=None):
+    deltas = dict.fromkeys(COUNTER_COLUMNS, 0)
+    if old_status in STATUS_COLUMNS:
+        deltas[STATUS_COLUMNS[old_status]] -= 1
+        deltas['total'] -= 1
+    if new_status in STATUS_COLUMNS:
+        deltas[STATUS_COLUMNS[new_status]] += 1
+        deltas['total'] += 1
+    return deltas
+
+def _counter_upsert_clause():
+    return ', '.join(f'{c} = {c} + VALUES({c})' for c in COUNTER_COLUMNS)
+
+def shift_attendance_counter(cursor, user_id, timetable_id, old_status=None, new_status=None):
+    """
+    attendance_counters を old_status から new_status へ1件分移す
+    （新規登録は old_status=None）。呼び出し側のトランザクション内で実行する
+    """
+    deltas = _counter_deltas(old_status, new_status)
+    if not any(deltas.values()):
+        return
+
+    sql = f"""
+        INSERT INTO attendance_counters (user_id, subject_id, {', '.join(COUNTER_COLUMNS)})
+        SELECT %s, subject_id, {', '.join(['%s'] * len(COUNTER_COLUMNS))}
+        FROM timetables
+        WHERE id = %s
+        ON DUPLICATE KEY UPDATE {_counter_upsert_clause()}
+    """
+    cursor.execute(sql, (user_id, *deltas.values(), timetable_id))
+
+def shift_attendance_counters(cursor, changes):
+    """
+    shift_attendance_counter の一括版
+    changes: [(user_id, timetable_id, old_status, new_status), ...]
+    教科IDの解決と集計の更新をそれぞれ1文で行う
+    """
+    changes = [c for c in changes if c[2] != c[3]]
+    if not changes:
+        return
+
+    timetable_ids = sorted({c[1] for c in changes})
+    cursor.execute(
+        f"SELECT id, subject_id FROM timetables WHERE id IN ({', '.join(['%s'] * len(timetable_ids))})",
+        timetable_ids
+    )
+    subject_of = {row['id']: row['subject_id'] for row in cursor.fetchall()}
+
+    # (user_id, subject_id) ごとに増減をまとめる
+    totals = {}
+    for user_id, timetable_id, old_status, new_status in changes:
+        subject_id = subject_of.get(timetable_id)
+        if subject_id is None:
+            continue
+        acc = totals.setdefault((user_id, subject_id), dict.fromkeys(COUNTER_COLUMNS, 0))
+        for column, delta in _counter_deltas(old_status, new_status).items():
+            acc[column] += delta
+
+    _apply_counter_totals(cursor, totals)
+
+def _apply_counter_totals(cursor, totals):
+    """
+    {(user_id, subject_id): {列: 増減}} を attendance_counters に1文で反映する
+    """
+    rows = [(user_id, subject_id, *acc.values()) for (user_id, subject_id), acc in totals.items() if any(acc.values())]
+    if not rows:
+        return
+
+    placeholders = '(' + ', '.join(['%s'] * (2 + len(COUNTER_COLUMNS))) + ')'
+    sql = f"""
+        INSERT INTO attendance_counters (user_id, subject_id, {', '.join(COUNTER_COLUMNS)})
+        VALUES {', '.join([placeholders] * len(rows))}
+        ON DUPLICATE KEY UPDATE {_counter_upsert_clause()}
+    """
+    cursor.execute(sql, [value for row in rows for value in row])
+
+def move_attendance_counters(cursor, subject_changes):
+    """
+    時間割の科目を差し替えるときに、その時間割の出席を attendance_counters の旧科目から新科目へ移す
+    subject_changes: {timetable_id: 新しい subject_id}
+    呼び出し側のトランザクション内で、timetables の subject_id を更新する前に実行する
+    （出席行を共有ロックするので、並行するステータス変更は更新後の科目で集計される）
+    """
+    if not subject_changes:
+        return
+
+    timetable_ids = sorted(subject_changes)
+    cursor.execute(
+        f"""
+            SELECT a.user_id, a.timetable_id, a.status, t.subject_id
+            FROM attendance a
+            JOIN timetables t ON t.id = a.timetable_id
+            WHERE a.timetable_id IN ({', '.join(['%s'] * len(timetable_ids))})
+            LOCK IN SHARE MODE
+        """,
+        timetable_ids
+    )
+
+    totals = {}
+    for row in cursor.fetchall():
+        new_subject_id = subject_changes[row['timetable_id']]
+        if new_subject_id == row['subject_id']:
+            continue
+        for subject_id, deltas in (
+            (row['subject_id'], _counter_deltas(old_status=row['status'])),
+            (new_subject_id, _counter_deltas(new_status=row['status'])),
+        ):
+            acc = totals.setdefault((row['user_id'], subject_id), dict.fromkeys(COUNTER_COLUMNS, 0))
+            for column, delta in deltas.items():
+                acc[column] += delta
+
+    _apply_counter_totals(cursor, totals)
 
 def register_attendance(user_id, timetable_id, status='出席'):
     """
@@ -10,25 +142,26 @@ def register_attendance(user_id, timetable_id, status='出席'):
         if not conn:
             return False
             
-        # 既に登録済みか確認（オプション）
-        check_sql = "SELECT id FROM attendance WHERE user_id = %s AND timetable_id = %s"
-        
-        with conn.cursor() as cursor:
-            cursor.execute(check_sql, (user_id, timetable_id))
-            if cursor.fetchone():
-                # 既に登録済みなら更新するか、無視するか。ここでは更新とするか、あるいはTrueを返して終了
-                # 今回は重複登録を防ぐため、何もしないでTrueを返す
-                return True
-
-        sql = "INSERT INTO attendance (user_id, timetable_id, status) VALUES (%s, %s, %s)"
+        # 既に登録済みなら何もしない（uq_user_timetable により重複登録は起きない）
+        sql = """
+            INSERT INTO attendance (user_id, timetable_id, status) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
+        """
         
         with conn.cursor() as cursor:
-            cursor.execute(sql, (user_id, timetable_id, status))
+            inserted = cursor.execute(sql, (user_id, timetable_id, status))
+            if inserted:
+                shift_attendance_counter(cursor, user_id, timetable_id, new_status=status)
             conn.commit()
+            if inserted:
+                mark_user_write(user_id)
+                invalidate_statuses(user_id)
             return True
             
     except Exception as e:
         print(f"register_attendance エラー: {e}", flush=True)
+        if conn:
+            conn.rollback()
         return False
 
     finally:
@@ -46,7 +179,7 @@ def update_attendance_status(user_id, timetable_id, status, reason=None):
             return False
             
         # Check if exists
-        check_sql = "SELECT id FROM attendance WHERE user_id = %s AND timetable_id = %s"
+        check_sql = "SELECT id, status FROM attendance WHERE user_id = %s AND timetable_id = %s FOR UPDATE"
         
         with conn.cursor() as cursor:
             cursor.execute(check_sql, (user_id, timetable_id))
@@ -68,21 +201,164 @@ def update_attendance_status(user_id, timetable_id, status, reason=None):
                 else:
                     insert_sql = "INSERT INTO attendance (user_id, timetable_id, status) VALUES (%s, %s, %s)"
                     cursor.execute(insert_sql, (user_id, timetable_id, status))
+
+            shift_attendance_counter(cursor, user_id, timetable_id, result['status'] if result else None, status)
                 
             conn.commit()
+            mark_user_write(user_id)
+            invalidate_statuses(user_id)
             return True
             
     except Exception as e:
         print(f"update_attendance_status エラー: {e}", flush=True)
+        if conn:
+            conn.rollback()
         return False
 
     finally:
         if conn:
             conn.close()
 
+def bulk_update_attendance(records):
+    """
+    複数の出席ステータスを1トランザクションでまとめて登録・更新する（点呼用）
+    records: [(user_id, timetable_id, status, reason), ...]
+    戻り値: {'inserted': n, 'updated': n}、失敗時は None
+    """
+    # 同じ (user_id, timetable_id) が複数あれば後のものを優先
+    latest = {}
+    for user_id, timetable_id, status, reason in records:
+        latest[(user_id, timetable_id)] = (status, reason)
+    if not latest:
+        return {'inserted': 0, 'updated': 0}
+
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        keys = list(latest)
+        with conn.cursor() as cursor:
+            # 既存行をまとめてロックして取得
+            check_sql = f"""
+                SELECT id, user_id, timetable_id, status
+                FROM attendance
+                WHERE (user_id, timetable_id) IN ({', '.join(['(%s, %s)'] * len(keys))})
+                FOR UPDATE
+            """
+            cursor.execute(check_sql, [v for key in keys for v in key])
+            existing = {(row['user_id'], row['timetable_id']): row for row in cursor.fetchall()}
+
+            updates = [(existing[key]['id'], *latest[key]) for key in keys if key in existing]
+            inserts = [(*key, *latest[key]) for key in keys if key not in existing]
+
+            if updates:
+                ids = [u[0] for u in updates]
+                update_sql = f"""
+                    UPDATE attendance
+                    SET status = CASE id {' '.join(['WHEN %s THEN %s'] * len(updates))} END,
+                        reason = CASE id {' '.join(['WHEN %s THEN COALESCE(%s, reason)'] * len(updates))} END,
+                        marked_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({', '.join(['%s'] * len(ids))})
+                """
+                params = [v for u in updates for v in (u[0], u[1])]
+                params += [v for u in updates for v in (u[0], u[2])]
+                params += ids
+                cursor.execute(update_sql, params)
+
+            if inserts:
+                insert_sql = "INSERT INTO attendance (user_id, timetable_id, status, reason) VALUES (%s, %s, %s, %s)"
+                # PyMySQL は INSERT ... VALUES の executemany を1文の複数行INSERTにまとめる
+                cursor.executemany(insert_sql, inserts)
+
+            changes = [(key[0], key[1], existing[key]['status'] if key in existing else None, latest[key][0]) for key in keys]
+            shift_attendance_counters(cursor, changes)
+
+            conn.commit()
+
+        for user_id in {key[0] for key in keys}:
+            mark_user_write(user_id)
+            invalidate_statuses(user_id)
+
+        return {'inserted': len(inserts), 'updated': len(updates)}
+
+    except Exception as e:
+        print(f"bulk_update_attendance エラー: {e}", flush=True)
+        if conn:
+            conn.rollback()
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+def close_out_absentees(date, period):
+    """
+    指定日・時限の授業で出席記録のない在籍学生をまとめて欠席にする
+    集計の更新と欠席の登録をそれぞれ1文の INSERT ... SELECT で行う
+    戻り値: 登録した件数、失敗時は None
+    """
+    # 対象: その時限の授業があるクラスの在籍学生（専攻授業は同じ専攻の学生のみ）で、出席記録がないもの
+    missing_sql = """
+        FROM timetables t
+        JOIN student_users s
+            ON s.class_id = t.class_id
+            AND (t.major_id IS NULL OR s.major_id = t.major_id)
+        LEFT JOIN attendance a
+            ON a.timetable_id = t.id
+            AND a.user_id = s.user_id
+        WHERE t.date = %s
+        AND t.period = %s
+        AND s.is_enrollment = TRUE
+        AND s.is_graduation = FALSE
+        AND a.id IS NULL
+    """
+
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        with conn.cursor() as cursor:
+            counter_sql = f"""
+                INSERT INTO attendance_counters (user_id, subject_id, absent, total)
+                SELECT s.user_id, t.subject_id, COUNT(*), COUNT(*)
+                {missing_sql}
+                GROUP BY s.user_id, t.subject_id
+                ON DUPLICATE KEY UPDATE
+                    absent = attendance_counters.absent + VALUES(absent),
+                    total = attendance_counters.total + VALUES(total)
+            """
+            cursor.execute(counter_sql, (date, period))
+
+            insert_sql = f"""
+                INSERT INTO attendance (user_id, timetable_id, status)
+                SELECT s.user_id, t.id, '欠席'
+                {missing_sql}
+            """
+            inserted = cursor.execute(insert_sql, (date, period))
+            conn.commit()
+
+        if inserted:
+            invalidate_all_statuses()
+        return inserted
+
+    except Exception as e:
+        print(f"close_out_absentees エラー: {e}", flush=True)
+        if conn:
+            conn.rollback()
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+@read_only(user_arg="user_id")
 def get_attendance_summary(user_id):
     """
-    出席率などのサマリーを取得する
+    出席率などのサマリーを取得する（attendance_counters から読む）
     """
     conn = None
     try:
@@ -92,32 +368,22 @@ def get_attendance_summary(user_id):
             
         sql = """
             SELECT 
-                status, 
-                COUNT(*) as count 
-            FROM attendance 
+                COALESCE(SUM(present), 0) as present,
+                COALESCE(SUM(absent), 0) as absent,
+                COALESCE(SUM(late), 0) as late,
+                COALESCE(SUM(early), 0) as early,
+                COALESCE(SUM(public_absent), 0) as public_absent,
+                COALESCE(SUM(total), 0) as total
+            FROM attendance_counters 
             WHERE user_id = %s 
-            GROUP BY status
         """
         
         with conn.cursor() as cursor:
             cursor.execute(sql, (user_id,))
-            results = cursor.fetchall()
+            row = cursor.fetchone()
             
-            summary = {
-                '出席': 0,
-                '欠席': 0,
-                '遅刻': 0,
-                '早退': 0,
-                '公欠': 0,
-                'total': 0
-            }
-            
-            for row in results:
-                status = row['status']
-                count = row['count']
-                if status in summary:
-                    summary[status] = count
-                    summary['total'] += count
+            summary = {status: int(row[column]) for status, column in STATUS_COLUMNS.items()}
+            summary['total'] = int(row['total'])
                     
             return summary
             
@@ -129,9 +395,10 @@ def get_attendance_summary(user_id):
         if conn:
             conn.close()
 
+@read_only(user_arg="user_id")
 def get_subject_attendance_summary(user_id):
     """
-    科目ごとの出席状況を取得する
+    科目ごとの出席状況を取得する（attendance_counters から読む）
     """
     conn = None
     try:
@@ -142,16 +409,15 @@ def get_subject_attendance_summary(user_id):
         sql = """
             SELECT 
                 s.name as subject_name,
-                SUM(CASE WHEN a.status = '出席' THEN 1 ELSE 0 END) as present,
-                SUM(CASE WHEN a.status = '欠席' THEN 1 ELSE 0 END) as absent,
-                SUM(CASE WHEN a.status = '遅刻' THEN 1 ELSE 0 END) as late,
-                SUM(CASE WHEN a.status = '早退' THEN 1 ELSE 0 END) as early,
-                SUM(CASE WHEN a.status = '公欠' THEN 1 ELSE 0 END) as public_absent,
-                COUNT(*) as total
-            FROM attendance a
-            JOIN timetables t ON a.timetable_id = t.id
-            JOIN subjects s ON t.subject_id = s.id
-            WHERE a.user_id = %s
+                CAST(SUM(c.present) AS SIGNED) as present,
+                CAST(SUM(c.absent) AS SIGNED) as absent,
+                CAST(SUM(c.late) AS SIGNED) as late,
+                CAST(SUM(c.early) AS SIGNED) as early,
+                CAST(SUM(c.public_absent) AS SIGNED) as public_absent,
+                CAST(SUM(c.total) AS SIGNED) as total
+            FROM attendance_counters c
+            JOIN subjects s ON c.subject_id = s.id
+            WHERE c.user_id = %s AND c.total > 0
             GROUP BY s.name
         """
         
@@ -166,6 +432,102 @@ def get_subject_attendance_summary(user_id):
         if conn:
             conn.close()
 
+@read_only()
+def get_term_attendance_counts(start_date, end_date, class_id=None, department_id=None):
+    """
+    クラス（または学科）の在籍学生について、期間内の学生×科目ごとの件数を1回のクエリで取得する
+    - scheduled: 期間内の授業コマ数（これからの授業を含む）
+    - remaining: 記録がなく、今日以降に行われる授業コマ数
+    - present / absent / late / early / public_absent: ステータスごとの件数
+    繰り返しルールのうちまだ timetables に展開されていない日は、ルールと上書きからその場で数える
+    （レポートのために時間割を書き込まない）
+    失敗時は None
+    """
+    if class_id is not None:
+        scope_sql, scope_arg = "c.id = %s", class_id
+    else:
+        scope_sql, scope_arg = "c.department_id = %s", department_id
+
+    # 期間内の日付（JSON_TABLE で行にする。再帰CTEの深さの上限を気にしなくてよい）
+    days = []
+    day = start_date
+    while day <= end_date:
+        days.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        status_sums = ",\n".join(
+            f"CAST(COALESCE(SUM(a.status = '{status}'), 0) AS SIGNED) AS {column}"
+            for status, column in STATUS_COLUMNS.items()
+        )
+        sql = f"""
+            WITH slots AS (
+                SELECT t.id, t.class_id, t.major_id, t.date, t.subject_id
+                FROM timetables t
+                JOIN classes c ON c.id = t.class_id
+                WHERE {scope_sql}
+                AND t.date BETWEEN %s AND %s
+                UNION ALL
+                -- 未展開のルールの授業（休講と、既に行がある・他の授業が入っているコマは除く）
+                SELECT NULL, r.class_id, r.major_id, d.day, COALESCE(o.subject_id, r.subject_id)
+                FROM timetable_rules r
+                JOIN classes c ON c.id = r.class_id
+                JOIN JSON_TABLE(%s, '$[*]' COLUMNS (day DATE PATH '$')) AS d
+                    ON d.day BETWEEN r.start_date AND r.end_date
+                    AND WEEKDAY(d.day) = r.weekday
+                LEFT JOIN timetable_overrides o ON o.rule_id = r.id AND o.date = d.day
+                WHERE {scope_sql}
+                AND r.start_date <= %s AND r.end_date >= %s
+                AND NOT COALESCE(o.cancelled, FALSE)
+                AND NOT EXISTS (
+                    SELECT 1 FROM timetables e
+                    WHERE e.class_id = r.class_id AND e.date = d.day AND e.period = r.period
+                    AND {SLOT_MAJOR_CONFLICT.format(a="e", b="r")}
+                )
+            )
+            SELECT
+                s.user_id,
+                s.full_name,
+                s.class_id,
+                t.subject_id,
+                sub.name AS subject_name,
+                COUNT(*) AS scheduled,
+                CAST(SUM(a.id IS NULL AND t.date >= CURDATE()) AS SIGNED) AS remaining,
+                {status_sums}
+            FROM slots t
+            JOIN subjects sub ON sub.id = t.subject_id
+            JOIN student_users s
+                ON s.class_id = t.class_id
+                AND (t.major_id IS NULL OR s.major_id = t.major_id)
+            LEFT JOIN attendance a
+                ON a.timetable_id = t.id
+                AND a.user_id = s.user_id
+            WHERE s.is_enrollment = TRUE
+            AND s.is_graduation = FALSE
+            GROUP BY s.user_id, t.subject_id
+        """
+
+        with conn.cursor() as cursor:
+            cursor.execute(sql, (
+                scope_arg, start_date, end_date,
+                json.dumps(days), scope_arg, end_date, start_date,
+            ))
+            return cursor.fetchall()
+
+    except Exception as e:
+        print(f"get_term_attendance_counts エラー: {e}", flush=True)
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+@read_only(user_arg="user_id")
 def get_recent_attendance_history(user_id, limit=5):
     """
     直近の活動履歴（出席以外）を取得する
@@ -203,3 +565,104 @@ def get_recent_attendance_history(user_id, limit=5):
         if conn:
             conn.close()
 
+
+# 出力する列（stream_class_attendance の各行のキー）
+EXPORT_COLUMNS = [
+    'date', 'period', 'subject', 'teacher', 'user_id', 'full_name', 'major_id', 'status', 'reason', 'marked_at'
+]
+
+class UnbufferedRows:
+    """
+    サーバー側カーソルの結果を1行ずつ返すイテレーター
+    読み終えるか close() すると接続をプールへ返す。途中で閉じた場合（クライアントの切断など）は
+    未読の結果が残っているので、読み捨てずに接続ごと破棄する
+    """
+
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._conn is None:
+            raise StopIteration
+        row = self._cursor.fetchone()
+        if row is None:
+            self._cursor.close()
+            self._release()
+            raise StopIteration
+        return row
+
+    def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        if self._conn is None:
+            return
+        try:
+            # release で使えない接続として破棄される
+            self._conn.raw.close()
+        except Exception:
+            pass
+        self._release()
+
+@read_only()
+def stream_class_attendance(class_id, start_date, end_date):
+    """
+    クラスの指定期間の出席を、授業コマ × 学生の1行ずつ返すイテレーターを返す（記録のないコマは status が None）
+    結果はサーバー側カーソル（SSDictCursor）で読むため、件数に関係なくメモリ使用量は一定
+    接続は読み終えるか close() するまで借りたままになる（レスポンスの call_on_close に渡す）
+    失敗時は None
+    """
+    sql = """
+        SELECT
+            t.date,
+            t.period,
+            sub.name AS subject,
+            tu.full_name AS teacher,
+            s.user_id,
+            s.full_name,
+            s.major_id,
+            a.status,
+            a.reason,
+            a.marked_at
+        FROM timetables t
+        JOIN subjects sub ON sub.id = t.subject_id
+        JOIN teacher_users tu ON tu.user_id = t.teacher_id
+        JOIN student_users s
+            ON s.class_id = t.class_id
+            AND (t.major_id IS NULL OR s.major_id = t.major_id)
+        LEFT JOIN attendance a
+            ON a.timetable_id = t.id
+            AND a.user_id = s.user_id
+        WHERE t.class_id = %s
+        AND t.date BETWEEN %s AND %s
+        AND (s.is_enrollment = TRUE OR a.id IS NOT NULL)
+        ORDER BY t.date, t.period, s.user_id
+    """
+
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        # 遅いクライアントに合わせて読み出しが止まっても、サーバーが送信を打ち切らないようにする
+        cursor.execute("SET SESSION net_write_timeout = %s", (Config.EXPORT_NET_WRITE_TIMEOUT,))
+        cursor.execute(sql, (class_id, start_date, end_date))
+        return UnbufferedRows(conn, cursor)
+
+    except Exception as e:
+        print(f"stream_class_attendance エラー: {e}", flush=True)
+        if conn:
+            try:
+                conn.raw.close()
+            except Exception:
+                pass
+            conn.close()
+        return None
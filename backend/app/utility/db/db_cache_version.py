@@ -0,0 +1,46 @@
+from app.utility.db.db_connect import db_connect
+
+def get_cache_versions():
+    """
+    キャッシュ名ごとの版数（どのプロセスが変更しても上がる）を {name: version} で返す。失敗時は None
+    レプリカの遅れで変更を見落とさないようプライマリから読む
+    """
+    conn = db_connect()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT name, version FROM cache_versions")
+            return {row['name']: row['version'] for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"get_cache_versions error: {e}")
+        return None
+    finally:
+        conn.close()
+
+def bump_cache_version(name):
+    """
+    name のデータを変更したことを他のプロセスに知らせる（版数を1つ上げる）
+    """
+    conn = db_connect()
+    if not conn:
+        return False
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO cache_versions (name, version) VALUES (%s, 1)
+                ON DUPLICATE KEY UPDATE version = version + 1
+                """,
+                (name,)
+            )
+            conn.commit()
+            return True
+    except Exception as e:
+        print(f"bump_cache_version error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
@@ -0,0 +1,55 @@
+from app.utility.db.db_connect import db_connect, read_only
+
+def add_chat_log(user_id, message, response):
+    """
+    チャットの質問と回答を保存する
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return False
+
+        sql = "INSERT INTO chat_logs (user_id, message, response) VALUES (%s, %s, %s)"
+        with conn.cursor() as cursor:
+            cursor.execute(sql, (user_id, message, response))
+            conn.commit()
+        return True
+
+    except Exception as e:
+        print(f"add_chat_log エラー: {e}", flush=True)
+        return False
+
+    finally:
+        if conn:
+            conn.close()
+
+@read_only()
+def get_recent_chat_answers(limit=500):
+    """
+    回答済みの最近のチャットを新しい順に返す（回答キャッシュの初期データ）
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return []
+
+        sql = """
+            SELECT message, response
+            FROM chat_logs
+            WHERE response IS NOT NULL
+            ORDER BY id DESC
+            LIMIT %s
+        """
+        with conn.cursor() as cursor:
+            cursor.execute(sql, (limit,))
+            return cursor.fetchall()
+
+    except Exception as e:
+        print(f"get_recent_chat_answers エラー: {e}", flush=True)
+        return []
+
+    finally:
+        if conn:
+            conn.close()
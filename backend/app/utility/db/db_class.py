@@ -1,4 +1,4 @@
-from app.utility.db.db_connect import db_connect
+from app.utility.db.db_connect import db_connect, read_only
 
 def get_class_data(department_id, grade=1):
     try:
@@ -25,6 +25,7 @@ def get_class_data(department_id, grade=1):
         if conn:
             conn.close()
 
+@read_only()
 def get_majors_by_department(department_id):
     try:
         conn = db_connect()
@@ -1,31 +1,77 @@
 from app.utility.db.db_connect import db_connect
+from app.utility.cache.entry_index import entry_index
+
+def warm_entry_index():
+    """
+    当日の入構記録をDBから読み込み、インメモリ索引を作り直す
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return False
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT NOW() AS db_now")
+            db_now = cursor.fetchone()['db_now']
+
+            # DATE(entered_at) ではなく範囲条件にして idx_entered_at を使う
+            sql = """
+                SELECT felica_idm, MAX(entered_at) AS entered_at
+                FROM entry_logs
+                WHERE entered_at >= CURDATE()
+                GROUP BY felica_idm
+            """
+            cursor.execute(sql)
+            rows = [(row['felica_idm'], row['entered_at']) for row in cursor.fetchall()]
+
+        entry_index.load(db_now, rows)
+        return True
+
+    except Exception as e:
+        print(f"warm_entry_index エラー: {e}", flush=True)
+        return False
+
+    finally:
+        if conn:
+            conn.close()
+
+def _ensure_entry_index():
+    if not entry_index.warmed:
+        warm_entry_index()
+    return entry_index.warmed
 
 def add_entry_log(felica_idm):
     """
     入構ログをDBに保存する
-    1日1回のみ記録する
+    1日1回のみ記録する（当日分は索引で判定し、記録済みならDBに触れない）
     """
+    if _ensure_entry_index() and entry_index.entered_today(felica_idm):
+        # 既に記録済み
+        return True
+
     conn = None
     try:
         conn = db_connect()
         if not conn:
             return False
             
-        # 今日の記録が既にあるか確認
-        check_sql = "SELECT COUNT(*) as count FROM entry_logs WHERE felica_idm = %s AND DATE(entered_at) = CURDATE()"
-        
-        with conn.cursor() as cursor:
-            cursor.execute(check_sql, (felica_idm,))
-            result = cursor.fetchone()
-            if result and result['count'] > 0:
-                # 既に記録済み
-                return True
-
-        sql = "INSERT INTO entry_logs (felica_idm) VALUES (%s)"
+        # 他プロセスが先に記録している場合に備え、存在確認と挿入を1文で行う
+        sql = """
+            INSERT INTO entry_logs (felica_idm)
+            SELECT %s FROM DUAL
+            WHERE NOT EXISTS (
+                SELECT 1 FROM entry_logs
+                WHERE felica_idm = %s AND entered_at >= CURDATE()
+            )
+        """
         
         with conn.cursor() as cursor:
-            cursor.execute(sql, (felica_idm,))
+            inserted = cursor.execute(sql, (felica_idm, felica_idm))
             conn.commit()
+
+        if inserted:
+            entry_index.record(felica_idm)
             
         return True
         
@@ -37,36 +83,242 @@ def add_entry_log(felica_idm):
         if conn:
             conn.close()
 
+def get_device_high_water_mark(device_id):
+    """
+    端末の反映済み連番を返す（未登録の端末は 0、失敗時は None）
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT last_sequence FROM entry_devices WHERE device_id = %s", (device_id,))
+            row = cursor.fetchone()
+            return row['last_sequence'] if row else 0
+
+    except Exception as e:
+        print(f"get_device_high_water_mark エラー: {e}", flush=True)
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+def sync_device_entries(device_id, records):
+    """
+    入構端末がためておいたタッチ記録をまとめて entry_logs に反映する
+    records: (sequence, felica_idm, entered_at) のリスト。entered_at が None のもの（端末側で不正な記録）は
+             連番だけ進めて捨てる
+    端末ごとの反映済み連番（high-water mark）以下の記録は再送とみなして捨てるので、同じバッチを何度送っても重複しない
+    1日1回のみ記録する規則は add_entry_log と同じ
+    戻り値: {"high_water_mark", "accepted", "duplicates", "rejected", "inserted",
+             "entered"（挿入した記録のうち、当日の入構として新たに索引に載せた (IDm, 時刻)）}。
+            失敗時は None
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        with conn.cursor() as cursor:
+            # 端末の行をロックして、同じ端末からの同時送信を直列化する
+            cursor.execute("INSERT IGNORE INTO entry_devices (device_id) VALUES (%s)", (device_id,))
+            cursor.execute(
+                "SELECT last_sequence FROM entry_devices WHERE device_id = %s FOR UPDATE",
+                (device_id,),
+            )
+            high_water_mark = cursor.fetchone()['last_sequence']
+
+            fresh = {}
+            for sequence, idm, entered_at in records:
+                if sequence > high_water_mark and sequence not in fresh:
+                    fresh[sequence] = (idm, entered_at)
+            duplicates = len(records) - len(fresh)
+
+            # 同じ IDm・同じ日はバッチ内でも最初の1件だけにする
+            first = {}
+            for sequence in sorted(fresh):
+                idm, entered_at = fresh[sequence]
+                if entered_at is None:
+                    continue
+                key = (idm, entered_at.date())
+                if key not in first or entered_at < first[key][1]:
+                    first[key] = (sequence, entered_at)
+            rows = [(idm, entered_at, sequence) for (idm, _), (sequence, entered_at) in first.items()]
+
+            inserted = 0
+            if rows:
+                values = " UNION ALL ".join(
+                    ["SELECT %s AS felica_idm, %s AS entered_at, %s AS device_seq"] * len(rows)
+                )
+                sql = f"""
+                    INSERT INTO entry_logs (felica_idm, entered_at, device_id, device_seq)
+                    SELECT j.felica_idm, j.entered_at, %s, j.device_seq
+                    FROM ({values}) AS j
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM entry_logs e
+                        WHERE e.felica_idm = j.felica_idm
+                        AND e.entered_at >= DATE(j.entered_at)
+                        AND e.entered_at < DATE(j.entered_at) + INTERVAL 1 DAY
+                    )
+                """
+                params = [device_id] + [value for row in rows for value in row]
+                inserted = cursor.execute(sql, params)
+
+            # 挿入された記録だけを入構として扱う（NOT EXISTS で落ちた行は既に先の記録がある）
+            if inserted == len(rows):
+                inserted_rows = [(idm, entered_at) for idm, entered_at, _ in rows]
+            elif inserted:
+                cursor.execute(
+                    f"""
+                        SELECT felica_idm, entered_at FROM entry_logs
+                        WHERE device_id = %s AND device_seq IN ({', '.join(['%s'] * len(rows))})
+                    """,
+                    [device_id] + [sequence for _, _, sequence in rows],
+                )
+                inserted_rows = [(row['felica_idm'], row['entered_at']) for row in cursor.fetchall()]
+            else:
+                inserted_rows = []
+
+            if fresh:
+                high_water_mark = max(fresh)
+                cursor.execute(
+                    "UPDATE entry_devices SET last_sequence = %s, last_synced_at = NOW() WHERE device_id = %s",
+                    (high_water_mark, device_id),
+                )
+            conn.commit()
+
+        # 挿入した当日分のうち、索引に載っていない IDm だけ記録する（ジャーナルに未反映の記録があれば載っている）
+        entered = []
+        for idm, entered_at in inserted_rows:
+            if not entry_index.entered_today(idm):
+                entry_index.record(idm, entered_at)
+                if entry_index.entered_today(idm):
+                    entered.append((idm, entered_at))
+
+        return {
+            "high_water_mark": high_water_mark,
+            "accepted": len(fresh),
+            "duplicates": duplicates,
+            "rejected": sum(1 for _, entered_at in fresh.values() if entered_at is None),
+            "inserted": inserted,
+            "entered": entered,
+        }
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"sync_device_entries エラー: {e}", flush=True)
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+def _recent_entry_from_index(felica_idms, minutes):
+    """
+    索引から、いずれかの IDm の minutes 分以内の最新入構時刻を返す（索引になければ None）
+    """
+    if not _ensure_entry_index():
+        return None
+    found = [entry_index.recent_entry(idm, minutes) for idm in felica_idms]
+    found = [entered_at for entered_at in found if entered_at]
+    return max(found) if found else None
+
+def _recent_entry_from_db(cursor, felica_idms, minutes):
+    """
+    entry_logs から、いずれかの IDm の minutes 分以内の最新入構時刻を返す（なければ None）
+    見つかった記録は索引に載せる（他のプロセスが記録したタッチ）
+    """
+    sql = f"""
+        SELECT felica_idm, entered_at
+        FROM entry_logs
+        WHERE felica_idm IN ({', '.join(['%s'] * len(felica_idms))})
+        AND entered_at >= NOW() - INTERVAL %s MINUTE
+        ORDER BY entered_at DESC
+        LIMIT 1
+    """
+    cursor.execute(sql, (*felica_idms, minutes))
+    result = cursor.fetchone()
+    if not result:
+        return None
+    entry_index.record(result['felica_idm'], result['entered_at'])
+    return result['entered_at']
+
 def check_recent_entry(felica_idm, minutes=30):
     """
     指定されたIDmの入構記録が、現在時刻から指定分以内にあるか確認する
+    索引に見つかればDBには問い合わせない
     """
+    entered_at = _recent_entry_from_index([felica_idm], minutes)
+    if entered_at:
+        return entered_at
+
     conn = None
     try:
         conn = db_connect()
         if not conn:
             return False
+
+        with conn.cursor() as cursor:
+            return _recent_entry_from_db(cursor, [felica_idm], minutes)
             
-        # 現在時刻から minutes 分前以降のログがあるか
+    except Exception as e:
+        print(f"check_recent_entry エラー: {e}", flush=True)
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+def get_recent_entry_for_user(user_id, timetable_id, minutes=30):
+    """
+    出席登録に必要な情報をまとめて取得する
+    - card_count: ユーザーの登録カード枚数
+    - entered_at: いずれかのカードで minutes 分以内に入構した最新時刻（なければ None）
+    - date, start_time: 指定時間割の日付と開始時刻（時間割がなければ None）
+    カードと時間割は1回のクエリで取得し、入構時刻は索引から引く。
+    索引にない場合（他のプロセスが記録したタッチなど）だけ entry_logs に問い合わせる
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
         sql = """
-            SELECT entered_at 
-            FROM entry_logs 
-            WHERE felica_idm = %s 
-            AND entered_at >= NOW() - INTERVAL %s MINUTE
-            ORDER BY entered_at DESC
-            LIMIT 1
+            SELECT
+                (SELECT GROUP_CONCAT(felica_idm) FROM user_cards WHERE user_id = %s) AS felica_idms,
+                t.date,
+                l.start_time
+            FROM (SELECT 1) AS dummy
+            LEFT JOIN timetables t ON t.id = %s
+            LEFT JOIN lessontime l ON t.period = l.id
         """
-        
+
         with conn.cursor() as cursor:
-            cursor.execute(sql, (felica_idm, minutes))
-            result = cursor.fetchone()
-            
-            if result:
-                return result['entered_at']
-            return None
-            
+            cursor.execute(sql, (user_id, timetable_id))
+            row = cursor.fetchone()
+            felica_idms = row['felica_idms'].split(',') if row['felica_idms'] else []
+
+            entered_at = None
+            if felica_idms:
+                entered_at = _recent_entry_from_index(felica_idms, minutes)
+                if not entered_at:
+                    entered_at = _recent_entry_from_db(cursor, felica_idms, minutes)
+
+        return {
+            "card_count": len(felica_idms),
+            "entered_at": entered_at,
+            "date": row['date'],
+            "start_time": row['start_time'],
+        }
+
     except Exception as e:
-        print(f"check_recent_entry エラー: {e}", flush=True)
+        print(f"get_recent_entry_for_user エラー: {e}", flush=True)
         return None
 
     finally:
@@ -0,0 +1,75 @@
+import threading
+import time
+
+from app.utility.db.db_connect import db_connect, read_only
+from app.utility.cache.faq_index import faq_index
+from app.core.config import Config
+
+_refresh_lock = threading.Lock()
+
+@read_only()
+def refresh_faq_index(force=False):
+    """
+    FAQ の n-gram 索引をDBと同期する
+    - 未作成または force=True なら全件で作り直す
+    - それ以外は FAQ_INDEX_REFRESH_SECONDS ごとに updated_at が新しい行だけ取り込む
+    - 件数が合わない（削除された行がある）場合は全件で作り直す
+    他のスレッドが同期中の場合は待たずに現在の索引を使う
+    """
+    if not force and faq_index.loaded \
+            and time.monotonic() - faq_index.checked_at < Config.FAQ_INDEX_REFRESH_SECONDS:
+        return True
+    if not _refresh_lock.acquire(blocking=False):
+        return faq_index.loaded
+
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return False
+
+        columns = "SELECT id, category, question, answer, updated_at FROM faq"
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS count, MAX(updated_at) AS last_updated FROM faq")
+            state = cursor.fetchone()
+
+            if force or not faq_index.loaded or faq_index.synced_at is None:
+                cursor.execute(columns)
+                faq_index.load(cursor.fetchall())
+            elif state['last_updated'] is not None and state['last_updated'] >= faq_index.synced_at:
+                # 同じ秒に更新された行を取りこぼさないよう >= で取り直す
+                cursor.execute(columns + " WHERE updated_at >= %s", (faq_index.synced_at,))
+                for row in cursor.fetchall():
+                    faq_index.upsert(row)
+
+            if len(faq_index) != state['count']:
+                cursor.execute(columns)
+                faq_index.load(cursor.fetchall())
+
+        faq_index.checked_at = time.monotonic()
+        return True
+
+    except Exception as e:
+        print(f"refresh_faq_index エラー: {e}", flush=True)
+        return False
+
+    finally:
+        if conn:
+            conn.close()
+        _refresh_lock.release()
+
+def search_faq(query, limit=10, category=None):
+    """
+    FAQ を検索し、スコア順に返す（索引は必要なときだけDBと同期する）
+    """
+    refresh_faq_index()
+    return [
+        {
+            "id": row['id'],
+            "category": row['category'],
+            "question": row['question'],
+            "answer": row['answer'],
+            "score": score,
+        }
+        for score, row in faq_index.search(query, limit=limit, category=category)
+    ]
@@ -0,0 +1,65 @@
+import glob
+import os
+
+from app.utility.db.db_connect import db_connect
+
+MIGRATIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "migrations"))
+
+
+def split_statements(sql_text):
+    """
+    マイグレーションファイルを文ごとに分割する（-- コメント行は除く）
+    """
+    lines = [line for line in sql_text.splitlines() if not line.strip().startswith("--")]
+    return [stmt.strip() for stmt in "\n".join(lines).split(";") if stmt.strip()]
+
+
+def get_applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(255) PRIMARY KEY,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def apply_migrations(migrations_dir=MIGRATIONS_DIR):
+    """
+    未適用のマイグレーションをファイル名順に適用する
+    戻り値: 今回適用したバージョンのリスト
+    """
+    conn = db_connect()
+    if not conn:
+        raise RuntimeError("データベースに接続できません")
+
+    applied_now = []
+    try:
+        with conn.cursor() as cursor:
+            applied = get_applied_versions(cursor)
+            conn.commit()
+
+            for path in sorted(glob.glob(os.path.join(migrations_dir, "*.sql"))):
+                version = os.path.basename(path)
+                if version in applied:
+                    continue
+
+                with open(path, encoding="utf-8") as f:
+                    statements = split_statements(f.read())
+
+                # DDLは暗黙コミットされるため、ファイル単位で記録する
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+                conn.commit()
+                applied_now.append(version)
+
+        return applied_now
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        conn.close()
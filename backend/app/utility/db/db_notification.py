@@ -0,0 +1,215 @@
+from app.utility.db.db_connect import db_connect, mark_user_write, read_only
+from app.utility.cache.ttl_cache import TTLCache
+from app.core.config import Config
+
+NOTIFICATION_TYPES = ['授業変更', '出席リマインド', 'イベント']
+
+# user_id -> 未読件数（通知バッジ用。ページ遷移ごとの COUNT を省く）
+unread_count_cache = TTLCache(
+    maxsize=Config.NOTIFICATION_COUNT_CACHE_SIZE,
+    ttl=Config.NOTIFICATION_COUNT_CACHE_TTL
+)
+
+def _fan_out(select_sql, params, notification_type, message):
+    """
+    対象学生を選ぶ SELECT をそのまま INSERT ... SELECT にして、1文で全員分の通知を作る
+    戻り値: 作成した件数、失敗時は None
+    """
+    if notification_type not in NOTIFICATION_TYPES:
+        raise ValueError(f"invalid notification type: {notification_type}")
+
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        sql = f"""
+            INSERT INTO notifications (user_id, type, message)
+            SELECT s.user_id, %s, %s
+            {select_sql}
+        """
+        with conn.cursor() as cursor:
+            inserted = cursor.execute(sql, (notification_type, message, *params))
+            conn.commit()
+        return inserted
+
+    except Exception as e:
+        print(f"notification fan-out エラー: {e}", flush=True)
+        if conn:
+            conn.rollback()
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+def notify_users(user_ids, notification_type, message):
+    """
+    指定した学生に通知を作る（複数行INSERT 1文）
+    """
+    user_ids = sorted({int(u) for u in user_ids})
+    if not user_ids:
+        return 0
+
+    inserted = _fan_out(
+        f"FROM student_users s WHERE s.user_id IN ({', '.join(['%s'] * len(user_ids))})",
+        user_ids, notification_type, message
+    )
+    if inserted is not None:
+        for user_id in user_ids:
+            unread_count_cache.invalidate(user_id)
+            mark_user_write(user_id)
+    return inserted
+
+def notify_classes(class_ids, notification_type, message, major_id=None):
+    """
+    クラスの在籍学生全員に通知を作る（major_id を指定した場合はその専攻の学生だけ）
+    """
+    class_ids = sorted({int(c) for c in class_ids})
+    if not class_ids:
+        return 0
+
+    select_sql = f"""
+        FROM student_users s
+        WHERE s.class_id IN ({', '.join(['%s'] * len(class_ids))})
+        AND s.is_enrollment = TRUE
+        AND s.is_graduation = FALSE
+    """
+    params = list(class_ids)
+    if major_id is not None:
+        select_sql += " AND s.major_id = %s"
+        params.append(major_id)
+
+    inserted = _fan_out(select_sql, params, notification_type, message)
+    if inserted:
+        # 対象学生のIDは取得していないので件数キャッシュはまとめて破棄する（一斉通知は稀）
+        unread_count_cache.clear()
+    return inserted
+
+def notify_department(department_id, notification_type, message):
+    """
+    学科の在籍学生全員に通知を作る
+    """
+    inserted = _fan_out("""
+        FROM student_users s
+        JOIN classes c ON s.class_id = c.id
+        WHERE c.department_id = %s
+        AND s.is_enrollment = TRUE
+        AND s.is_graduation = FALSE
+    """, (department_id,), notification_type, message)
+    if inserted:
+        unread_count_cache.clear()
+    return inserted
+
+@read_only(user_arg="user_id")
+def get_unread_notifications(user_id, before_id=None, limit=20):
+    """
+    未読通知を新しい順に limit 件返す（before_id より古いものから続きを取得する）
+    戻り値: (通知のリスト, 次ページの before_id または None)
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return [], None
+
+        sql = """
+            SELECT id, type, message, created_at
+            FROM notifications
+            WHERE user_id = %s AND is_read = FALSE
+        """
+        params = [user_id]
+        if before_id is not None:
+            sql += " AND id < %s"
+            params.append(before_id)
+        sql += " ORDER BY id DESC LIMIT %s"
+        # 1件多く取って次ページの有無を判定する
+        params.append(limit + 1)
+
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        next_before_id = rows[limit - 1]['id'] if len(rows) > limit else None
+        return rows[:limit], next_before_id
+
+    except Exception as e:
+        print(f"get_unread_notifications エラー: {e}", flush=True)
+        return [], None
+
+    finally:
+        if conn:
+            conn.close()
+
+@read_only(user_arg="user_id")
+def get_unread_count(user_id):
+    """
+    未読件数を返す（キャッシュ付き）。失敗時は None
+    """
+    cached = unread_count_cache.get(int(user_id))
+    if cached is not None:
+        return cached
+
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        sql = "SELECT COUNT(*) AS unread FROM notifications WHERE user_id = %s AND is_read = FALSE"
+        with conn.cursor() as cursor:
+            cursor.execute(sql, (user_id,))
+            count = cursor.fetchone()['unread']
+
+        unread_count_cache.set(int(user_id), count)
+        return count
+
+    except Exception as e:
+        print(f"get_unread_count エラー: {e}", flush=True)
+        return None
+
+    finally:
+        if conn:
+            conn.close()
+
+def mark_notifications_read(user_id, ids=None, up_to_id=None):
+    """
+    通知をまとめて既読にする（1文）
+    ids を指定した場合はその通知、up_to_id を指定した場合はその id 以下の全未読、
+    どちらもなければ全未読を既読にする
+    戻り値: 既読にした件数、失敗時は None
+    """
+    conn = None
+    try:
+        conn = db_connect()
+        if not conn:
+            return None
+
+        sql = "UPDATE notifications SET is_read = TRUE WHERE user_id = %s AND is_read = FALSE"
+        params = [user_id]
+        if ids:
+            ids = sorted({int(i) for i in ids})
+            sql += f" AND id IN ({', '.join(['%s'] * len(ids))})"
+            params += ids
+        elif up_to_id is not None:
+            sql += " AND id <= %s"
+            params.append(up_to_id)
+
+        with conn.cursor() as cursor:
+            updated = cursor.execute(sql, params)
+            conn.commit()
+
+        unread_count_cache.invalidate(int(user_id))
+        mark_user_write(user_id)
+        return updated
+
+    except Exception as e:
+        print(f"mark_notifications_read エラー: {e}", flush=True)
+        if conn:
+            conn.rollback()
+        return None
+
+    finally:
+        if conn:
+            conn.close()
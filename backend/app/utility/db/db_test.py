@@ -3,8 +3,11 @@ from app.utility.db.db_connect import db_connect
 def get_departments():
     conn = db_connect()
     sql = "SELECT * FROM departments"
-    with conn.cursor() as cursor:
-        cursor.execute(sql)
-        rows = cursor.fetchall()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
 
     return rows
\ No newline at end of file
@@ -1,5 +1,8 @@
-from app.utility.db.db_connect import db_connect
+import datetime
 
+from app.utility.db.db_connect import db_connect, read_only
+
+@read_only(user_arg="user_id")
 def get_timetable(class_id, major_id, start_date, end_date, user_id=None):
     """
     指定されたクラス、専攻、期間の時間割を取得する。
@@ -16,7 +19,11 @@ def get_timetable(class_id, major_id, start_date, end_date, user_id=None):
             # 通常、学生はmajor_idを持っているはず。
             # major_idがNULLのレコードは共通授業。
             
-            sql = """
+            # user_idがない場合は出席テーブルを結合しない（クラス共通の時間割のみ）
+            attendance_column = "a.status as attendance_status" if user_id is not None else "NULL as attendance_status"
+            attendance_join = "LEFT JOIN attendance a ON t.id = a.timetable_id AND a.user_id = %s" if user_id is not None else ""
+
+            sql = f"""
                 SELECT 
                     t.id,
                     t.date,
@@ -26,19 +33,22 @@ def get_timetable(class_id, major_id, start_date, end_date, user_id=None):
                     t.major_id,
                     l.start_time,
                     l.end_time,
-                    a.status as attendance_status
+                    {attendance_column}
                 FROM timetables t
                 LEFT JOIN subjects s ON t.subject_id = s.id
                 LEFT JOIN teacher_users u ON t.teacher_id = u.user_id
                 LEFT JOIN lessontime l ON t.period = l.id
-                LEFT JOIN attendance a ON t.id = a.timetable_id AND a.user_id = %s
+                {attendance_join}
                 WHERE t.class_id = %s
                 AND t.date BETWEEN %s AND %s
                 AND (t.major_id = %s OR t.major_id IS NULL)
                 ORDER BY t.date, t.period
             """
             
-            cursor.execute(sql, (user_id, class_id, start_date, end_date, major_id))
+            params = (class_id, start_date, end_date, major_id)
+            if user_id is not None:
+                params = (user_id,) + params
+            cursor.execute(sql, params)
             results = cursor.fetchall()
             
             # datetime/date/time objects need to be serializable if returned directly, 
@@ -82,3 +92,379 @@ def get_timetable_by_id(timetable_id):
         if conn:
             conn.close()
 
+
+@read_only(user_arg="user_id")
+def get_attendance_statuses(user_id, start_date, end_date):
+    """
+    指定期間の時間割に対するユーザーの出席ステータスを {timetable_id: status} で取得する
+    取得に失敗した場合は None を返す
+    """
+    conn = db_connect()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            sql = """
+                SELECT a.timetable_id, a.status
+                FROM attendance a
+                JOIN timetables t ON a.timetable_id = t.id
+                WHERE a.user_id = %s
+                AND t.date BETWEEN %s AND %s
+            """
+            cursor.execute(sql, (user_id, start_date, end_date))
+            return {row['timetable_id']: row['status'] for row in cursor.fetchall()}
+
+    except Exception as e:
+        print(f"get_attendance_statuses error: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_lessontimes():
+    """
+    授業時間（時限ごとの開始・終了時刻）の一覧を取得する
+    """
+    conn = db_connect()
+    if not conn:
+        return []
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id, start_time, end_time FROM lessontime ORDER BY id")
+            return cursor.fetchall()
+
+    except Exception as e:
+        print(f"get_lessontimes error: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+# 1文で展開する行数
+EXPAND_CHUNK_SIZE = 500
+
+# 同じクラス・日付・時限で、2つの授業（a, b）の専攻が重なる条件（専攻共通の授業はどの専攻とも重なる）
+SLOT_MAJOR_CONFLICT = "({a}.major_id <=> {b}.major_id OR {a}.major_id IS NULL OR {b}.major_id IS NULL)"
+
+
+def _rule_scope(class_id=None, department_id=None):
+    """
+    ルールを絞り込む条件と引数（どちらも None なら全クラス）
+    """
+    if class_id is not None:
+        return "r.class_id = %s", (class_id,)
+    if department_id is not None:
+        return "r.class_id IN (SELECT id FROM classes WHERE department_id = %s)", (department_id,)
+    return "TRUE", ()
+
+
+def rule_dates(weekday, start_date, end_date):
+    """
+    start_date〜end_date のうち曜日が weekday（0=月曜）の日付を返す
+    """
+    day = start_date + datetime.timedelta(days=(weekday - start_date.weekday()) % 7)
+    while day <= end_date:
+        yield day
+        day += datetime.timedelta(days=7)
+
+
+def expand_timetable_rules(start_date, end_date, class_id=None, department_id=None):
+    """
+    期間内の繰り返しルールを timetables の行に展開する（上書きで休講の日は作らず、差し替えはその科目・教員で作る）
+    展開済みの (rule_id, date) はそのまま残すので、何度呼んでも結果は同じ
+    戻り値: 新たに作った行数。失敗時は None
+    """
+    conn = db_connect()
+    if not conn:
+        return None
+
+    scope_sql, scope_args = _rule_scope(class_id, department_id)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id, class_id, major_id, weekday, period, subject_id, teacher_id, start_date, end_date
+                FROM timetable_rules r
+                WHERE {scope_sql}
+                AND r.start_date <= %s
+                AND r.end_date >= %s
+                """,
+                (*scope_args, end_date, start_date),
+            )
+            rules = cursor.fetchall()
+            if not rules:
+                return 0
+
+            cursor.execute(
+                f"""
+                SELECT o.rule_id, o.date, o.cancelled, o.subject_id, o.teacher_id
+                FROM timetable_overrides o
+                JOIN timetable_rules r ON r.id = o.rule_id
+                WHERE {scope_sql}
+                AND o.date BETWEEN %s AND %s
+                """,
+                (*scope_args, start_date, end_date),
+            )
+            overrides = {(row['rule_id'], row['date']): row for row in cursor.fetchall()}
+
+            # 同じコマ（クラス・日付・時限・専攻）には1件だけ作る
+            slots = {}
+            for rule in rules:
+                first, last = max(rule['start_date'], start_date), min(rule['end_date'], end_date)
+                for day in rule_dates(rule['weekday'], first, last):
+                    override = overrides.get((rule['id'], day))
+                    if override and override['cancelled']:
+                        continue
+                    slots.setdefault((rule['class_id'], day, rule['period'], rule['major_id']), (
+                        rule['class_id'], rule['major_id'], day, rule['period'],
+                        (override and override['subject_id']) or rule['subject_id'],
+                        (override and override['teacher_id']) or rule['teacher_id'],
+                        rule['id'],
+                    ))
+            rows = list(slots.values())
+            if not rows:
+                return 0
+
+            # 既に授業があるコマ（取り込んだ行・初期データ・展開済みの行）には作らない
+            inserted = 0
+            for i in range(0, len(rows), EXPAND_CHUNK_SIZE):
+                chunk = rows[i:i + EXPAND_CHUNK_SIZE]
+                values = " UNION ALL ".join([
+                    "SELECT %s AS class_id, %s AS major_id, %s AS date, %s AS period,"
+                    " %s AS subject_id, %s AS teacher_id, %s AS rule_id"
+                ] * len(chunk))
+                inserted += cursor.execute(
+                    f"""
+                    INSERT INTO timetables (class_id, major_id, date, period, subject_id, teacher_id, rule_id)
+                    SELECT j.class_id, j.major_id, j.date, j.period, j.subject_id, j.teacher_id, j.rule_id
+                    FROM ({values}) AS j
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM timetables e
+                        WHERE e.class_id = j.class_id AND e.date = j.date AND e.period = j.period
+                        AND {SLOT_MAJOR_CONFLICT.format(a="e", b="j")}
+                    )
+                    ON DUPLICATE KEY UPDATE id = timetables.id
+                    """,
+                    [value for row in chunk for value in row],
+                )
+            conn.commit()
+            return inserted
+
+    except Exception as e:
+        print(f"expand_timetable_rules error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def get_timetable_rules(class_id):
+    """
+    クラスの繰り返しルールの一覧を取得する
+    """
+    conn = db_connect()
+    if not conn:
+        return []
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT r.id, r.class_id, r.major_id, r.weekday, r.period, r.subject_id, s.name AS subject_name,
+                    r.teacher_id, u.full_name AS teacher_name, r.start_date, r.end_date
+                FROM timetable_rules r
+                LEFT JOIN subjects s ON r.subject_id = s.id
+                LEFT JOIN teacher_users u ON r.teacher_id = u.user_id
+                WHERE r.class_id = %s
+                ORDER BY r.weekday, r.period, r.start_date
+                """,
+                (class_id,),
+            )
+            return cursor.fetchall()
+
+    except Exception as e:
+        print(f"get_timetable_rules error: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def get_timetable_rule(rule_id):
+    """
+    繰り返しルールを1件取得する（なければ None）
+    """
+    conn = db_connect()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT * FROM timetable_rules WHERE id = %s", (rule_id,))
+            return cursor.fetchone()
+
+    except Exception as e:
+        print(f"get_timetable_rule error: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def create_timetable_rule(class_id, major_id, weekday, period, subject_id, teacher_id, start_date, end_date):
+    """
+    繰り返しルールを登録する
+    同じクラス・曜日・時限で期間と専攻が重なるルールがあれば登録しない
+    戻り値: 登録したルールの id / 重なるルールがある場合は "OVERLAP"。失敗時は None
+    """
+    conn = db_connect()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            # 重なりうるルールの範囲をロックして、同時に登録された重なるルールも防ぐ
+            cursor.execute(
+                """
+                SELECT r.id FROM timetable_rules r
+                WHERE r.class_id = %s AND r.weekday = %s AND r.period = %s
+                AND r.start_date <= %s AND r.end_date >= %s
+                AND (r.major_id <=> %s OR r.major_id IS NULL OR %s IS NULL)
+                LIMIT 1
+                FOR UPDATE
+                """,
+                (class_id, weekday, period, end_date, start_date, major_id, major_id),
+            )
+            if cursor.fetchone():
+                conn.rollback()
+                return "OVERLAP"
+
+            cursor.execute(
+                """
+                INSERT INTO timetable_rules
+                    (class_id, major_id, weekday, period, subject_id, teacher_id, start_date, end_date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (class_id, major_id, weekday, period, subject_id, teacher_id, start_date, end_date),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    except Exception as e:
+        print(f"create_timetable_rule error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def end_timetable_rule(rule_id, end_date):
+    """
+    ルールの最終日を end_date にする（恒久的な変更は、古いルールを終わらせて新しいルールを登録する）
+    end_date より後に展開済みの行は、出席記録がなければ削除する
+    期間の延長は他のルールとの重なりを確認できないので、今の最終日より後にはしない
+    戻り値: 削除した行数。失敗時は None
+    """
+    conn = db_connect()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE timetable_rules SET end_date = LEAST(end_date, %s) WHERE id = %s", (end_date, rule_id))
+            deleted = cursor.execute(
+                """
+                DELETE t FROM timetables t
+                LEFT JOIN attendance a ON a.timetable_id = t.id
+                WHERE t.rule_id = %s
+                AND t.date > %s
+                AND a.id IS NULL
+                """,
+                (rule_id, end_date),
+            )
+            conn.commit()
+            return deleted
+
+    except Exception as e:
+        print(f"end_timetable_rule error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
+def set_timetable_override(rule_id, date, cancelled=False, subject_id=None, teacher_id=None):
+    """
+    ルールの特定の日を休講にするか、科目・教員を差し替える（展開済みの行にも反映する）
+    出席記録のある行の科目を変える場合は attendance_counters も同じトランザクションで移す
+    戻り値: "SUCCESS" / 休講にする日に出席記録がある場合は "HAS_ATTENDANCE"。失敗時は None
+    """
+    # db_attendance は時間割キャッシュ経由でこのモジュールを読み込むので、ここで読み込む
+    from app.utility.db.db_attendance import move_attendance_counters
+
+    conn = db_connect()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            if cancelled:
+                cursor.execute(
+                    """
+                    SELECT 1 FROM timetables t
+                    JOIN attendance a ON a.timetable_id = t.id
+                    WHERE t.rule_id = %s AND t.date = %s
+                    LIMIT 1
+                    """,
+                    (rule_id, date),
+                )
+                if cursor.fetchone():
+                    return "HAS_ATTENDANCE"
+
+            cursor.execute(
+                """
+                INSERT INTO timetable_overrides (rule_id, date, cancelled, subject_id, teacher_id)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    cancelled = VALUES(cancelled),
+                    subject_id = VALUES(subject_id),
+                    teacher_id = VALUES(teacher_id)
+                """,
+                (rule_id, date, cancelled, subject_id, teacher_id),
+            )
+
+            if cancelled:
+                cursor.execute("DELETE FROM timetables WHERE rule_id = %s AND date = %s", (rule_id, date))
+            else:
+                # 展開済みの行に出席記録があれば、集計を新しい科目へ移してから差し替える
+                cursor.execute(
+                    """
+                    SELECT t.id, COALESCE(%s, r.subject_id) AS subject_id
+                    FROM timetables t
+                    JOIN timetable_rules r ON r.id = t.rule_id
+                    WHERE t.rule_id = %s AND t.date = %s
+                    FOR UPDATE
+                    """,
+                    (subject_id, rule_id, date),
+                )
+                slot = cursor.fetchone()
+                if slot:
+                    move_attendance_counters(cursor, {slot['id']: slot['subject_id']})
+                cursor.execute(
+                    """
+                    UPDATE timetables t
+                    JOIN timetable_rules r ON r.id = t.rule_id
+                    SET t.subject_id = COALESCE(%s, r.subject_id),
+                        t.teacher_id = COALESCE(%s, r.teacher_id)
+                    WHERE t.rule_id = %s AND t.date = %s
+                    """,
+                    (subject_id, teacher_id, rule_id, date),
+                )
+            conn.commit()
+            return "SUCCESS"
+
+    except Exception as e:
+        print(f"set_timetable_override error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
@@ -1,4 +1,24 @@
-from app.utility.db.db_connect import db_connect
+from app.utility.db.db_connect import db_connect, read_only
+from app.utility.cache import shared_versions
+from app.utility.cache.ttl_cache import TTLCache
+from app.core.config import Config
+
+# google_sub -> 学生情報（認証付きエンドポイントごとの問い合わせを省く）
+student_info_cache = TTLCache(
+    maxsize=Config.STUDENT_INFO_CACHE_SIZE,
+    ttl=Config.STUDENT_INFO_CACHE_TTL
+)
+# 他のプロセスが専攻を変更したら破棄する
+shared_versions.on_change("student_info", student_info_cache.clear)
+
+def invalidate_student_info(google_sub=None, user_id=None):
+    """
+    学生情報キャッシュを破棄する（google_sub または user_id で指定）
+    """
+    if google_sub is not None:
+        student_info_cache.invalidate(google_sub)
+    if user_id is not None:
+        student_info_cache.invalidate_where(lambda key, info: str(info['user_id']) == str(user_id))
 
 def exists_student_user(google_sub):
     try:
@@ -75,6 +95,7 @@ def regist_student_user(user_id, email, google_sub, admission_year, full_name, c
         with conn.cursor() as cursor:
             cursor.execute(sql, (user_id, email, google_sub, admission_year, full_name, class_id))
             conn.commit() # コミットが必要
+            invalidate_student_info(google_sub=google_sub)
             return True
     except Exception as e:
         print(f"regist_student_user エラー: {e}", flush=True)
@@ -88,7 +109,14 @@ def regist_student_user(user_id, email, google_sub, admission_year, full_name, c
 def get_student_info(google_sub):
     """
     Google Sub IDから学生情報を取得する
+    一定時間キャッシュし、登録・専攻変更時に破棄する（専攻変更は他のプロセスのキャッシュも破棄する）
     """
+    shared_versions.sync()
+    cached = student_info_cache.get(google_sub)
+    if cached is not None:
+        return dict(cached)
+
+    conn = None
     try:
         conn = db_connect()
         sql = """
@@ -99,7 +127,10 @@ def get_student_info(google_sub):
         """
         with conn.cursor() as cursor:
             cursor.execute(sql, (google_sub,))
-            return cursor.fetchone()
+            info = cursor.fetchone()
+            if info:
+                student_info_cache.set(google_sub, dict(info))
+            return info
     except Exception as e:
         print(f"get_student_info error: {e}")
         return None
@@ -161,6 +192,11 @@ def get_user_cards(user_id):
         print(f"get_user_cards エラー: {e}", flush=True)
         return []
 
+    finally:
+        if conn:
+            conn.close()
+
+@read_only()
 def get_available_majors(department_id):
     try:
         conn = db_connect()
@@ -182,6 +218,8 @@ def update_student_major(user_id, major_id):
         with conn.cursor() as cursor:
             cursor.execute(sql, (major_id, user_id))
             conn.commit()
+            invalidate_student_info(user_id=user_id)
+            shared_versions.bump("student_info")
             return True
     except Exception as e:
         print(f"update_student_major error: {e}", flush=True)
@@ -0,0 +1,263 @@
+"""
+app/utility/db の各関数が発行するクエリを EXPLAIN し、
+全件走査（type=ALL）になっていないか確認する。
+インデックスの候補があってもオプティマイザーが全件走査を選んだ場合も検出する。
+意図した全件走査は build_checks のテーブル指定（と SMALL_TABLES）で明示的に許可する。
+
+シード済みのローカルMySQLに対して `flask explain-check` で実行する。
+書き込みを伴う関数も実行するが、commit は無効化し最後にロールバックする。
+"""
+import datetime
+
+import app.utility.db.db_attendance as db_attendance
+import app.utility.db.db_cache_version as db_cache_version
+import app.utility.db.db_chat as db_chat
+import app.utility.db.db_class as db_class
+import app.utility.db.db_entry as db_entry
+import app.utility.db.db_faq as db_faq
+import app.utility.db.db_notification as db_notification
+import app.utility.db.db_timetable as db_timetable
+import app.utility.db.db_user as db_user
+from app.utility.cache.entry_index import entry_index
+from app.utility.cache.faq_index import faq_index
+from app.utility.db.db_connect import get_pool
+
+DB_MODULES = [db_attendance, db_cache_version, db_chat, db_class, db_entry, db_faq, db_notification, db_timetable, db_user]
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# 行数が少なく、どのクエリから全件走査してもよいテーブル
+SMALL_TABLES = ("lessontime", "cache_versions")
+
+
+class ExplainingCursor:
+    """
+    execute のたびに同じ文を EXPLAIN してから実行するカーソル
+    """
+
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def _explain(self, sql, args):
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return
+        with self._conn.raw.cursor() as cursor:
+            cursor.execute("EXPLAIN " + sql, args)
+            self._conn.plans.append((" ".join(sql.split()), cursor.fetchall()))
+
+    def execute(self, sql, args=None):
+        self._explain(sql, args)
+        return self._cursor.execute(sql, args)
+
+    def executemany(self, sql, args):
+        args = list(args)
+        if args:
+            self._explain(sql, args[0])
+        return self._cursor.executemany(sql, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ExplainingConnection:
+    """
+    プールの接続をラップし、コミットせずに返却時ロールバックする
+    """
+
+    def __init__(self, pooled, plans):
+        self._pooled = pooled
+        self.plans = plans
+
+    @property
+    def raw(self):
+        return self._pooled.raw
+
+    def cursor(self, *args, **kwargs):
+        return ExplainingCursor(self, self._pooled.cursor(*args, **kwargs))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._pooled.rollback()
+
+    def close(self):
+        self._pooled.rollback()
+        self._pooled.close()
+
+
+def find_full_scans(plan_rows, allowed_tables=()):
+    """
+    全件走査（type=ALL）の行を返す
+    派生テーブル・JSON_TABLE の行と、SMALL_TABLES・allowed_tables のテーブルは除く
+    """
+    scans = []
+    for row in plan_rows:
+        table = row.get("table") or ""
+        if table.startswith("<") or table in SMALL_TABLES or table in allowed_tables:
+            continue
+        if "Table function" in (row.get("Extra") or ""):
+            continue
+        if row.get("type") == "ALL":
+            scans.append(row)
+    return scans
+
+
+def _sample(sql):
+    conn = get_pool().acquire()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone() or {}
+    finally:
+        conn.close()
+
+
+def _refresh_faq_incremental():
+    """
+    同期間隔を待たずに差分同期の経路を通す
+    """
+    faq_index.checked_at = 0.0
+    return db_faq.refresh_faq_index()
+
+
+def _export_class_attendance(class_id, start, end):
+    """
+    ストリーミング出力のイテレーターを最後まで読む
+    """
+    return list(db_attendance.stream_class_attendance(class_id, start, end) or [])
+
+
+def build_checks():
+    """
+    (名前, 関数, 引数, 全件走査を許可するテーブル) のリストを作る
+    引数はシード済みDBから実在する値を拾う
+    """
+    student = _sample("""
+        SELECT s.user_id, s.google_sub, s.email, s.class_id, s.major_id, c.department_id
+        FROM student_users s JOIN classes c ON s.class_id = c.id LIMIT 1
+    """)
+    timetable = _sample(
+        "SELECT id, class_id, major_id, date, period, subject_id, teacher_id FROM timetables ORDER BY date DESC LIMIT 1"
+    )
+    rule = _sample("SELECT id FROM timetable_rules LIMIT 1")
+    card = _sample("SELECT felica_idm FROM user_cards LIMIT 1")
+
+    user_id = student.get("user_id", 0)
+    google_sub = student.get("google_sub", "")
+    timetable_id = timetable.get("id", 0)
+    date = timetable.get("date") or datetime.date.today()
+    start = date - datetime.timedelta(days=date.weekday())
+    end = start + datetime.timedelta(days=6)
+    idm = card.get("felica_idm", "0000000000000000")
+
+    return [
+        ("db_user.exists_student_user", db_user.exists_student_user, (google_sub,), ()),
+        ("db_user.exists_teacher_user", db_user.exists_teacher_user, ("nobody@example.com", google_sub), ()),
+        ("db_user.get_student_info", db_user.get_student_info, (google_sub,), ()),
+        ("db_user.register_user_card", db_user.register_user_card, (user_id, idm), ()),
+        ("db_user.get_user_cards", db_user.get_user_cards, (user_id,), ()),
+        ("db_user.get_available_majors", db_user.get_available_majors, (student.get("department_id", 0),), ()),
+        ("db_user.update_student_major", db_user.update_student_major, (user_id, student.get("major_id")), ()),
+        ("db_class.get_class_data", db_class.get_class_data, (student.get("department_id", 0), 1), ()),
+        ("db_class.get_majors_by_department", db_class.get_majors_by_department, (student.get("department_id", 0),), ()),
+        ("db_entry.warm_entry_index", db_entry.warm_entry_index, (), ()),
+        ("db_entry.add_entry_log", db_entry.add_entry_log, (idm,), ()),
+        ("db_entry.check_recent_entry", db_entry.check_recent_entry, (idm,), ()),
+        ("db_entry.get_device_high_water_mark", db_entry.get_device_high_water_mark, ("explain",), ()),
+        ("db_entry.sync_device_entries", db_entry.sync_device_entries,
+            ("explain", [(1, idm, datetime.datetime.now().replace(microsecond=0))]), ()),
+        ("db_entry.get_recent_entry_for_user", db_entry.get_recent_entry_for_user, (user_id, timetable_id), ()),
+        ("db_timetable.get_timetable", db_timetable.get_timetable,
+            (timetable.get("class_id", 0), timetable.get("major_id"), start, end, user_id), ()),
+        ("db_timetable.get_timetable_by_id", db_timetable.get_timetable_by_id, (timetable_id,), ()),
+        ("db_timetable.get_attendance_statuses", db_timetable.get_attendance_statuses, (user_id, start, end), ()),
+        ("db_timetable.expand_timetable_rules (class)", db_timetable.expand_timetable_rules,
+            (start, end, timetable.get("class_id", 0)), ()),
+        ("db_timetable.expand_timetable_rules (department)", db_timetable.expand_timetable_rules,
+            (start, end, None, student.get("department_id", 0)), ()),
+        ("db_timetable.get_timetable_rules", db_timetable.get_timetable_rules, (timetable.get("class_id", 0),), ()),
+        ("db_timetable.get_timetable_rule", db_timetable.get_timetable_rule, (rule.get("id", 0),), ()),
+        ("db_timetable.create_timetable_rule", db_timetable.create_timetable_rule,
+            (timetable.get("class_id", 0), None, date.weekday(), timetable.get("period", 1),
+             timetable.get("subject_id", 0), timetable.get("teacher_id", 0), start, end), ()),
+        ("db_timetable.end_timetable_rule", db_timetable.end_timetable_rule, (rule.get("id", 0), start), ()),
+        ("db_timetable.set_timetable_override", db_timetable.set_timetable_override,
+            (rule.get("id", 0), date, True), ()),
+        ("db_cache_version.get_cache_versions", db_cache_version.get_cache_versions, (), ()),
+        ("db_cache_version.bump_cache_version", db_cache_version.bump_cache_version, ("timetables",), ()),
+        ("db_timetable.get_lessontimes", db_timetable.get_lessontimes, (), ()),
+        ("db_attendance.register_attendance", db_attendance.register_attendance, (user_id, timetable_id), ()),
+        ("db_attendance.update_attendance_status", db_attendance.update_attendance_status,
+            (user_id, timetable_id, "遅刻", "explain"), ()),
+        ("db_attendance.bulk_update_attendance", db_attendance.bulk_update_attendance,
+            ([(user_id, timetable_id, "公欠", None)],), ()),
+        ("db_attendance.close_out_absentees", db_attendance.close_out_absentees,
+            (date, timetable.get("period", 1)), ()),
+        ("db_attendance.get_attendance_summary", db_attendance.get_attendance_summary, (user_id,), ()),
+        ("db_attendance.get_subject_attendance_summary", db_attendance.get_subject_attendance_summary, (user_id,), ()),
+        ("db_attendance.stream_class_attendance", _export_class_attendance,
+            (timetable.get("class_id", 0), start, end), ()),
+        ("db_attendance.get_term_attendance_counts (class)", db_attendance.get_term_attendance_counts,
+            (start, end, timetable.get("class_id", 0)), ()),
+        ("db_attendance.get_term_attendance_counts (department)", db_attendance.get_term_attendance_counts,
+            (start, end, None, student.get("department_id", 0)), ()),
+        ("db_attendance.get_recent_attendance_history", db_attendance.get_recent_attendance_history, (user_id,), ()),
+        ("db_chat.add_chat_log", db_chat.add_chat_log, (user_id, "explain", "explain"), ()),
+        ("db_chat.get_recent_chat_answers", db_chat.get_recent_chat_answers, (), ()),
+        ("db_faq.refresh_faq_index", db_faq.refresh_faq_index, (True,), ("faq",)),
+        ("db_faq.refresh_faq_index (incremental)", _refresh_faq_incremental, (), ()),
+        ("db_notification.notify_users", db_notification.notify_users, ([user_id], "イベント", "explain"), ()),
+        ("db_notification.notify_classes", db_notification.notify_classes,
+            ([student.get("class_id", 0)], "授業変更", "explain"), ()),
+        ("db_notification.notify_department", db_notification.notify_department,
+            (student.get("department_id", 0), "イベント", "explain"), ()),
+        ("db_notification.get_unread_notifications", db_notification.get_unread_notifications, (user_id,), ()),
+        ("db_notification.get_unread_count", db_notification.get_unread_count, (user_id,), ()),
+        ("db_notification.mark_notifications_read", db_notification.mark_notifications_read, (user_id,), ()),
+    ]
+
+
+def run_checks(checks=None):
+    """
+    各関数を EXPLAIN 付きで実行し、[(名前, 発行した文の数, 全件走査のリスト)] を返す
+    """
+    checks = build_checks() if checks is None else checks
+    results = []
+    originals = {module: module.db_connect for module in DB_MODULES}
+
+    try:
+        for name, func, args, allowed_tables in checks:
+            plans = []
+
+            def explaining_connect():
+                return ExplainingConnection(get_pool().acquire(), plans)
+
+            for module in DB_MODULES:
+                module.db_connect = explaining_connect
+            # キャッシュ・索引に当たるとクエリが発行されないので空にしておく
+            db_user.student_info_cache.clear()
+            db_notification.unread_count_cache.clear()
+            entry_index.clear()
+
+            func(*args)
+
+            scans = []
+            for sql, rows in plans:
+                for row in find_full_scans(rows, allowed_tables):
+                    scans.append((sql, row))
+            results.append((name, len(plans), scans))
+    finally:
+        for module, original in originals.items():
+            module.db_connect = original
+        db_user.student_info_cache.clear()
+        entry_index.clear()
+
+    return results
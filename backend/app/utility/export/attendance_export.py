@@ -0,0 +1,116 @@
+"""
+出席エクスポートの書き出し（CSV / Parquet）。
+
+どちらも行のイテレーターを chunk_rows 行ずつ読み、書き出したバイト列をその都度返すジェネレーターで、
+全件をメモリに載せない。Parquet は pyarrow がインストールされている場合のみ使える。
+"""
+import csv
+import datetime
+import io
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(rows, columns, chunk_rows=500):
+    """
+    行（dict）をCSVのバイト列にして chunk_rows 行ごとに返す
+    Excel で文字化けしないよう UTF-8 の BOM を付ける
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_cell(row[column]) for column in columns])
+        if i % chunk_rows == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    ParquetWriter の書き込み先。書かれたバイト列をためておき、drain() で取り出す
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _parquet_schema(pa):
+    return pa.schema([
+        ("date", pa.date32()),
+        ("period", pa.int32()),
+        ("subject", pa.string()),
+        ("teacher", pa.string()),
+        ("user_id", pa.int64()),
+        ("full_name", pa.string()),
+        ("major_id", pa.int64()),
+        ("status", pa.string()),
+        ("reason", pa.string()),
+        ("marked_at", pa.timestamp("s")),
+    ])
+
+
+def parquet_chunks(rows, chunk_rows=500):
+    """
+    行（dict）を Parquet にして、chunk_rows 行（1 row group）ごとに書き出したバイト列を返す
+    フッターは最後のチャンクに含まれる
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+                yield sink.drain()
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    finally:
+        writer.close()
+    yield sink.drain()
@@ -0,0 +1,379 @@
+"""
+時間割の一括取り込み（CSV / XLSX / Google スプレッドシートのCSVエクスポート）。
+
+1行1コマの表を読み込み、科目・教員・時限・専攻・クラスを pandas でまとめて検証してから、
+取り込み範囲（ファイル内のクラスごとに、そのクラスの最初の日付〜最後の日付）の既存の timetables と突き合わせ、
+差分（追加・変更・削除）だけを1トランザクションで反映する。
+出席記録のある時間割の科目を変えた場合は、attendance_counters も同じトランザクションで新しい科目へ移す。
+繰り返しルールから展開済みのコマと重なる行は、ルールの授業と同じ内容なら変更なしとして扱い、違えばエラーにする。
+
+列（ヘッダー名は大文字小文字を区別しない）
+- class    クラスID または classes.class_name
+- major    専攻ID または major.name（クラスの学科内で検索）。空欄は専攻共通
+- date     日付（YYYY-MM-DD など）
+- period   時限（lessontime.id）
+- subject  科目ID または subjects.name
+- teacher  教員の user_id・メールアドレス・氏名のいずれか
+"""
+import io
+import numbers
+import re
+
+import pandas as pd
+
+from app.utility.db.db_connect import db_connect
+from app.utility.db.db_attendance import move_attendance_counters
+from app.utility.cache.timetable_cache import invalidate_weeks
+
+COLUMNS = ["class", "major", "date", "period", "subject", "teacher"]
+REQUIRED_COLUMNS = ["class", "date", "period", "subject", "teacher"]
+
+# 1文あたりの行数（プレースホルダー数が多くなりすぎないように分ける）
+CHUNK_SIZE = 1000
+MAX_ERRORS = 100
+
+_SHEET_URL = re.compile(r"https://docs\.google\.com/spreadsheets/d/([\w-]+)")
+_SHEET_GID = re.compile(r"[#&?]gid=(\d+)")
+
+
+class TimetableImportError(Exception):
+    """
+    取り込む表に不正な行がある（errors に {"row", "column", "message"} のリスト）
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid rows")
+        self.errors = errors
+
+
+def sheet_export_url(url):
+    """
+    Google スプレッドシートの共有URLをCSVエクスポートのURLにする（既にエクスポートURLならそのまま）
+    """
+    match = _SHEET_URL.match(url)
+    if not match:
+        raise ValueError("Google スプレッドシートのURLではありません")
+    if "/export" in url:
+        return url
+    gid = _SHEET_GID.search(url)
+    export = f"https://docs.google.com/spreadsheets/d/{match.group(1)}/export?format=csv"
+    return export + (f"&gid={gid.group(1)}" if gid else "")
+
+
+def read_sheet_frame(url):
+    """
+    Google スプレッドシートをCSVエクスポート経由で DataFrame にする（シートは「リンクを知っている全員」に共有しておく）
+    """
+    return pd.read_csv(sheet_export_url(url), dtype=str, keep_default_na=False)
+
+
+def read_timetable_frame(source, filename=None):
+    """
+    CSV / XLSX のファイル（パス・バイト列・ファイルオブジェクト）を DataFrame にする
+    値はすべて文字列のまま読み、変換は validate_timetable_frame で行う
+    """
+    name = (filename or (source if isinstance(source, str) else "")).lower()
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    if name.endswith((".xlsx", ".xlsm")):
+        return pd.read_excel(source, dtype=str, keep_default_na=False)
+    return pd.read_csv(source, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+
+
+def _fetch_reference(cursor):
+    """
+    検証に使う参照データ（クラス・専攻・科目・教員・時限）を DataFrame で取得する
+    """
+    frames = {}
+    queries = {
+        "classes": "SELECT id AS class_id, department_id, class_name FROM classes",
+        "majors": "SELECT id AS major_id, department_id, name AS major_name FROM major",
+        "subjects": "SELECT id AS subject_id, name AS subject_name FROM subjects",
+        "teachers": "SELECT user_id AS teacher_id, email, full_name FROM teacher_users",
+        "periods": "SELECT id AS period FROM lessontime",
+    }
+    for key, sql in queries.items():
+        cursor.execute(sql)
+        frames[key] = pd.DataFrame(cursor.fetchall(), columns=[c[0] for c in cursor.description])
+    return frames
+
+
+def _resolve(values, by_id, by_name):
+    """
+    ID（数字）か名前の列を ID の列にする。見つからなければ NA
+    by_id: 有効なIDの集合 / by_name: 名前 -> ID の Series（重複する名前は除いておく）
+    """
+    numeric = pd.to_numeric(values, errors="coerce")
+    ids = numeric.where(numeric.isin(by_id))
+    named = values.map(by_name)
+    return ids.fillna(named).astype("Int64")
+
+
+def _unique_names(frame, name_column, id_column):
+    """
+    名前 -> ID の対応を作る（同名が複数あるものは曖昧なので使わない）
+    """
+    names = frame[[name_column, id_column]].dropna()
+    names = names[~names[name_column].duplicated(keep=False)]
+    return pd.Series(names[id_column].values, index=names[name_column].values)
+
+
+def validate_timetable_frame(frame, reference):
+    """
+    表を検証して timetables の列（class_id, major_id, date, period, subject_id, teacher_id）に変換する
+    不正な行があれば TimetableImportError を送出する
+    """
+    frame = frame.rename(columns=lambda c: str(c).strip().lower())
+    missing = [c for c in REQUIRED_COLUMNS if c not in frame.columns]
+    if missing:
+        raise TimetableImportError([{"row": None, "column": c, "message": "列がありません"} for c in missing])
+    if "major" not in frame.columns:
+        frame["major"] = ""
+    frame = frame[COLUMNS].apply(lambda s: s.astype(str).str.strip())
+    # 完全な空行（Excel の末尾など）は無視する
+    frame = frame[(frame != "").any(axis=1)]
+
+    classes, majors = reference["classes"], reference["majors"]
+    subjects, teachers = reference["subjects"], reference["teachers"]
+
+    out = pd.DataFrame(index=frame.index)
+    out["class_id"] = _resolve(frame["class"], classes["class_id"], _unique_names(classes, "class_name", "class_id"))
+    out["date"] = pd.to_datetime(frame["date"], errors="coerce", format="mixed").dt.date
+    out["period"] = pd.to_numeric(frame["period"], errors="coerce").astype("Int64")
+    out["subject_id"] = _resolve(
+        frame["subject"], subjects["subject_id"], _unique_names(subjects, "subject_name", "subject_id")
+    )
+    teacher_names = pd.concat([
+        _unique_names(teachers, "email", "teacher_id"),
+        _unique_names(teachers, "full_name", "teacher_id"),
+    ])
+    out["teacher_id"] = _resolve(frame["teacher"], teachers["teacher_id"], teacher_names[~teacher_names.index.duplicated()])
+
+    # 専攻はクラスの学科の中で名前を引く
+    department = out["class_id"].map(classes.set_index("class_id")["department_id"])
+    major_ids = pd.to_numeric(frame["major"], errors="coerce")
+    major_department = major_ids.map(majors.set_index("major_id")["department_id"])
+    by_name = majors.set_index(["department_id", "major_name"])["major_id"]
+    by_name = by_name[~by_name.index.duplicated(keep=False)]
+    named = pd.Series(
+        by_name.reindex(pd.MultiIndex.from_arrays([department, frame["major"]])).values, index=frame.index
+    )
+    out["major_id"] = major_ids.where(major_department == department).fillna(named).astype("Int64")
+
+    checks = [
+        ("class", out["class_id"].isna(), "クラスが見つかりません"),
+        ("date", out["date"].isna(), "日付を読めません"),
+        ("period", ~out["period"].isin(reference["periods"]["period"]), "時限が lessontime にありません"),
+        ("subject", out["subject_id"].isna(), "科目が見つからないか、同名の科目が複数あります"),
+        ("teacher", out["teacher_id"].isna(), "教員が見つからないか、同名の教員が複数います"),
+        ("major", (frame["major"] != "") & out["major_id"].isna(), "クラスの学科にその専攻がありません"),
+    ]
+    key = ["class_id", "date", "period", "major_id"]
+    checks.append(("date", out.duplicated(key, keep=False) & out[key[:3]].notna().all(axis=1), "同じクラス・日付・時限・専攻の行が重複しています"))
+
+    errors = []
+    for column, mask, message in checks:
+        for index in mask[mask.fillna(False)].index:
+            # 行番号はヘッダーを1行目とした表上の位置
+            errors.append({"row": int(index) + 2, "column": column, "message": message})
+    if errors:
+        errors.sort(key=lambda e: (e["row"], e["column"]))
+        raise TimetableImportError(errors[:MAX_ERRORS])
+
+    return out[["class_id", "major_id", "date", "period", "subject_id", "teacher_id"]].reset_index(drop=True)
+
+
+def diff_timetables(incoming, existing, delete_missing=True):
+    """
+    取り込む行と既存行を (class_id, date, period, major_id) で突き合わせる
+    戻り値: (追加する行の DataFrame, 変更する行の DataFrame（id・変更前の subject_id_old 付き）, 削除する id のリスト,
+            変更なしの件数)
+    """
+    key = ["class_id", "date", "period", "major_key"]
+    incoming = incoming.assign(major_key=incoming["major_id"].fillna(0))
+    existing = existing.assign(major_key=existing["major_id"].fillna(0))
+    merged = incoming.merge(
+        existing[["id", *key, "subject_id", "teacher_id"]], on=key, how="outer",
+        suffixes=("", "_old"), indicator=True,
+    )
+
+    inserts = merged[merged["_merge"] == "left_only"]
+    both = merged[merged["_merge"] == "both"]
+    changed = both[(both["subject_id"] != both["subject_id_old"]) | (both["teacher_id"] != both["teacher_id_old"])]
+    deletes = merged.loc[merged["_merge"] == "right_only", "id"].astype(int).tolist() if delete_missing else []
+
+    return (
+        inserts[["class_id", "major_id", "date", "period", "subject_id", "teacher_id"]],
+        changed[["id", "subject_id", "teacher_id", "subject_id_old"]],
+        deletes,
+        len(both) - len(changed),
+    )
+
+
+def split_rule_slots(incoming, rule_rows):
+    """
+    取り込む行のうち、繰り返しルールから展開済みの行とコマが重なるものを分ける
+    (class_id, date, period) が同じで、専攻が同じか一方が専攻共通なら重なる（db_timetable.SLOT_MAJOR_CONFLICT と同じ条件）
+    戻り値: (重ならない行, ルールの授業と同じ内容の行数, 内容が違う（取り込めない）行の DataFrame)
+    """
+    slot = ["class_id", "date", "period"]
+    # merge で失う元の行番号を index 列に残して突き合わせる
+    merged = incoming.reset_index().merge(
+        rule_rows[[*slot, "major_id", "subject_id", "teacher_id"]], on=slot, how="inner", suffixes=("", "_rule"),
+    )
+    overlap = (
+        merged["major_id"].isna() | merged["major_id_rule"].isna() | (merged["major_id"] == merged["major_id_rule"])
+    ).fillna(False).astype(bool)
+    merged = merged[overlap]
+    same = (
+        (merged["major_id"].fillna(0) == merged["major_id_rule"].fillna(0))
+        & (merged["subject_id"] == merged["subject_id_rule"])
+        & (merged["teacher_id"] == merged["teacher_id_rule"])
+    ).astype(bool)
+    # 1行が複数のルール行と重なる場合は、すべてと同じ内容のときだけ変更なし
+    all_same = same.groupby(merged["index"]).all()
+
+    return (
+        incoming.drop(index=all_same.index),
+        int(all_same.sum()),
+        incoming.loc[all_same.index[~all_same.values]],
+    )
+
+
+def _rows(frame):
+    """
+    DataFrame の行を PyMySQL に渡せるタプル（NA は None、numpy の整数は int）にする
+    """
+    return [
+        tuple(None if pd.isna(v) else (int(v) if isinstance(v, numbers.Number) else v) for v in row)
+        for row in frame.itertuples(index=False, name=None)
+    ]
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def import_timetables(frame, delete_missing=True, dry_run=False):
+    """
+    表を検証し、既存の時間割との差分を1トランザクションで反映する
+    delete_missing: 取り込み範囲（クラスごとの最初〜最後の日付）にあって表にない既存の時間割を削除する
+    dry_run: 差分を数えるだけで反映しない
+    戻り値: {"inserted", "updated", "deleted", "unchanged", "classes", "start_date", "end_date"}
+    表に不正な行があれば TimetableImportError、DBのエラーはそのまま送出する
+    """
+    conn = db_connect()
+    if not conn:
+        raise ConnectionError("データベースに接続できません")
+
+    try:
+        with conn.cursor() as cursor:
+            incoming = validate_timetable_frame(frame, _fetch_reference(cursor))
+            if incoming.empty:
+                raise TimetableImportError([{"row": None, "column": None, "message": "取り込む行がありません"}])
+
+            class_ids = sorted(int(c) for c in incoming["class_id"].unique())
+            start_date, end_date = incoming["date"].min(), incoming["date"].max()
+            # 範囲はクラスごとに取る（あるクラスの1週間分の修正で、他のクラスの期間を消さないように）
+            ranges = incoming.groupby("class_id")["date"].agg(["min", "max"])
+            scope = [(int(class_id), row["min"], row["max"]) for class_id, row in ranges.iterrows()]
+
+            # 取り込み範囲の既存行をロックして取得する（並行する取り込み・ルールの展開と食い違わないように）
+            cursor.execute(
+                f"""
+                SELECT id, class_id, major_id, date, period, subject_id, teacher_id, rule_id
+                FROM timetables
+                WHERE ({' OR '.join(['(class_id = %s AND date BETWEEN %s AND %s)'] * len(scope))})
+                FOR UPDATE
+                """,
+                [v for item in scope for v in item],
+            )
+            existing = pd.DataFrame(
+                cursor.fetchall(),
+                columns=["id", "class_id", "major_id", "date", "period", "subject_id", "teacher_id", "rule_id"],
+            ).astype({"major_id": "Int64"})
+
+            # 繰り返しルールから展開した行は差分の対象にしない（ルールの変更は end_timetable_rule / 上書きで行う）
+            # そのコマに別の授業を追加すると同じコマに2つの授業ができるので、内容が違う行はエラーにする
+            from_rules = existing["rule_id"].notna()
+            incoming, rule_unchanged, conflicts = split_rule_slots(incoming, existing[from_rules])
+            if not conflicts.empty:
+                raise TimetableImportError([
+                    {
+                        "row": None,
+                        "column": "period",
+                        "message": (
+                            f"繰り返しルールの授業と重なります (class_id={row.class_id}, date={row.date}, "
+                            f"period={row.period})。休講・差し替えはルールの上書きで行ってください"
+                        ),
+                    }
+                    for row in conflicts.head(MAX_ERRORS).itertuples()
+                ])
+
+            inserts, updates, deletes, unchanged = diff_timetables(incoming, existing[~from_rules], delete_missing)
+            unchanged += rule_unchanged
+
+            if deletes:
+                # 出席記録が付いた時間割は消せない（記録ごと消えてしまう）
+                cursor.execute(
+                    f"SELECT DISTINCT timetable_id FROM attendance WHERE timetable_id IN ({', '.join(['%s'] * len(deletes))})",
+                    deletes,
+                )
+                referenced = sorted(row["timetable_id"] for row in cursor.fetchall())
+                if referenced:
+                    raise TimetableImportError([
+                        {"row": None, "column": None, "message": f"出席記録のある時間割は削除できません (id={i})"}
+                        for i in referenced[:MAX_ERRORS]
+                    ])
+
+            if not dry_run:
+                for chunk in _chunks(deletes):
+                    cursor.execute(f"DELETE FROM timetables WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+                for chunk in _chunks(_rows(updates)):
+                    # 出席の集計（ユーザー×科目）を旧科目から新科目へ移してから科目を変える
+                    move_attendance_counters(cursor, {row[0]: row[1] for row in chunk if row[1] != row[3]})
+                    cursor.execute(
+                        f"""
+                        UPDATE timetables
+                        SET subject_id = CASE id {' '.join(['WHEN %s THEN %s'] * len(chunk))} END,
+                            teacher_id = CASE id {' '.join(['WHEN %s THEN %s'] * len(chunk))} END
+                        WHERE id IN ({', '.join(['%s'] * len(chunk))})
+                        """,
+                        [v for row in chunk for v in (row[0], row[1])]
+                        + [v for row in chunk for v in (row[0], row[2])]
+                        + [row[0] for row in chunk],
+                    )
+
+                insert_sql = """
+                    INSERT INTO timetables (class_id, major_id, date, period, subject_id, teacher_id)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """
+                for chunk in _chunks(_rows(inserts)):
+                    # PyMySQL は INSERT ... VALUES の executemany を1文の複数行INSERTにまとめる
+                    cursor.executemany(insert_sql, chunk)
+
+                conn.commit()
+            else:
+                conn.rollback()
+
+        if not dry_run and (len(inserts) or len(updates) or deletes):
+            invalidate_weeks()
+
+        return {
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "deleted": len(deletes),
+            "unchanged": unchanged,
+            "classes": class_ids,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+        }
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        conn.close()
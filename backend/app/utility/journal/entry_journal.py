@@ -0,0 +1,321 @@
+"""
+入構ログの書き込みを後回しにするジャーナル（ENTRY_WRITE_MODE=journal のときに使う）。
+
+record_entry はローカルの追記専用ファイルに1行書いて即座に応答し、
+バックグラウンドのライターが ENTRY_JOURNAL_FLUSH_SECONDS ごとに entry_logs へ複数行INSERTでまとめて書き込む。
+
+ファイル構成（ENTRY_JOURNAL_DIR）
+- <pid>.lock     プロセスが生きている間 flock で保持する
+- <pid>-<n>.log  追記中・未反映のセグメント（1行1件の JSON）
+ライターは追記先を次のセグメントに切り替えてから古いセグメントを反映し、成功したら削除する。
+接続以外の理由（不正なデータなど）で反映できないセグメントは <pid>-<n>.bad に改名して隔離し、後続を止めない。
+起動時には、ロックを取れた（持ち主のプロセスが終了している）<pid>.lock のセグメントを引き取って反映する。
+
+反映は「同じ IDm・同じ日の記録がなければ挿入」で行うので、同じセグメントを2度反映しても重複しない。
+"""
+import atexit
+import datetime
+import glob
+import json
+import os
+import threading
+
+import pymysql
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from app.core.config import Config
+from app.utility.cache.entry_index import entry_index
+from app.utility.db.db_connect import db_connect
+from app.utility.db.db_entry import warm_entry_index
+
+_start_lock = threading.Lock()
+
+# 待てば反映できる失敗（DBに接続できない・接続が切れた・ロック待ち）。これ以外はセグメントを隔離する
+RETRYABLE_ERRORS = (ConnectionError, pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+
+def valid_idm(felica_idm):
+    """
+    entry_logs.felica_idm（VARCHAR(16)）に入る IDm か
+    """
+    return isinstance(felica_idm, str) and 0 < len(felica_idm) <= 16
+
+
+def _insert_batch(records):
+    """
+    (felica_idm, entered_at) のリストを1文で entry_logs に挿入する
+    同じ IDm・同じ日の記録が既にあるものは挿入しない
+    戻り値: 挿入した件数。失敗時は例外を送出する
+    """
+    # 同じバッチ内の同じ IDm・同じ日は最初の1件だけにする
+    first = {}
+    for idm, entered_at in records:
+        key = (idm, entered_at.date())
+        if key not in first or entered_at < first[key]:
+            first[key] = entered_at
+    rows = [(idm, entered_at) for (idm, _), entered_at in first.items()]
+    if not rows:
+        return 0
+
+    values = " UNION ALL ".join(["SELECT %s AS felica_idm, %s AS entered_at"] * len(rows))
+    sql = f"""
+        INSERT INTO entry_logs (felica_idm, entered_at)
+        SELECT j.felica_idm, j.entered_at
+        FROM ({values}) AS j
+        WHERE NOT EXISTS (
+            SELECT 1 FROM entry_logs e
+            WHERE e.felica_idm = j.felica_idm
+            AND e.entered_at >= DATE(j.entered_at)
+            AND e.entered_at < DATE(j.entered_at) + INTERVAL 1 DAY
+        )
+    """
+    conn = db_connect()
+    if not conn:
+        raise ConnectionError("データベースに接続できません")
+    try:
+        with conn.cursor() as cursor:
+            inserted = cursor.execute(sql, [value for row in rows for value in row])
+        conn.commit()
+        return inserted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+class EntryJournal:
+
+    def __init__(self, directory, flush_seconds=1.0, batch_size=500, fsync=True):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock_file = None
+        self._segment = None
+        self._segment_no = 0
+        self._pending = 0
+        self._stats = {"appended": 0, "flushed": 0, "inserted": 0, "flush_errors": 0, "replayed_segments": 0,
+                       "quarantined_segments": 0}
+
+    # --- ファイル ---
+
+    def _segment_path(self, pid, number):
+        return os.path.join(self.directory, f"{pid}-{number:06d}.log")
+
+    def _segments(self, pid):
+        return sorted(glob.glob(os.path.join(self.directory, f"{pid}-*.log")))
+
+    def _open_segment(self):
+        self._segment_no += 1
+        self._segment = open(self._segment_path(self._pid, self._segment_no), "a", encoding="utf-8")
+
+    def start(self):
+        """
+        このプロセスのジャーナルを開き、終了済みプロセスのセグメントを引き取ってライターを起動する
+        fork 後の子プロセスでは親の状態を捨てて開き直す
+        """
+        with _start_lock:
+            if self._pid == os.getpid():
+                return
+            self._lock = threading.Lock()
+            self._wake = threading.Event()
+            self._stop = threading.Event()
+            self._pending = 0
+            os.makedirs(self.directory, exist_ok=True)
+
+            pid = os.getpid()
+            self._lock_file = open(os.path.join(self.directory, f"{pid}.lock"), "a")
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            existing = self._segments(pid)
+            self._segment_no = int(os.path.basename(existing[-1]).split("-")[1].split(".")[0]) if existing else 0
+            self._pid = pid
+            self._open_segment()
+
+            self._adopt_orphans()
+            self._thread = threading.Thread(target=self._run, name="entry-journal-writer", daemon=True)
+            self._thread.start()
+
+    def _adopt_orphans(self):
+        """
+        終了したプロセスのセグメントを、このプロセスのセグメントとして引き取る
+        """
+        for lock_path in glob.glob(os.path.join(self.directory, "*.lock")):
+            pid = os.path.basename(lock_path).split(".")[0]
+            if pid == str(self._pid):
+                continue
+            handle = open(lock_path, "a")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue  # まだ動いているプロセス
+            try:
+                for path in self._segments(pid):
+                    with self._lock:
+                        self._segment_no += 1
+                        os.replace(path, self._segment_path(self._pid, self._segment_no))
+                    self._stats["replayed_segments"] += 1
+                os.remove(lock_path)
+            finally:
+                handle.close()
+
+    # --- 追記 ---
+
+    def append(self, felica_idm, entered_at=None):
+        """
+        1件追記する（DBには書かない）
+        """
+        if not valid_idm(felica_idm):
+            raise ValueError(f"invalid IDm: {felica_idm!r}")
+        if self._pid != os.getpid():
+            self.start()
+        entered_at = entered_at or entry_index.now()
+        line = json.dumps({"idm": felica_idm, "at": entered_at.isoformat(timespec="seconds")}) + "\n"
+        with self._lock:
+            self._segment.write(line)
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+            self._pending += 1
+            self._stats["appended"] += 1
+            pending = self._pending
+        if pending >= self.batch_size:
+            self._wake.set()
+        return entered_at
+
+    # --- 反映 ---
+
+    def _rotate(self):
+        """
+        追記先を新しいセグメントに切り替える（空なら切り替えない）
+        """
+        with self._lock:
+            if self._pending == 0:
+                return
+            self._segment.close()
+            self._open_segment()
+            self._pending = 0
+
+    @staticmethod
+    def _read(path):
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                    record = (item["idm"], datetime.datetime.fromisoformat(item["at"]))
+                except (ValueError, KeyError, TypeError):
+                    # クラッシュで途中までしか書かれなかった行は捨てる
+                    continue
+                if valid_idm(record[0]):
+                    records.append(record)
+        return records
+
+    def flush(self):
+        """
+        追記中以外のセグメントを entry_logs に反映する
+        戻り値: 挿入した件数
+        """
+        self._rotate()
+        with self._lock:
+            active = self._segment.name
+        inserted = 0
+        for path in self._segments(self._pid):
+            if path == active:
+                continue
+            records = self._read(path)
+            try:
+                for i in range(0, len(records), self.batch_size):
+                    inserted += _insert_batch(records[i:i + self.batch_size])
+            except RETRYABLE_ERRORS as e:
+                self._stats["flush_errors"] += 1
+                print(f"entry journal 反映エラー: {e}", flush=True)
+                break  # 残りは次回に再試行する（順序を保つ）
+            except Exception as e:
+                # 何度やり直しても失敗するので、隔離して後続のセグメントを反映する
+                self._stats["flush_errors"] += 1
+                self._stats["quarantined_segments"] += 1
+                os.replace(path, path[:-len(".log")] + ".bad")
+                print(f"entry journal セグメントを隔離しました {os.path.basename(path)}: {e}", flush=True)
+                continue
+            os.remove(path)
+            self._stats["flushed"] += len(records)
+        self._stats["inserted"] += inserted
+        return inserted
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"entry journal ライターエラー: {e}", flush=True)
+
+    def stop(self):
+        """
+        ライターを止め、残りを反映する（プロセス終了時）
+        """
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=self.flush_seconds + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"entry journal 終了時の反映エラー: {e}", flush=True)
+
+        # すべて反映できていれば空の追記先とロックファイルを片付ける
+        with self._lock:
+            self._segment.close()
+            if os.path.getsize(self._segment.name) == 0 and len(self._segments(self._pid)) == 1:
+                os.remove(self._segment.name)
+                os.remove(self._lock_file.name)
+            self._lock_file.close()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["pending"] = self._pending
+        return stats
+
+
+entry_journal = EntryJournal(
+    Config.ENTRY_JOURNAL_DIR,
+    flush_seconds=Config.ENTRY_JOURNAL_FLUSH_SECONDS,
+    batch_size=Config.ENTRY_JOURNAL_BATCH_SIZE,
+    fsync=Config.ENTRY_JOURNAL_FSYNC,
+)
+atexit.register(entry_journal.stop)
+
+
+def record_entry(felica_idm):
+    """
+    ジャーナル経由で入構を記録する（当日記録済みなら何もしない）
+    """
+    if not entry_index.warmed:
+        warm_entry_index()
+    if entry_index.entered_today(felica_idm):
+        return True
+
+    try:
+        entered_at = entry_journal.append(felica_idm)
+    except Exception as e:
+        print(f"entry journal 追記エラー: {e}", flush=True)
+        return False
+
+    entry_index.record(felica_idm, entered_at)
+    return True
@@ -0,0 +1,125 @@
+"""
+出席率の計算と、出席不足のおそれがある学生のレポート。
+
+出席率 = (記録のある授業 − 公欠 − 欠席) / (記録のある授業 − 公欠) × 100
+（遅刻・早退は出席扱い。ATTENDANCE_LATE_PER_ABSENCE を設定すると、遅刻・早退その回数ごとに欠席1回として数える）
+公欠だけの場合は 100%、記録がなければ 0%（レポートでは None）。
+
+残り欠席可能回数は、期間内の全授業（これからの授業を含む）で出席率が threshold を下回らない欠席の上限から、
+これまでの欠席を引いた回数。
+"""
+import pandas as pd
+
+from app.core.config import Config
+
+COUNT_COLUMNS = ["present", "absent", "late", "early", "public_absent"]
+
+
+def attendance_rate(total, absent, public_absent, late=0, early=0):
+    """
+    1人分の出席率（%、小数第1位まで）を返す
+    """
+    absent = absent + _late_absences(late + early)
+    denom = total - public_absent
+    if denom > 0:
+        return round((denom - absent) / denom * 100, 1)
+    if total > 0:
+        # すべて公欠なら無断欠席はないので 100% とする
+        return 100.0
+    return 0.0
+
+
+def _late_absences(late_and_early):
+    """
+    遅刻・早退を欠席に換算した回数（換算しない設定なら 0）
+    """
+    per_absence = Config.ATTENDANCE_LATE_PER_ABSENCE
+    if per_absence <= 0:
+        return late_and_early * 0
+    return late_and_early // per_absence
+
+
+def _add_rates(frame, threshold):
+    """
+    件数の列（present など・scheduled・remaining）から出席率と残り欠席可能回数の列を追加する
+    """
+    recorded = frame[COUNT_COLUMNS].sum(axis=1)
+    effective_absent = frame["absent"] + _late_absences(frame["late"] + frame["early"])
+    denom = recorded - frame["public_absent"]
+
+    rate = ((denom - effective_absent) / denom.where(denom > 0) * 100).round(1)
+    frame["attendance_rate"] = rate.where(denom > 0, pd.Series(100.0, index=frame.index).where(recorded > 0))
+    frame["effective_absent"] = effective_absent
+
+    # 期末まで公欠が増えないと仮定したときの欠席上限
+    planned = frame["scheduled"] - frame["public_absent"]
+    allowed = (planned * (100 - threshold) // 100).astype("int64")
+    frame["remaining_allowance"] = allowed - effective_absent
+    return frame
+
+
+def build_at_risk_report(rows, threshold=None, allowance_margin=None):
+    """
+    get_term_attendance_counts の行（学生×科目）から、出席不足のおそれがある学生の一覧を作る
+    対象: 全体か科目の出席率が threshold 未満、または科目の残り欠席可能回数が allowance_margin 以下の学生
+    戻り値: 全体の出席率の低い順の学生のリスト（subjects には該当する科目だけを入れる）
+    """
+    threshold = Config.AT_RISK_THRESHOLD if threshold is None else threshold
+    allowance_margin = Config.AT_RISK_ALLOWANCE_MARGIN if allowance_margin is None else allowance_margin
+
+    if not rows:
+        return []
+    subjects = pd.DataFrame(rows)
+    numeric = COUNT_COLUMNS + ["scheduled", "remaining"]
+    subjects[numeric] = subjects[numeric].astype("int64")
+
+    subjects = _add_rates(subjects, threshold)
+    subjects["at_risk"] = (subjects["attendance_rate"] < threshold) | (subjects["remaining_allowance"] <= allowance_margin)
+
+    students = subjects.groupby(["user_id", "full_name", "class_id"], as_index=False)[numeric].sum()
+    students = _add_rates(students, threshold)
+    flagged_subjects = subjects[subjects["at_risk"]]
+
+    at_risk = students[
+        (students["attendance_rate"] < threshold) | students["user_id"].isin(flagged_subjects["user_id"])
+    ].sort_values(["attendance_rate", "user_id"], na_position="last")
+
+    subject_columns = [
+        "subject_id", "subject_name", "attendance_rate", *COUNT_COLUMNS,
+        "scheduled", "remaining", "remaining_allowance",
+    ]
+    by_student = {
+        user_id: group.sort_values("remaining_allowance")[subject_columns]
+        for user_id, group in flagged_subjects.groupby("user_id")
+    }
+
+    report = []
+    for student in at_risk.to_dict("records"):
+        group = by_student.get(student["user_id"])
+        report.append({
+            "user_id": int(student["user_id"]),
+            "full_name": student["full_name"],
+            "class_id": int(student["class_id"]),
+            "attendance_rate": _number(student["attendance_rate"]),
+            **{column: int(student[column]) for column in COUNT_COLUMNS},
+            "scheduled": int(student["scheduled"]),
+            "remaining": int(student["remaining"]),
+            "subjects": [
+                {key: _number(value) for key, value in subject.items()}
+                for subject in (group.to_dict("records") if group is not None else [])
+            ],
+        })
+    return report
+
+
+def _number(value):
+    """
+    numpy の数値を JSON にできる値にする（NaN は None）
+    """
+    if isinstance(value, str):
+        return value
+    if pd.isna(value):
+        return None
+    if float(value).is_integer() and not isinstance(value, float):
+        return int(value)
+    return float(value)
@@ -0,0 +1,59 @@
+"""
+gunicorn の設定（serve.py 用）
+
+- WEB_CONCURRENCY: ワーカープロセス数（省略時は SOCKETIO_MESSAGE_QUEUE があれば CPU コア数 x 2 + 1、なければ 1）
+- WEB_WORKER_CLASS: gthread（スレッド）または eventlet（グリーンスレッド、WebSocket 向け）
+- WEB_THREADS: gthread の1ワーカーあたりのスレッド数（DATABASE_POOL_SIZE 以下にする）
+- WEB_WORKER_CONNECTIONS: eventlet の1ワーカーあたりの同時接続数
+- WEB_TIMEOUT: 応答のないワーカーを再起動するまでの秒数
+- WEB_MAX_REQUESTS: この件数を処理したワーカーを入れ替える（0 なら無効）
+
+Socket.IO（/live）の制約
+- gthread では WebSocket が使えず long-polling になる。polling は同じワーカーに届き続ける必要があるが、
+  gunicorn はワーカーへの振り分けを固定できないので、gthread は1ワーカーでしか動かない
+- 複数ワーカーにするには eventlet と SOCKETIO_MESSAGE_QUEUE（他のワーカーの emit を受け取る）を設定し、
+  クライアントは transports: ["websocket"] で接続する（接続が1本のワーカーに留まる）
+- polling も使うなら、1ワーカーのコンテナを複数並べ、前段のロードバランサーでスティッキーセッションにする
+条件を満たさない設定では起動時にエラーにする
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("WEB_BIND", "0.0.0.0:5000")
+wsgi_app = "serve:app"
+
+message_queue = os.environ.get("SOCKETIO_MESSAGE_QUEUE")
+workers = int(os.environ.get("WEB_CONCURRENCY") or (multiprocessing.cpu_count() * 2 + 1 if message_queue else 1))
+worker_class = os.environ.get("WEB_WORKER_CLASS", "gthread")
+if workers > 1 and (worker_class != "eventlet" or not message_queue):
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} では Socket.IO のイベントが届きません。"
+        "複数ワーカーには WEB_WORKER_CLASS=eventlet と SOCKETIO_MESSAGE_QUEUE が必要です"
+        "（または WEB_CONCURRENCY=1）"
+    )
+if worker_class != "eventlet":
+    print("gunicorn: gthread ワーカーでは Socket.IO は long-polling のみで動きます（WebSocket は eventlet）", flush=True)
+if worker_class == "eventlet":
+    # preload_app ではマスターがアプリを import するので、その前にパッチを当てておく
+    import eventlet
+    eventlet.monkey_patch()
+    os.environ.setdefault("SOCKETIO_ASYNC_MODE", "eventlet")
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_connections = int(os.environ.get("WEB_WORKER_CONNECTIONS", 200))
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+graceful_timeout = timeout
+keepalive = 5
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+# マスターでアプリを1度だけ読み込み、ワーカーはそれを fork して使う
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    # fork 後のワーカー初期化の最後に呼ばれる。ここで接続プール・キャッシュを作り直す
+    from app.core.prefork import run_post_fork_hooks
+    run_post_fork_hooks(worker.wsgi)
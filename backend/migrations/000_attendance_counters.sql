@@ -0,0 +1,16 @@
+-- 出席集計（ユーザー×教科ごとのステータス件数）
+-- attendance への登録・更新と同じトランザクションで増減させる
+-- 既存の出席データからの集計は、重複を削除したあとに 001_query_indexes.sql で作る
+CREATE TABLE IF NOT EXISTS attendance_counters (
+    user_id INT NOT NULL,
+    subject_id INT NOT NULL,
+    present INT NOT NULL DEFAULT 0,
+    absent INT NOT NULL DEFAULT 0,
+    late INT NOT NULL DEFAULT 0,
+    early INT NOT NULL DEFAULT 0,
+    public_absent INT NOT NULL DEFAULT 0,
+    total INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, subject_id),
+    FOREIGN KEY (user_id) REFERENCES student_users(user_id),
+    FOREIGN KEY (subject_id) REFERENCES subjects(id)
+);
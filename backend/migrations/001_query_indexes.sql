@@ -0,0 +1,45 @@
+-- 各 db_* モジュールのクエリに合わせた複合・ユニークインデックス
+
+-- 時間割: get_timetable は class_id + 日付範囲 + 専攻で絞り、日付・時限順に並べる
+ALTER TABLE timetables
+    ADD INDEX idx_class_date_period (class_id, date, period, major_id),
+    ADD INDEX idx_date_period (date, period);
+
+-- 出席: (user_id, timetable_id) で1件に決まるので重複を禁止する
+-- 既に重複がある場合は最新の1件だけを残す
+DELETE a_old FROM attendance a_old
+JOIN attendance a_new
+    ON a_old.user_id = a_new.user_id
+    AND a_old.timetable_id = a_new.timetable_id
+    AND a_old.id < a_new.id;
+
+ALTER TABLE attendance
+    ADD UNIQUE INDEX uq_user_timetable (user_id, timetable_id);
+
+-- user_id 単独のインデックスは uq_user_timetable の先頭列で代用できる
+ALTER TABLE attendance
+    DROP INDEX idx_user_id;
+
+-- 重複を削除した分、集計を作り直す
+REPLACE INTO attendance_counters (user_id, subject_id, present, absent, late, early, public_absent, total)
+SELECT
+    a.user_id,
+    t.subject_id,
+    SUM(CASE WHEN a.status = '出席' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.status = '欠席' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.status = '遅刻' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.status = '早退' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.status = '公欠' THEN 1 ELSE 0 END),
+    COUNT(*)
+FROM attendance a
+JOIN timetables t ON a.timetable_id = t.id
+GROUP BY a.user_id, t.subject_id;
+
+-- 入構記録: felica_idm で絞って entered_at の範囲・最新を引く
+ALTER TABLE entry_logs
+    ADD INDEX idx_felica_entered (felica_idm, entered_at),
+    DROP INDEX idx_felica_idm;
+
+-- 専攻: get_majors_by_department / get_available_majors
+ALTER TABLE major
+    ADD INDEX idx_department_id (department_id);
@@ -0,0 +1,3 @@
+-- 通知: 未読一覧（user_id + is_read、id の降順でページング）と未読件数をインデックスだけで返す
+ALTER TABLE notifications
+    ADD INDEX idx_user_unread (user_id, is_read, id);
@@ -0,0 +1,3 @@
+-- FAQ: 検索索引の差分同期（updated_at が新しい行だけ取得）で全件走査しない
+ALTER TABLE faq
+    ADD INDEX idx_updated_at (updated_at);
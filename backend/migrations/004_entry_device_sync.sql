@@ -0,0 +1,10 @@
+-- 入構端末の一括同期: 端末ごとの反映済み連番（high-water mark）と、記録がどの端末のどの連番から来たか
+CREATE TABLE IF NOT EXISTS entry_devices (
+    device_id VARCHAR(50) PRIMARY KEY,
+    last_sequence BIGINT NOT NULL DEFAULT 0,
+    last_synced_at DATETIME NULL
+);
+
+ALTER TABLE entry_logs
+    ADD COLUMN device_seq BIGINT NULL AFTER device_id,
+    ADD UNIQUE INDEX uq_device_seq (device_id, device_seq);
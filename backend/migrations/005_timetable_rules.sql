@@ -0,0 +1,39 @@
+-- 時間割の繰り返しルール（クラス・専攻・曜日・時限ごと、期間付き）と日付ごとの上書き
+-- ルールは時間割を表示する週と締め処理の当日だけ timetables の行に展開する（出席は展開した行の id に付く）
+CREATE TABLE IF NOT EXISTS timetable_rules (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    class_id INT NOT NULL,
+    major_id INT,
+    weekday TINYINT NOT NULL,
+    period INT NOT NULL,
+    subject_id INT NOT NULL,
+    teacher_id INT NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    INDEX idx_class_term (class_id, start_date, end_date),
+    INDEX idx_term (start_date, end_date),
+    CONSTRAINT fk_timetable_rules_class FOREIGN KEY (class_id) REFERENCES classes(id),
+    CONSTRAINT fk_timetable_rules_subject FOREIGN KEY (subject_id) REFERENCES subjects(id),
+    CONSTRAINT fk_timetable_rules_teacher FOREIGN KEY (teacher_id) REFERENCES teacher_users(user_id),
+    CHECK (weekday BETWEEN 0 AND 6),
+    CHECK (period BETWEEN 1 AND 7)
+);
+
+-- 休講（cancelled）または科目・教員の差し替え（NULL の列はルールの値を使う）
+CREATE TABLE IF NOT EXISTS timetable_overrides (
+    rule_id INT NOT NULL,
+    date DATE NOT NULL,
+    cancelled BOOLEAN NOT NULL DEFAULT FALSE,
+    subject_id INT,
+    teacher_id INT,
+    PRIMARY KEY (rule_id, date),
+    CONSTRAINT fk_timetable_overrides_rule FOREIGN KEY (rule_id) REFERENCES timetable_rules(id),
+    CONSTRAINT fk_timetable_overrides_subject FOREIGN KEY (subject_id) REFERENCES subjects(id),
+    CONSTRAINT fk_timetable_overrides_teacher FOREIGN KEY (teacher_id) REFERENCES teacher_users(user_id)
+);
+
+-- 展開した行はどのルールの何日分かを持つ（同じ日を2回展開しない）
+ALTER TABLE timetables
+    ADD COLUMN rule_id INT NULL,
+    ADD UNIQUE INDEX uq_rule_date (rule_id, date),
+    ADD CONSTRAINT fk_timetables_rule FOREIGN KEY (rule_id) REFERENCES timetable_rules(id);
@@ -0,0 +1,9 @@
+-- プロセスをまたいだキャッシュの破棄: データを変更したプロセスが version を上げ、
+-- 各プロセスは一定間隔で読み比べて、変わっていれば自分のキャッシュを捨てる
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO cache_versions (name) VALUES ('timetables');
@@ -0,0 +1,2 @@
+-- 学生情報キャッシュ（専攻の変更）もプロセスをまたいで破棄する
+INSERT IGNORE INTO cache_versions (name) VALUES ('student_info');
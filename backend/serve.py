@@ -0,0 +1,15 @@
+"""
+本番用のエントリーポイント（開発時は wsgi.py + flask run）
+    gunicorn -c gunicorn.conf.py
+    または python serve.py
+ワーカー数・スレッド数・ワーカー方式は gunicorn.conf.py（WEB_* 環境変数）で設定する
+"""
+from app import create_app
+app = create_app(prefork=True)
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+    os.execvp("gunicorn", ["gunicorn", "-c", config] + sys.argv[1:])
@@ -0,0 +1,19 @@
+#!/bin/bash
+# 初回起動時に backend/migrations のマイグレーションを適用し、適用済みとして記録する
+# （既存DBには backend で `flask migrate` を実行する）
+MIGRATIONS_DIR=/docker-entrypoint-initdb.d/migrations
+
+if [ -d "$MIGRATIONS_DIR" ]; then
+    docker_process_sql --database="$MYSQL_DATABASE" <<'SQL'
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(255) PRIMARY KEY,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+SQL
+    for f in "$MIGRATIONS_DIR"/*.sql; do
+        [ -e "$f" ] || continue
+        echo "$0: applying migration $(basename "$f")"
+        docker_process_sql --database="$MYSQL_DATABASE" < "$f"
+        echo "INSERT INTO schema_migrations (version) VALUES ('$(basename "$f")');" | docker_process_sql --database="$MYSQL_DATABASE"
+    done
+fi